@@ -0,0 +1,59 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional
+import logging
+
+from services.device_io import PARSERS, export_devices, import_devices
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/v1/devices")
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _format(fmt: Optional[str], content_type: str) -> str:
+    if fmt is None:
+        fmt = "csv" if content_type.startswith("text/csv") else "ndjson"
+    if fmt not in PARSERS:
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    return fmt
+
+
+@router.post("/import")
+async def import_device_rows(
+    request: Request,
+    format: Optional[str] = Query(None),
+    dry_run: bool = Query(False),
+):
+    fmt = _format(format, request.headers.get("content-type", ""))
+    # the body is parsed as it arrives, never held in memory whole
+    result = await import_devices(PARSERS[fmt](request.stream()), dry_run=dry_run)
+
+    if result.error and not result.received:
+        raise HTTPException(status_code=400, detail=result.error)
+    logger.info(
+        "Device import: %d received, %d imported, %d failed%s",
+        result.received,
+        result.imported,
+        result.failed,
+        " (dry run)" if dry_run else "",
+    )
+    return result.as_dict()
+
+
+@router.get("/export")
+async def export_device_rows(
+    format: str = Query("ndjson"),
+    include_credentials: bool = Query(False),
+):
+    fmt = _format(format, "")
+    if include_credentials:
+        logger.warning("Device export including credentials requested")
+    return StreamingResponse(
+        export_devices(fmt, include_credentials),
+        media_type=MEDIA_TYPES[fmt],
+        headers={
+            "Content-Disposition": 'attachment; filename="streaming_devices.%s"' % fmt
+        },
+    )
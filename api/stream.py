@@ -1,49 +1,92 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi.responses import StreamingResponse
-from sqlalchemy import select
+from fastapi import (
+    APIRouter,
+    HTTPException,
+    Query,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.responses import Response, StreamingResponse
+from datetime import datetime
+from typing import List, Optional
 import asyncio
+import base64
+import json
 import logging
+import threading
 import httpx
 
+from core import metrics
+from core.config import settings
 from schemas.streaming import (
+    FrameOutputOptions,
     FrameRequest,
+    CameraFrameResponse,
+    NVRFrameResponse,
+    BatchFrameRequest,
     CapabilitiesRequest,
+    RegistryInvalidateRequest,
 )
-from db.session import get_db
-from models.streaming_device import StreamingDevice
-from services.streaming_service import _grab_frame_blocking
-from services.capabilities_service import (
-    fetch_capabilities_from_onboarding,
-    extract_discovery_response,
+from services.device_registry import device_registry, DeviceRecord
+from services.streaming_service import (
+    _read_frame_pooled,
+    capture_scheduler,
+    CaptureRejected,
+    rtsp_host,
 )
+from services.frame_cache import CachedFrame, frame_cache
+from services.frame_fingerprint import difference, scene_tracker
+from services.frame_transform import DEFAULT_SPEC, FrameSpec, MEDIA_TYPES
+from services.stream_profiles import StreamProfile, select_profiles
+from services.fanout import stream_hub
+from services.frame_history import HistoryFrames, frame_history
+from services.session_pool import PoolExhausted
+from services.shared_frames import SlotsExhausted, shared_frames
+from services.prefetcher import prefetcher
+from services.camera_profiles import profile_store, CameraUnavailable
+from services.capabilities_service import get_discovery
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/v1/stream")
 
+MJPEG_BOUNDARY = "frame"
+BATCH_BOUNDARY = "batch"
+HISTORY_BOUNDARY = "history"
+
+# shared by every batch request so several walls cannot flood the cameras
+_batch_semaphore = asyncio.Semaphore(settings.BATCH_GLOBAL_CONCURRENCY)
 
-# -------------------------------------------------------------------
-# FRAME ENDPOINT
-# -------------------------------------------------------------------
-@router.post("/frame")
-async def get_frame(payload: FrameRequest, db: AsyncSession = Depends(get_db)):
-    stmt = select(StreamingDevice).where(
-        StreamingDevice.device_id == payload.device_id
-    )
-    res = await db.execute(stmt)
-    device = res.scalars().first()
+
+async def _resolve_profiles(
+    device_id: str,
+    device_type: str,
+    camera_id: Optional[str],
+):
+    with metrics.stage("lookup"):
+        device = await device_registry.get(device_id)
 
     if not device:
+        # unknown ids are not used as labels, they could be anything
+        metrics.count_failure("device_not_found")
         raise HTTPException(status_code=404, detail="Device not found")
+    metrics.set_device(device_id)
+
+    return device, _device_profiles(device, device_type, camera_id)
 
-    if payload.device_type not in ("camera", "nvr"):
+
+def _device_profiles(
+    device: DeviceRecord,
+    device_type: str,
+    camera_id: Optional[str],
+) -> List[StreamProfile]:
+    if device_type not in ("camera", "nvr"):
         raise HTTPException(
             status_code=400,
             detail="device_type must be 'camera' or 'nvr'"
         )
 
-    if device.device_type.value != payload.device_type:
+    if device.device_type.value != device_type:
         raise HTTPException(
             status_code=400,
             detail="device_type mismatch with stored device"
@@ -54,110 +97,743 @@ async def get_frame(payload: FrameRequest, db: AsyncSession = Depends(get_db)):
     # ---------------------------------------------------------------
     # CAMERA DEVICE
     # ---------------------------------------------------------------
-    if payload.device_type == "camera":
+    if device_type == "camera":
         if not isinstance(meta, dict):
             raise HTTPException(
                 status_code=400,
                 detail="Invalid meta_data format for camera"
             )
 
-        rtsp = meta.get("rtsp_url")
-        if not rtsp:
+        profiles = device.profiles.get(None)
+        if not profiles:
             raise HTTPException(
                 status_code=400,
                 detail="RTSP url not found in meta_data"
             )
 
+        return profiles
+
+    # ---------------------------------------------------------------
+    # NVR DEVICE
+    # ---------------------------------------------------------------
+    if not camera_id:
+        raise HTTPException(
+            status_code=400,
+            detail="camera_id is required for nvr devices"
+        )
+
+    if not isinstance(meta, list):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid meta_data format for nvr"
+        )
+
+    profiles = device.profiles.get(camera_id)
+    if not profiles:
+        raise HTTPException(
+            status_code=404,
+            detail="RTSP url not found for camera_id in meta_data"
+        )
+
+    return profiles
+
+
+async def _get_source_frame(key, rtsp: str, host: Optional[str], max_age_ms):
+    host = host or rtsp_host(rtsp)
+    prefetcher.record(key, rtsp, host)
+
+    async def grab():
+        # cameras known to be failing are rejected before taking a worker
+        profile_store.check(rtsp)
+        if shared_frames.enabled:
+            # multi-worker mode: read the camera's owner process's frames
+            try:
+                return await shared_frames.read_frame(
+                    key, rtsp, settings.RTSP_GRAB_TIMEOUT_SECONDS
+                )
+            except (SlotsExhausted, PoolExhausted):
+                pass
+        cancel = threading.Event()
         try:
-            loop = asyncio.get_running_loop()
-            jpeg_bytes = await loop.run_in_executor(
-                None, _grab_frame_blocking, rtsp
+            return await capture_scheduler.run(
+                host,
+                _read_frame_pooled,
+                rtsp,
+                settings.RTSP_GRAB_TIMEOUT_SECONDS,
+                cancel,
             )
-        except Exception:
+        except asyncio.CancelledError:
+            # nobody is waiting any more: let the worker thread bail out
+            cancel.set()
+            raise
+
+    return await frame_cache.get_or_grab(key, grab, max_age_ms)
+
+
+async def _until_disconnected(request: Request, aw):
+    """Await aw, abandoning it if the HTTP client goes away first."""
+    task = asyncio.ensure_future(aw)
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                {task}, timeout=settings.CLIENT_DISCONNECT_POLL_SECONDS
+            )
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info("Client disconnected, abandoning %s", request.url.path)
+                metrics.count_failure("client_disconnected")
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+def _capture_rejected(e: CaptureRejected) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Capture capacity exhausted, retry later",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+def _camera_unavailable(e: CameraUnavailable) -> HTTPException:
+    metrics.count_failure("camera_unavailable")
+    return HTTPException(
+        status_code=503,
+        detail="Camera temporarily unavailable",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+def _frame_key(
+    device_id: str,
+    device_type: str,
+    camera_id: Optional[str],
+    profile: StreamProfile,
+):
+    return (device_id, camera_id if device_type == "nvr" else None, profile.name)
+
+
+def _frame_spec(options: FrameOutputOptions) -> FrameSpec:
+    crop = options.crop
+    return FrameSpec(
+        width=options.width,
+        height=options.height,
+        quality=options.quality,
+        format=options.format,
+        crop=(crop.x, crop.y, crop.w, crop.h) if crop is not None else None,
+    )
+
+
+async def _get_source(
+    device: DeviceRecord,
+    device_type: str,
+    camera_id: Optional[str],
+    profiles: List[StreamProfile],
+    max_age_ms,
+    spec: FrameSpec,
+) -> CachedFrame:
+    # cheapest stream that is big enough first; on failure fall back to
+    # the next one rather than failing the request
+    candidates = select_profiles(profiles, spec)
+    for i, profile in enumerate(candidates):
+        key = _frame_key(device.device_id, device_type, camera_id, profile)
+        try:
+            return await _get_source_frame(
+                key, profile.rtsp_url, device.ip, max_age_ms
+            )
+        except CaptureRejected:
+            # out of capacity: another stream would not help
+            raise
+        except Exception as e:
+            if i == len(candidates) - 1:
+                raise
+            logger.warning(
+                "Stream %s of %s failed (%s), falling back to %s",
+                profile.name,
+                key[:2],
+                e,
+                candidates[i + 1].name,
+            )
+
+
+async def _get_encoded(
+    device: DeviceRecord,
+    device_type: str,
+    camera_id: Optional[str],
+    profiles: List[StreamProfile],
+    max_age_ms,
+    spec: FrameSpec,
+) -> bytes:
+    entry = await _get_source(
+        device, device_type, camera_id, profiles, max_age_ms, spec
+    )
+    return await frame_cache.encode(entry, spec)
+
+
+# -------------------------------------------------------------------
+# FRAME ENDPOINT
+# -------------------------------------------------------------------
+def _scene_changed(
+    entry: CachedFrame,
+    known: int,
+    threshold: Optional[float],
+) -> bool:
+    """Whether entry shows a different scene than generation known."""
+    if threshold is None:
+        return entry.generation != known
+
+    reference = scene_tracker.reference(entry.key, known)
+    if reference is None:
+        # the client's picture is too old to compare against
+        return True
+    if difference(entry.fingerprint, reference) <= threshold:
+        return False
+    if entry.generation == known:
+        # changed enough for this client, not for the global threshold
+        entry.generation = scene_tracker.mark_changed(entry.key, entry.fingerprint)
+    return True
+
+
+async def _get_snapshot(
+    payload: FrameRequest,
+    device: DeviceRecord,
+    profiles: List[StreamProfile],
+    spec: FrameSpec,
+    if_none_match: Optional[str],
+):
+    """Return (etag, image bytes), with None bytes when the client's copy is current."""
+    def get_source(max_age_ms):
+        return _get_source(
+            device,
+            payload.device_type,
+            payload.camera_id,
+            profiles,
+            max_age_ms,
+            spec,
+        )
+
+    # the binary image and its base64 JSON wrapper are separate representations
+    variant = (spec, payload.response_format)
+    entry = await get_source(payload.max_age_ms)
+    known = scene_tracker.parse_etag(if_none_match, entry.key, variant)
+    threshold = payload.change_threshold
+
+    if known is not None and payload.wait_for_change:
+        timeout_ms = min(
+            payload.wait_timeout_ms or settings.FRAME_WAIT_MAX_MS,
+            settings.FRAME_WAIT_MAX_MS,
+        )
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout_ms / 1000.0
+        while not _scene_changed(entry, known, threshold):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            # woken early by frames other requests or live viewers grab
+            await scene_tracker.wait(
+                entry.key, min(settings.FRAME_WAIT_POLL_MS / 1000.0, remaining)
+            )
+            entry = await get_source(settings.FRAME_WAIT_POLL_MS)
+
+    if known is not None and not _scene_changed(entry, known, threshold):
+        return scene_tracker.etag(entry.key, known, variant), None
+
+    etag = scene_tracker.etag(entry.key, entry.generation, variant)
+    return etag, await frame_cache.encode(entry, spec)
+
+
+@router.post("/frame")
+async def get_frame(payload: FrameRequest, request: Request, response: Response):
+    device, profiles = await _resolve_profiles(
+        payload.device_id, payload.device_type, payload.camera_id
+    )
+
+    spec = _frame_spec(payload)
+    try:
+        etag, image_bytes = await _until_disconnected(
+            request,
+            _get_snapshot(
+                payload,
+                device,
+                profiles,
+                spec,
+                request.headers.get("if-none-match"),
+            ),
+        )
+    except HTTPException:
+        raise
+    except CaptureRejected as e:
+        raise _capture_rejected(e)
+    except CameraUnavailable as e:
+        raise _camera_unavailable(e)
+    except Exception:
+        metrics.count_failure("rtsp")
+        if payload.device_type == "nvr":
+            logger.exception(
+                "Failed to grab frame for NVR %s camera %s",
+                device.device_id,
+                payload.camera_id
+            )
+        else:
             logger.exception(
                 "Failed to grab frame for camera %s",
                 device.device_id
             )
-            raise HTTPException(
-                status_code=502,
-                detail="Failed to fetch frame from RTSP"
+        raise HTTPException(
+            status_code=502,
+            detail="Failed to fetch frame from RTSP"
+        )
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if image_bytes is None:
+        return Response(status_code=304, headers=headers)
+
+    if payload.response_format == "base64":
+        response.headers.update(headers)
+        frame = base64.b64encode(image_bytes).decode("utf-8")
+        if payload.device_type == "nvr":
+            return NVRFrameResponse(
+                device_id=device.device_id,
+                camera_id=payload.camera_id,
+                frame=frame,
             )
+        return CameraFrameResponse(device_id=device.device_id, frame=frame)
+
+    return Response(
+        content=image_bytes,
+        media_type=MEDIA_TYPES[spec.format],
+        headers=headers,
+    )
+
+
+# -------------------------------------------------------------------
+# BATCH FRAME ENDPOINT
+# -------------------------------------------------------------------
+def _batch_part(
+    device_id: str,
+    camera_id: Optional[str],
+    status: int,
+    body: bytes,
+    content_type: str,
+) -> bytes:
+    headers = (
+        "--%s\r\n"
+        "Content-Type: %s\r\n"
+        "Content-Length: %d\r\n"
+        "X-Device-Id: %s\r\n"
+        "X-Camera-Id: %s\r\n"
+        "X-Status: %d\r\n\r\n"
+    ) % (
+        BATCH_BOUNDARY,
+        content_type,
+        len(body),
+        device_id,
+        camera_id or "",
+        status,
+    )
+    return headers.encode() + body + b"\r\n"
 
-        return StreamingResponse(
-            iter([jpeg_bytes]),
-            media_type="image/jpeg"
+
+@router.post("/frames/batch")
+async def get_frames_batch(payload: BatchFrameRequest):
+    # registry misses are loaded together in a single query
+    with metrics.stage("lookup"):
+        devices = await device_registry.get_many(
+            item.device_id for item in payload.items
         )
 
-    # ---------------------------------------------------------------
-    # NVR DEVICE
-    # ---------------------------------------------------------------
-    if payload.device_type == "nvr":
-        if not payload.camera_id:
-            raise HTTPException(
-                status_code=400,
-                detail="camera_id is required for nvr devices"
+    # expand items into (device_id, camera_id, profiles | error) jobs
+    jobs = []
+    for item in payload.items:
+        device = devices.get(item.device_id)
+        if device is None:
+            metrics.count_failure("device_not_found")
+            jobs.append(
+                (item.device_id, item.camera_id, None, (404, "Device not found"))
             )
+            continue
 
-        if not isinstance(meta, list):
-            raise HTTPException(
-                status_code=400,
-                detail="Invalid meta_data format for nvr"
-            )
+        device_type = device.device_type.value
+        if device_type == "nvr" and item.all_cameras:
+            camera_ids = device.camera_ids
+            if not camera_ids:
+                jobs.append(
+                    (item.device_id, None, None, (404, "No cameras in meta_data"))
+                )
+        else:
+            camera_ids = [item.camera_id]
 
-        rtsp = None
-        for cam in meta:
-            if (
-                isinstance(cam, dict)
-                and cam.get("camera_id") == payload.camera_id
-            ):
-                rtsp = cam.get("rtsp_url")
-                break
+        for camera_id in camera_ids:
+            try:
+                profiles = _device_profiles(device, device_type, camera_id)
+            except HTTPException as e:
+                jobs.append(
+                    (item.device_id, camera_id, None, (e.status_code, e.detail))
+                )
+                continue
+            if device_type != "nvr":
+                camera_id = None
+            jobs.append((item.device_id, camera_id, profiles, None))
 
-        if not rtsp:
-            raise HTTPException(
-                status_code=404,
-                detail="RTSP url not found for camera_id in meta_data"
-            )
+    if len(jobs) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail="Batch expands to %d frames, limit is %d"
+            % (len(jobs), settings.BATCH_MAX_ITEMS)
+        )
+
+    device_semaphores = {
+        device_id: asyncio.Semaphore(settings.BATCH_PER_DEVICE_CONCURRENCY)
+        for device_id in devices
+    }
 
+    spec = _frame_spec(payload)
+    media_type = MEDIA_TYPES[spec.format]
+
+    async def run_job(device_id, camera_id, profiles, error):
+        if error is not None:
+            return device_id, camera_id, None, error
+        device = devices[device_id]
+        # each job runs in its own task, so this only labels its own stages
+        metrics.set_device(device_id)
         try:
-            loop = asyncio.get_running_loop()
-            jpeg_bytes = await loop.run_in_executor(
-                None, _grab_frame_blocking, rtsp
+            async with device_semaphores[device_id], _batch_semaphore:
+                image = await _get_encoded(
+                    device,
+                    device.device_type.value,
+                    camera_id,
+                    profiles,
+                    payload.max_age_ms,
+                    spec,
+                )
+        except CaptureRejected:
+            return (
+                device_id, camera_id, None, (503, "Capture capacity exhausted")
+            )
+        except CameraUnavailable:
+            metrics.count_failure("camera_unavailable")
+            return (
+                device_id, camera_id, None, (503, "Camera temporarily unavailable")
             )
         except Exception:
+            metrics.count_failure("rtsp")
             logger.exception(
-                "Failed to grab frame for NVR %s camera %s",
-                device.device_id,
-                payload.camera_id
+                "Failed to grab batch frame for %s camera %s",
+                device_id,
+                camera_id
             )
-            raise HTTPException(
-                status_code=502,
-                detail="Failed to fetch frame from RTSP"
+            return (
+                device_id, camera_id, None, (502, "Failed to fetch frame from RTSP")
             )
+        return device_id, camera_id, image, None
+
+    multipart = payload.response_format == "multipart"
+
+    def render(device_id, camera_id, image, error) -> bytes:
+        if multipart:
+            if error is None:
+                return _batch_part(device_id, camera_id, 200, image, media_type)
+            body = json.dumps({"detail": error[1]}).encode()
+            return _batch_part(
+                device_id, camera_id, error[0], body, "application/json"
+            )
+
+        entry = {"device_id": device_id, "camera_id": camera_id}
+        if error is None:
+            entry.update(status=200, frame=base64.b64encode(image).decode("utf-8"))
+        else:
+            entry.update(status=error[0], error=error[1])
+        return json.dumps(entry).encode() + b"\n"
+
+    async def results():
+        tasks = [asyncio.ensure_future(run_job(*job)) for job in jobs]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield render(*(await done))
+            if multipart:
+                yield ("--%s--\r\n" % BATCH_BOUNDARY).encode()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    if multipart:
+        response_type = "multipart/mixed; boundary=%s" % BATCH_BOUNDARY
+    else:
+        response_type = "application/x-ndjson"
 
-        return StreamingResponse(
-            iter([jpeg_bytes]),
-            media_type="image/jpeg"
+    return StreamingResponse(results(), media_type=response_type)
+
+
+# -------------------------------------------------------------------
+# LIVE ENDPOINTS (MJPEG / WEBSOCKET)
+# -------------------------------------------------------------------
+async def _resolve_live(
+    device_id: str,
+    device_type: str,
+    camera_id: Optional[str],
+):
+    device, profiles = await _resolve_profiles(device_id, device_type, camera_id)
+    # live views are served full size, so they ride on the biggest stream
+    profile = select_profiles(profiles, DEFAULT_SPEC)[0]
+    key = _frame_key(device.device_id, device_type, camera_id, profile)
+    return key, profile.rtsp_url
+
+
+@router.get("/mjpeg")
+async def live_mjpeg(
+    device_id: str,
+    device_type: str,
+    camera_id: Optional[str] = None,
+    fps: float = Query(
+        settings.STREAM_DEFAULT_FPS, gt=0, le=settings.STREAM_MAX_FPS
+    ),
+):
+    key, rtsp = await _resolve_live(device_id, device_type, camera_id)
+
+    try:
+        sub = stream_hub.subscribe(key, rtsp, fps)
+    except PoolExhausted:
+        raise HTTPException(
+            status_code=503,
+            detail="No RTSP session available for live stream"
         )
 
+    async def parts():
+        try:
+            while True:
+                jpeg = await sub.next_frame()
+                yield (
+                    b"--" + MJPEG_BOUNDARY.encode() + b"\r\n"
+                    b"Content-Type: image/jpeg\r\n"
+                    b"Content-Length: " + str(len(jpeg)).encode() + b"\r\n\r\n"
+                    + jpeg + b"\r\n"
+                )
+        finally:
+            stream_hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        parts(),
+        media_type="multipart/x-mixed-replace; boundary=%s" % MJPEG_BOUNDARY,
+        headers={"Cache-Control": "no-store"},
+    )
+
+
+@router.websocket("/ws")
+async def live_websocket(
+    websocket: WebSocket,
+    device_id: str,
+    device_type: str,
+    camera_id: Optional[str] = None,
+    fps: float = settings.STREAM_DEFAULT_FPS,
+):
+    try:
+        key, rtsp = await _resolve_live(device_id, device_type, camera_id)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=str(e.detail))
+        return
+
+    fps = min(max(fps, 0.1), settings.STREAM_MAX_FPS)
+    await websocket.accept()
+
+    try:
+        sub = stream_hub.subscribe(key, rtsp, fps)
+    except PoolExhausted:
+        await websocket.close(code=1013, reason="No RTSP session available")
+        return
+
+    async def wait_disconnect():
+        while True:
+            msg = await websocket.receive()
+            if msg["type"] == "websocket.disconnect":
+                return
+
+    closed = asyncio.ensure_future(wait_disconnect())
+    try:
+        while not closed.done():
+            next_frame = asyncio.ensure_future(sub.next_frame())
+            await asyncio.wait(
+                {next_frame, closed}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not next_frame.done():
+                next_frame.cancel()
+                break
+            await websocket.send_bytes(next_frame.result())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        closed.cancel()
+        stream_hub.unsubscribe(sub)
+
 
 # -------------------------------------------------------------------
-# CAPABILITIES ENDPOINT (PROXY)
+# FRAME HISTORY
 # -------------------------------------------------------------------
-@router.post("/capabilities")
-async def capabilities_proxy(
-    payload: CapabilitiesRequest,
-    db: AsyncSession = Depends(get_db),
+class _BufferResponse(Response):
+    """Sends its body parts as they are, so mmap'd history frames are not copied."""
+
+    def __init__(
+        self,
+        parts,
+        media_type: str,
+        headers: dict,
+        frames: HistoryFrames,
+    ):
+        self.parts = parts
+        self.frames = frames
+        super().__init__(media_type=media_type, headers=headers)
+        self.headers["content-length"] = str(sum(len(p) for p in parts))
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers,
+                }
+            )
+            last = len(self.parts) - 1
+            for i, part in enumerate(self.parts):
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": part,
+                        "more_body": i < last,
+                    }
+                )
+        finally:
+            self.frames.release()
+
+
+async def _resolve_history(
+    device_id: str,
+    device_type: str,
+    camera_id: Optional[str],
 ):
-    stmt = select(StreamingDevice).where(
-        StreamingDevice.device_id == payload.device_id
+    device, _ = await _resolve_profiles(device_id, device_type, camera_id)
+    key = (device.device_id, camera_id if device_type == "nvr" else None)
+    if key not in frame_history:
+        raise HTTPException(
+            status_code=404,
+            detail="Frame history is not enabled for this camera"
+        )
+    return key
+
+
+@router.get("/history/frame")
+async def history_frame(
+    device_id: str,
+    device_type: str,
+    at: datetime,
+    camera_id: Optional[str] = None,
+):
+    key = await _resolve_history(device_id, device_type, camera_id)
+
+    frames = frame_history.nearest(key, at.timestamp())
+    if frames is None:
+        raise HTTPException(
+            status_code=404, detail="No recorded frames around that time"
+        )
+
+    ts, data = frames.frames[0]
+    return _BufferResponse(
+        [data],
+        media_type="image/jpeg",
+        headers={"X-Frame-Timestamp": "%.3f" % ts},
+        frames=frames,
+    )
+
+
+@router.get("/history/burst")
+async def history_burst(
+    device_id: str,
+    device_type: str,
+    start: datetime,
+    end: datetime,
+    camera_id: Optional[str] = None,
+    limit: int = Query(settings.HISTORY_MAX_BURST_FRAMES, gt=0),
+):
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+
+    key = await _resolve_history(device_id, device_type, camera_id)
+    frames = frame_history.between(
+        key,
+        start.timestamp(),
+        end.timestamp(),
+        min(limit, settings.HISTORY_MAX_BURST_FRAMES),
+    )
+
+    parts = []
+    for ts, data in frames.frames:
+        headers = (
+            "--%s\r\n"
+            "Content-Type: image/jpeg\r\n"
+            "Content-Length: %d\r\n"
+            "X-Frame-Timestamp: %.3f\r\n\r\n"
+        ) % (HISTORY_BOUNDARY, len(data), ts)
+        # frame bytes stay a view into the history store
+        parts.append(headers.encode())
+        parts.append(data)
+        parts.append(b"\r\n")
+    parts.append(("--%s--\r\n" % HISTORY_BOUNDARY).encode())
+
+    return _BufferResponse(
+        parts,
+        media_type="multipart/mixed; boundary=%s" % HISTORY_BOUNDARY,
+        headers={"X-Frame-Count": str(len(frames.frames))},
+        frames=frames,
     )
-    res = await db.execute(stmt)
-    device = res.scalars().first()
+
+
+@router.get("/history")
+async def history_status():
+    return frame_history.stats()
+
+
+# -------------------------------------------------------------------
+# CAPTURE SCHEDULER STATUS
+# -------------------------------------------------------------------
+@router.get("/scheduler")
+async def scheduler_status():
+    return capture_scheduler.stats()
+
+
+@router.get("/prefetch")
+async def prefetch_status():
+    return prefetcher.stats()
+
+
+@router.get("/shared-frames")
+async def shared_frames_status():
+    return shared_frames.stats()
+
+
+# -------------------------------------------------------------------
+# DEVICE REGISTRY INVALIDATION
+# -------------------------------------------------------------------
+@router.post("/registry/invalidate")
+async def invalidate_registry(payload: RegistryInvalidateRequest):
+    device_registry.invalidate(payload.device_ids)
+    return {"cached_devices": len(device_registry)}
+
+
+# -------------------------------------------------------------------
+# CAPABILITIES ENDPOINT (PROXY)
+# -------------------------------------------------------------------
+@router.post("/capabilities")
+async def capabilities_proxy(payload: CapabilitiesRequest):
+    with metrics.stage("lookup"):
+        device = await device_registry.get(payload.device_id)
 
     if not device:
+        metrics.count_failure("device_not_found")
         raise HTTPException(status_code=404, detail="Device not found")
 
+    metrics.set_device(payload.device_id)
+
     if not device.username or not device.password:
         raise HTTPException(
             status_code=400,
@@ -165,11 +841,14 @@ async def capabilities_proxy(
         )
 
     try:
-        onboarding_resp = await fetch_capabilities_from_onboarding(
+        return await get_discovery(
+            payload.device_id,
+            device.device_type.value,
             payload.ip,
             payload.port,
             device.username,
             device.password,
+            refresh=payload.refresh,
         )
     except httpx.RequestError:
         logger.exception(
@@ -189,9 +868,3 @@ async def capabilities_proxy(
             status_code=502,
             detail="Failed to contact device_onboarding service"
         )
-
-    return extract_discovery_response(
-        payload.device_id,
-        device.device_type.value,
-        onboarding_resp,
-    )
@@ -1,7 +1,19 @@
 import logging
 from fastapi import FastAPI
 from api.stream import router as stream_router
+from api.metrics import router as metrics_router
+from api.devices import router as devices_router
+from core.metrics import MetricsMiddleware
 from db.session import init_db
+from services.session_pool import session_pool
+from services.fanout import stream_hub
+from services.streaming_service import capture_scheduler
+from services.device_registry import device_registry
+from services.frame_history import frame_history
+from services.shared_frames import shared_frames
+from services.prefetcher import prefetcher
+from core.config import settings
+from services.capabilities_service import close_client
 
 logger = logging.getLogger("streaming_controller")
 logging.basicConfig(level=logging.INFO)
@@ -11,11 +23,37 @@ def create_app() -> FastAPI:
     app = FastAPI(title="streaming_controller")
 
     app.include_router(stream_router)
+    app.include_router(devices_router)
+    app.include_router(metrics_router)
+    app.add_middleware(MetricsMiddleware)
 
     @app.on_event("startup")
     async def on_startup():
         logger.info("Starting streaming_controller, initializing DB")
         await init_db()
+        await device_registry.start()
+        if settings.SERVICE_WORKERS > 1:
+            # the history index lives in one process and its segment
+            # files cannot be shared between workers
+            logger.warning("Frame history is disabled with multiple workers")
+        else:
+            frame_history.start(settings.HISTORY_SYNC_SECONDS)
+        if settings.SHARED_FRAMES_ENABLED:
+            shared_frames.attach()
+        if settings.PREFETCH_ENABLED:
+            prefetcher.start(settings.PREFETCH_INTERVAL_SECONDS)
+
+    @app.on_event("shutdown")
+    async def on_shutdown():
+        logger.info("Shutting down streaming_controller, closing RTSP sessions")
+        await device_registry.stop()
+        await frame_history.stop()
+        await shared_frames.detach()
+        await prefetcher.stop()
+        stream_hub.shutdown()
+        session_pool.shutdown()
+        capture_scheduler.shutdown()
+        await close_client()
 
     return app
 
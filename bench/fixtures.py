@@ -0,0 +1,201 @@
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import cv2
+import numpy as np
+
+from models.streaming_device import DeviceType, StreamingDevice
+from services.device_registry import DeviceRecord
+
+
+_VideoCapture = cv2.VideoCapture
+
+
+class PacedCapture:
+    """cv2.VideoCapture that plays a video file like a live camera.
+
+    Files otherwise decode as fast as the CPU allows and end, so pooled
+    readers spin and reconnect. Frames are handed out at the clip's own
+    frame rate, and the clip loops instead of reaching EOF.
+    """
+
+    def __init__(self, *args):
+        self._cap = _VideoCapture(*args)
+        fps = self._cap.get(cv2.CAP_PROP_FPS)
+        self._interval = 1.0 / (fps if fps and fps > 0 else 25.0)
+        self._next_due: Optional[float] = None
+
+    def __getattr__(self, name: str):
+        return getattr(self._cap, name)
+
+    def read(self, *args):
+        now = time.monotonic()
+        if self._next_due is None:
+            self._next_due = now
+        else:
+            # never in bursts after a stall
+            self._next_due = max(self._next_due + self._interval, now)
+            time.sleep(self._next_due - now)
+        ret, frame = self._cap.read(*args)
+        if not ret and self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0):
+            ret, frame = self._cap.read(*args)
+        return ret, frame
+
+
+def pace_file_captures() -> None:
+    """Open every capture in this process through PacedCapture."""
+    cv2.VideoCapture = PacedCapture
+
+
+def write_video(path: str, width: int, height: int, frames: int, fps: float = 25) -> str:
+    """Write a synthetic MJPEG clip: a moving gradient with a frame counter."""
+    writer = cv2.VideoWriter(
+        path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height)
+    )
+    if not writer.isOpened():
+        raise RuntimeError("Unable to write synthetic video %s" % path)
+
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    try:
+        for i in range(frames):
+            shift = i * 255.0 / max(frames, 1)
+            frame = np.empty((height, width, 3), dtype=np.uint8)
+            frame[..., 0] = (x + shift) % 256
+            frame[..., 1] = (y + shift) % 256
+            frame[..., 2] = (x + y + 2 * shift) % 256
+            cv2.putText(
+                frame,
+                str(i),
+                (width // 20, height // 2),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                max(height / 180.0, 0.5),
+                (255, 255, 255),
+                2,
+            )
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
+
+
+def build_fleet(
+    directory: str,
+    cameras: int,
+    nvrs: int,
+    channels: int,
+    width: int,
+    height: int,
+    frames: int,
+    sub_stream: bool = True,
+) -> Dict[str, Any]:
+    """Write the synthetic videos and a fleet description to directory.
+
+    Every device gets a distinct file path (hard links to the same clip),
+    so each one is its own pooled session, as separate RTSP URLs would be.
+    NVRs get their own IP so per-host limits apply as they would on site.
+    """
+    os.makedirs(directory, exist_ok=True)
+    main = write_video(os.path.join(directory, "main.avi"), width, height, frames)
+    sub = None
+    if sub_stream:
+        sub = write_video(
+            os.path.join(directory, "sub.avi"),
+            max(width // 4, 16),
+            max(height // 4, 16),
+            frames,
+        )
+
+    def stream_entry(name: str) -> Dict[str, Any]:
+        url = _link(main, directory, name + "-main.avi")
+        entry: Dict[str, Any] = {"rtsp_url": url}
+        if sub is not None:
+            entry["profiles"] = [
+                {"name": "main", "rtsp_url": url, "width": width, "height": height},
+                {
+                    "name": "sub",
+                    "rtsp_url": _link(sub, directory, name + "-sub.avi"),
+                    "width": max(width // 4, 16),
+                    "height": max(height // 4, 16),
+                },
+            ]
+        return entry
+
+    devices: List[Dict[str, Any]] = []
+    for i in range(cameras):
+        device_id = "bench-cam-%d" % i
+        devices.append(
+            {
+                "device_id": device_id,
+                "device_type": "camera",
+                "ip": "10.0.%d.%d" % (i // 250, i % 250 + 1),
+                "port": 554,
+                "username": "bench",
+                "password": "bench",
+                "meta_data": stream_entry(device_id),
+            }
+        )
+    for i in range(nvrs):
+        device_id = "bench-nvr-%d" % i
+        meta = []
+        for c in range(channels):
+            entry = stream_entry("%s-ch%d" % (device_id, c))
+            entry["camera_id"] = "ch%d" % c
+            meta.append(entry)
+        devices.append(
+            {
+                "device_id": device_id,
+                "device_type": "nvr",
+                "ip": "10.1.%d.%d" % (i // 250, i % 250 + 1),
+                "port": 554,
+                "username": "bench",
+                "password": "bench",
+                "meta_data": meta,
+            }
+        )
+
+    fleet = {"devices": devices, "width": width, "height": height}
+    with open(os.path.join(directory, "fleet.json"), "w") as f:
+        json.dump(fleet, f)
+    return fleet
+
+
+def _link(source: str, directory: str, name: str) -> str:
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        os.link(source, path)
+    return path
+
+
+class MemoryDeviceSource:
+    """Device source backed by a fleet file, standing in for Postgres."""
+
+    def __init__(self, devices: Iterable[Dict[str, Any]]):
+        self._devices: Dict[str, StreamingDevice] = {}
+        for row in devices:
+            row = dict(row, device_type=DeviceType(row["device_type"]))
+            self._devices[row["device_id"]] = StreamingDevice(**row)
+
+    @classmethod
+    def from_file(cls, path: str) -> "MemoryDeviceSource":
+        with open(path) as f:
+            return cls(json.load(f)["devices"])
+
+    async def fetch(
+        self,
+        device_ids: Optional[Iterable[str]] = None,
+        limit: Optional[int] = None,
+    ) -> List[DeviceRecord]:
+        ids = list(self._devices if device_ids is None else device_ids)
+        if limit is not None:
+            ids = ids[:limit]
+        return [
+            DeviceRecord.from_model(self._devices[i], "static")
+            for i in ids
+            if i in self._devices
+        ]
+
+    async def fetch_fingerprints(self) -> Dict[str, str]:
+        return {device_id: "static" for device_id in self._devices}
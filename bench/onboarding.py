@@ -0,0 +1,39 @@
+"""Fake device_onboarding service answering capability discovery calls.
+
+Run with ``uvicorn bench.onboarding:app``. BENCH_ONBOARDING_DELAY_MS adds
+a fixed delay per call to stand in for slow ONVIF discovery, and
+BENCH_ONBOARDING_SOURCES sets how many video sources are reported.
+"""
+import asyncio
+import os
+
+from fastapi import FastAPI
+
+DELAY_SECONDS = float(os.getenv("BENCH_ONBOARDING_DELAY_MS", "50")) / 1000.0
+SOURCES = int(os.getenv("BENCH_ONBOARDING_SOURCES", "4"))
+
+app = FastAPI(title="bench_device_onboarding")
+calls = 0
+
+
+@app.post("/api/v1/cameras/capabilities")
+async def capabilities(payload: dict):
+    global calls
+    calls += 1
+    if DELAY_SECONDS:
+        await asyncio.sleep(DELAY_SECONDS)
+    return {
+        "host": payload.get("host"),
+        "data": {
+            "video_sources": {
+                "sources": [
+                    {"token": "VideoSource_%d" % i} for i in range(SOURCES)
+                ]
+            }
+        },
+    }
+
+
+@app.get("/calls")
+async def call_count():
+    return {"calls": calls}
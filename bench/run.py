@@ -0,0 +1,492 @@
+"""Offline load test for the streaming controller.
+
+Writes a synthetic fleet (file-backed video instead of RTSP), starts a
+fake device_onboarding service and the controller in subprocesses, drives
+/frame, NVR channel /frame and /capabilities at a fixed concurrency, and
+saves throughput, latency percentiles, CPU and RSS as JSON.
+
+    python -m bench.run --concurrency 32 --duration 20 --output run.json
+    python -m bench.run --compare run.json --max-regression 10
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from bench.fixtures import build_fleet
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("frame", "nvr", "capabilities")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+# -------------------------------------------------------------------
+# process accounting (/proc)
+# -------------------------------------------------------------------
+def _stat(pid: int) -> Optional[List[str]]:
+    try:
+        with open("/proc/%d/stat" % pid) as f:
+            data = f.read()
+    except OSError:
+        return None
+    # comm may contain spaces; fields after it are space separated
+    return data[data.rindex(")") + 2:].split()
+
+
+def process_tree(root: int) -> List[int]:
+    """root and all of its descendants (uvicorn workers, trackers)."""
+    children: Dict[int, List[int]] = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        fields = _stat(int(name))
+        if fields is not None:
+            children.setdefault(int(fields[1]), []).append(int(name))
+
+    pids, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, ()))
+    return pids
+
+
+def cpu_seconds(pids: List[int]) -> float:
+    total = 0
+    for pid in pids:
+        fields = _stat(pid)
+        if fields is not None:
+            # utime + stime
+            total += int(fields[11]) + int(fields[12])
+    return total / CLOCK_TICKS
+
+
+def rss_bytes(pids: List[int]) -> int:
+    total = 0
+    for pid in pids:
+        try:
+            with open("/proc/%d/statm" % pid) as f:
+                total += int(f.read().split()[1]) * PAGE_SIZE
+        except OSError:
+            pass
+    return total
+
+
+# -------------------------------------------------------------------
+# subprocesses
+# -------------------------------------------------------------------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start(
+    name: str,
+    target: str,
+    port: int,
+    env: Dict[str, str],
+    workers: int,
+    log_dir: str,
+) -> Tuple[subprocess.Popen, str]:
+    log_path = os.path.join(log_dir, name + ".log")
+    log = open(log_path, "w")
+    proc = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", target,
+            "--host", "127.0.0.1",
+            "--port", str(port),
+            "--workers", str(workers),
+            "--log-level", "warning",
+        ],
+        cwd=ROOT,
+        env=dict(os.environ, **env),
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    log.close()
+    return proc, log_path
+
+
+async def _wait_ready(
+    proc: subprocess.Popen,
+    url: str,
+    log_path: str,
+    timeout: float = 60.0,
+) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2.0) as client:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(
+                    "%s exited with %d, see %s" % (url, proc.returncode, log_path)
+                )
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("%s not ready after %.0fs, see %s" % (url, timeout, log_path))
+
+
+def _stop(proc: subprocess.Popen) -> None:
+    if proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+# -------------------------------------------------------------------
+# load generation
+# -------------------------------------------------------------------
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def _request_factory(
+    scenario: str,
+    devices: List[Dict[str, Any]],
+    args: argparse.Namespace,
+) -> Callable[[random.Random], Tuple[str, Dict[str, Any]]]:
+    cameras = [d for d in devices if d["device_type"] == "camera"]
+    nvrs = [d for d in devices if d["device_type"] == "nvr"]
+
+    def frame_body(device_id: str, device_type: str, camera_id=None):
+        body: Dict[str, Any] = {"device_id": device_id, "device_type": device_type}
+        if camera_id is not None:
+            body["camera_id"] = camera_id
+        if args.frame_width:
+            body["width"] = args.frame_width
+        if args.max_age_ms is not None:
+            body["max_age_ms"] = args.max_age_ms
+        return body
+
+    if scenario == "frame":
+        if not cameras:
+            raise SystemExit("the frame scenario needs --cameras > 0")
+
+        def make(rng):
+            device = rng.choice(cameras)
+            return "/api/v1/stream/frame", frame_body(device["device_id"], "camera")
+
+    elif scenario == "nvr":
+        if not nvrs:
+            raise SystemExit("the nvr scenario needs --nvrs > 0")
+
+        def make(rng):
+            device = rng.choice(nvrs)
+            channel = rng.choice(device["meta_data"])["camera_id"]
+            return "/api/v1/stream/frame", frame_body(
+                device["device_id"], "nvr", channel
+            )
+
+    else:
+        def make(rng):
+            device = rng.choice(devices)
+            return "/api/v1/stream/capabilities", {
+                "device_id": device["device_id"],
+                "ip": device["ip"],
+                "port": device["port"],
+                "refresh": args.refresh_capabilities,
+            }
+
+    return make
+
+
+async def run_scenario(
+    base_url: str,
+    scenario: str,
+    devices: List[Dict[str, Any]],
+    args: argparse.Namespace,
+    service_pid: int,
+) -> Dict[str, Any]:
+    make_request = _request_factory(scenario, devices, args)
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    measure_from = time.monotonic() + args.warmup
+    measure_until = measure_from + args.duration
+
+    async def worker(seed: int) -> None:
+        rng = random.Random(seed)
+        while True:
+            started = time.monotonic()
+            if started >= measure_until:
+                return
+            path, body = make_request(rng)
+            try:
+                response = await client.post(path, json=body)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            finished = time.monotonic()
+            if started >= measure_from and finished <= measure_until:
+                latencies.append(finished - started)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    async def sample_rss(peak: List[int]) -> None:
+        while True:
+            peak[0] = max(peak[0], rss_bytes(process_tree(service_pid)))
+            await asyncio.sleep(0.5)
+
+    limits = httpx.Limits(
+        max_connections=args.concurrency,
+        max_keepalive_connections=args.concurrency,
+    )
+    async with httpx.AsyncClient(
+        base_url=base_url, timeout=args.timeout, limits=limits
+    ) as client:
+        workers = [
+            asyncio.ensure_future(worker(args.seed + i))
+            for i in range(args.concurrency)
+        ]
+        await asyncio.sleep(max(measure_from - time.monotonic(), 0))
+
+        pids = process_tree(service_pid)
+        cpu_start = cpu_seconds(pids)
+        peak = [0]
+        sampler = asyncio.ensure_future(sample_rss(peak))
+        await asyncio.gather(*workers)
+        sampler.cancel()
+        await asyncio.gather(sampler, return_exceptions=True)
+        # workers spawned by uvicorn are in the tree from the start
+        cpu_used = cpu_seconds(pids) - cpu_start
+        rss_end = rss_bytes(process_tree(service_pid))
+        scheduler = (await client.get("/api/v1/stream/scheduler")).json()
+
+    latencies.sort()
+    ok = statuses.get("200", 0)
+    return {
+        "requests": len(latencies),
+        "statuses": statuses,
+        "error_rate": round(1 - ok / len(latencies), 4) if latencies else 0.0,
+        "throughput_rps": round(len(latencies) / args.duration, 2),
+        "latency_ms": {
+            "mean": round(1000 * sum(latencies) / len(latencies), 3)
+            if latencies else 0.0,
+            "p50": round(1000 * percentile(latencies, 50), 3),
+            "p95": round(1000 * percentile(latencies, 95), 3),
+            "p99": round(1000 * percentile(latencies, 99), 3),
+            "max": round(1000 * latencies[-1], 3) if latencies else 0.0,
+        },
+        "cpu_seconds": round(cpu_used, 3),
+        "cpu_percent": round(100 * cpu_used / args.duration, 1),
+        "rss_peak_bytes": max(peak[0], rss_end),
+        "rss_end_bytes": rss_end,
+        "scheduler": scheduler,
+    }
+
+
+# -------------------------------------------------------------------
+# comparison
+# -------------------------------------------------------------------
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], max_regression: float) -> bool:
+    """Print per-scenario deltas; False if anything regressed past the limit."""
+    ok = True
+    for name, result in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+        rows = [("throughput_rps", base["throughput_rps"], result["throughput_rps"], True)]
+        for p in ("p50", "p95", "p99"):
+            rows.append(
+                (p + "_ms", base["latency_ms"][p], result["latency_ms"][p], False)
+            )
+        rows.append(("cpu_seconds", base["cpu_seconds"], result["cpu_seconds"], False))
+        rows.append(
+            ("rss_peak_mb", base["rss_peak_bytes"] / 2**20,
+             result["rss_peak_bytes"] / 2**20, False)
+        )
+
+        print("%s:" % name)
+        for metric, before, after, higher_is_better in rows:
+            change = 100.0 * (after - before) / before if before else 0.0
+            regression = -change if higher_is_better else change
+            flag = ""
+            if regression > max_regression:
+                flag = "  REGRESSION"
+                ok = False
+            print("  %-15s %12.2f -> %12.2f  (%+.1f%%)%s" % (metric, before, after, change, flag))
+    return ok
+
+
+# -------------------------------------------------------------------
+# main
+# -------------------------------------------------------------------
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="comma separated subset of %s" % ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=15.0,
+                        help="measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=3.0,
+                        help="unmeasured seconds before each scenario")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--cameras", type=int, default=20)
+    parser.add_argument("--nvrs", type=int, default=4)
+    parser.add_argument("--channels", type=int, default=8)
+    parser.add_argument("--video-width", type=int, default=1280)
+    parser.add_argument("--video-height", type=int, default=720)
+    parser.add_argument("--video-frames", type=int, default=250)
+    parser.add_argument("--no-sub-stream", action="store_true",
+                        help="give devices a single main profile")
+    parser.add_argument("--frame-width", type=int, default=320,
+                        help="width requested from /frame (0 for full size)")
+    parser.add_argument("--max-age-ms", type=int, default=None,
+                        help="max_age_ms sent with /frame requests")
+    parser.add_argument("--refresh-capabilities", action="store_true",
+                        help="bypass the discovery cache on every call")
+    parser.add_argument("--onboarding-delay-ms", type=float, default=50.0)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="SERVICE_WORKERS for the controller")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra controller setting, may be repeated")
+    parser.add_argument("--workdir", default=None,
+                        help="fixture and log directory (default: a temp dir)")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the work directory afterwards")
+    parser.add_argument("--output", default=None,
+                        help="result file (default: bench-<timestamp>.json)")
+    parser.add_argument("--compare", default=None, metavar="BASELINE",
+                        help="print deltas against an earlier result file")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="with --compare, exit 1 if any metric is this many "
+                             "percent worse")
+    args = parser.parse_args(argv)
+
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error("unknown scenarios: %s" % ", ".join(sorted(unknown)))
+    for item in args.env:
+        if "=" not in item:
+            parser.error("--env expects KEY=VALUE, got %r" % item)
+    return args
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    workdir = args.workdir or tempfile.mkdtemp(prefix="streaming-bench-")
+    print("Writing fixtures to %s" % workdir)
+    fleet = build_fleet(
+        workdir,
+        cameras=args.cameras,
+        nvrs=args.nvrs,
+        channels=args.channels,
+        width=args.video_width,
+        height=args.video_height,
+        frames=args.video_frames,
+        sub_stream=not args.no_sub_stream,
+    )
+
+    onboarding_port = _free_port()
+    service_port = _free_port()
+    service_env = dict(item.split("=", 1) for item in args.env)
+    service_env.update(
+        BENCH_FLEET=os.path.join(workdir, "fleet.json"),
+        SERVICE_WORKERS=str(args.workers),
+        SERVICE_DEVICE_ONBOARDING_URL=(
+            "http://127.0.0.1:%d/api/v1/cameras/capabilities" % onboarding_port
+        ),
+        HISTORY_DIR=os.path.join(workdir, "history"),
+        SHARED_FRAMES_NAME="bench_frames_%d" % service_port,
+        SHARED_FRAMES_LOCK_PATH=os.path.join(workdir, "frames.lock"),
+    )
+
+    onboarding, onboarding_log = _start(
+        "onboarding", "bench.onboarding:app", onboarding_port,
+        {"BENCH_ONBOARDING_DELAY_MS": str(args.onboarding_delay_ms)}, 1, workdir,
+    )
+    service, service_log = _start(
+        "service", "bench.server:app", service_port, service_env,
+        args.workers, workdir,
+    )
+    base_url = "http://127.0.0.1:%d" % service_port
+    try:
+        await _wait_ready(
+            onboarding, "http://127.0.0.1:%d/calls" % onboarding_port, onboarding_log
+        )
+        await _wait_ready(service, base_url + "/api/v1/stream/scheduler", service_log)
+
+        rss_idle = rss_bytes(process_tree(service.pid))
+        results = {}
+        for scenario in args.scenarios:
+            print("Running %s for %.0fs at concurrency %d"
+                  % (scenario, args.duration, args.concurrency))
+            results[scenario] = await run_scenario(
+                base_url, scenario, fleet["devices"], args, service.pid
+            )
+            summary = results[scenario]
+            print("  %.1f req/s, p50 %.1fms, p95 %.1fms, p99 %.1fms, errors %.1f%%"
+                  % (summary["throughput_rps"], summary["latency_ms"]["p50"],
+                     summary["latency_ms"]["p95"], summary["latency_ms"]["p99"],
+                     100 * summary["error_rate"]))
+
+        async with httpx.AsyncClient() as client:
+            calls = (await client.get(
+                "http://127.0.0.1:%d/calls" % onboarding_port
+            )).json()["calls"]
+    finally:
+        _stop(service)
+        _stop(onboarding)
+        # the last worker unlinks the segment on shutdown; a killed
+        # service would leave it in /dev/shm
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(os.path.join("/dev/shm", service_env["SHARED_FRAMES_NAME"]))
+        if not args.keep and args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    config = {
+        k: v for k, v in vars(args).items()
+        if k not in ("output", "compare", "max_regression", "workdir", "keep")
+    }
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": config,
+        "host": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "rss_idle_bytes": rss_idle,
+        "onboarding_calls": calls,
+        "scenarios": results,
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(main(args))
+
+    output = args.output or time.strftime("bench-%Y%m%d-%H%M%S.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Saved results to %s" % output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(baseline, report, args.max_regression or float("inf")):
+            sys.exit(1)
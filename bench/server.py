@@ -0,0 +1,25 @@
+"""The streaming controller with its Postgres device source swapped out.
+
+Devices come from the fleet file named by BENCH_FLEET (written by
+bench.fixtures.build_fleet), and table creation at startup is skipped,
+so the service runs without a database. Video files are played at
+their own frame rate and looped, as cameras would deliver them. Start it with
+``uvicorn bench.server:app``; every worker process patches itself on
+import.
+"""
+import os
+
+import app as app_package
+from bench.fixtures import MemoryDeviceSource, pace_file_captures
+from services.device_registry import device_registry
+
+
+async def _skip_init_db() -> None:
+    pass
+
+
+device_registry.source = MemoryDeviceSource.from_file(os.environ["BENCH_FLEET"])
+pace_file_captures()
+# on_startup looks init_db up in the app package at call time
+app_package.init_db = _skip_init_db
+app = app_package.app
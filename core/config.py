@@ -13,6 +13,197 @@ class Settings:
         "SERVICE_DEVICE_ONBOARDING_URL",
         "http://localhost:8001/api/v1/cameras/capabilities"
     )
+    ONBOARDING_TIMEOUT_SECONDS: float = float(
+        os.getenv("ONBOARDING_TIMEOUT_SECONDS", "20")
+    )
+    ONBOARDING_MAX_CONNECTIONS: int = int(
+        os.getenv("ONBOARDING_MAX_CONNECTIONS", "20")
+    )
+    CAPABILITIES_CACHE_TTL_SECONDS: float = float(
+        os.getenv("CAPABILITIES_CACHE_TTL_SECONDS", "300")
+    )
+    CAPABILITIES_CACHE_MAX_ENTRIES: int = int(
+        os.getenv("CAPABILITIES_CACHE_MAX_ENTRIES", "4096")
+    )
+
+    # In-memory device registry
+    DEVICE_REGISTRY_MAX_DEVICES: int = int(
+        os.getenv("DEVICE_REGISTRY_MAX_DEVICES", "50000")
+    )
+    DEVICE_REGISTRY_REFRESH_SECONDS: float = float(
+        os.getenv("DEVICE_REGISTRY_REFRESH_SECONDS", "30")
+    )
+    DEVICE_REGISTRY_NEGATIVE_TTL_SECONDS: float = float(
+        os.getenv("DEVICE_REGISTRY_NEGATIVE_TTL_SECONDS", "5")
+    )
+    DEVICE_REGISTRY_NOTIFY_CHANNEL: str = os.getenv(
+        "DEVICE_REGISTRY_NOTIFY_CHANNEL", ""
+    )
+
+    # Bulk device import / export
+    DEVICE_IMPORT_BATCH_SIZE: int = int(os.getenv("DEVICE_IMPORT_BATCH_SIZE", "1000"))
+    DEVICE_IMPORT_MAX_ERRORS: int = int(os.getenv("DEVICE_IMPORT_MAX_ERRORS", "1000"))
+    DEVICE_IMPORT_MAX_LINE_BYTES: int = int(
+        os.getenv("DEVICE_IMPORT_MAX_LINE_BYTES", "1048576")
+    )
+    DEVICE_EXPORT_BATCH_SIZE: int = int(os.getenv("DEVICE_EXPORT_BATCH_SIZE", "1000"))
+
+    # RTSP session pool
+    RTSP_POOL_MAX_SESSIONS: int = int(os.getenv("RTSP_POOL_MAX_SESSIONS", "64"))
+    RTSP_POOL_MAX_SESSIONS_PER_HOST: int = int(
+        os.getenv("RTSP_POOL_MAX_SESSIONS_PER_HOST", "8")
+    )
+    RTSP_POOL_IDLE_TIMEOUT_SECONDS: float = float(
+        os.getenv("RTSP_POOL_IDLE_TIMEOUT_SECONDS", "60")
+    )
+    RTSP_FRAME_STALE_SECONDS: float = float(
+        os.getenv("RTSP_FRAME_STALE_SECONDS", "5")
+    )
+    RTSP_RECONNECT_BACKOFF_MIN_SECONDS: float = float(
+        os.getenv("RTSP_RECONNECT_BACKOFF_MIN_SECONDS", "0.5")
+    )
+    RTSP_RECONNECT_BACKOFF_MAX_SECONDS: float = float(
+        os.getenv("RTSP_RECONNECT_BACKOFF_MAX_SECONDS", "30")
+    )
+
+    # RTSP open/read timeouts and learned camera profiles
+    RTSP_OPEN_TIMEOUT_SECONDS: float = float(
+        os.getenv("RTSP_OPEN_TIMEOUT_SECONDS", "5")
+    )
+    RTSP_READ_TIMEOUT_SECONDS: float = float(
+        os.getenv("RTSP_READ_TIMEOUT_SECONDS", "5")
+    )
+    RTSP_GRAB_TIMEOUT_SECONDS: float = float(
+        os.getenv("RTSP_GRAB_TIMEOUT_SECONDS", "10")
+    )
+    RTSP_MAX_WARMUP_FRAMES: int = int(os.getenv("RTSP_MAX_WARMUP_FRAMES", "5"))
+    RTSP_TRANSPORTS: list = [
+        t.strip()
+        for t in os.getenv("RTSP_TRANSPORTS", "tcp,udp").split(",")
+        if t.strip()
+    ]
+    CAMERA_PROFILES_MAX: int = int(os.getenv("CAMERA_PROFILES_MAX", "10000"))
+    CAMERA_FAILURE_THRESHOLD: int = int(os.getenv("CAMERA_FAILURE_THRESHOLD", "3"))
+    CAMERA_FAILURE_BACKOFF_MIN_SECONDS: float = float(
+        os.getenv("CAMERA_FAILURE_BACKOFF_MIN_SECONDS", "5")
+    )
+    CAMERA_FAILURE_BACKOFF_MAX_SECONDS: float = float(
+        os.getenv("CAMERA_FAILURE_BACKOFF_MAX_SECONDS", "300")
+    )
+    CLIENT_DISCONNECT_POLL_SECONDS: float = float(
+        os.getenv("CLIENT_DISCONNECT_POLL_SECONDS", "0.5")
+    )
+
+    # Capture scheduler
+    CAPTURE_MAX_WORKERS: int = int(os.getenv("CAPTURE_MAX_WORKERS", "32"))
+    CAPTURE_PER_HOST_LIMIT: int = int(os.getenv("CAPTURE_PER_HOST_LIMIT", "4"))
+    CAPTURE_MAX_QUEUE: int = int(os.getenv("CAPTURE_MAX_QUEUE", "256"))
+    CAPTURE_QUEUE_TIMEOUT_SECONDS: float = float(
+        os.getenv("CAPTURE_QUEUE_TIMEOUT_SECONDS", "5")
+    )
+
+    # Encoded frame cache
+    FRAME_CACHE_TTL_MS: int = int(os.getenv("FRAME_CACHE_TTL_MS", "1000"))
+    FRAME_CACHE_MAX_ENTRIES: int = int(os.getenv("FRAME_CACHE_MAX_ENTRIES", "512"))
+    FRAME_CACHE_MAX_BYTES: int = int(
+        os.getenv("FRAME_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+    )
+    FRAME_CACHE_MAX_VARIANTS: int = int(os.getenv("FRAME_CACHE_MAX_VARIANTS", "8"))
+
+    # Scene change detection (ETag / long-poll)
+    FRAME_CHANGE_THRESHOLD: float = float(os.getenv("FRAME_CHANGE_THRESHOLD", "2.0"))
+    FRAME_FINGERPRINT_MAX_KEYS: int = int(
+        os.getenv("FRAME_FINGERPRINT_MAX_KEYS", "4096")
+    )
+    FRAME_WAIT_MAX_MS: int = int(os.getenv("FRAME_WAIT_MAX_MS", "30000"))
+    FRAME_WAIT_POLL_MS: int = int(os.getenv("FRAME_WAIT_POLL_MS", "500"))
+
+    # Per-camera frame history (opt in with "history" in meta_data)
+    HISTORY_DIR: str = os.getenv(
+        "HISTORY_DIR", "/var/tmp/streaming_controller/history"
+    )
+    HISTORY_FPS: float = float(os.getenv("HISTORY_FPS", "2"))
+    HISTORY_JPEG_QUALITY: int = int(os.getenv("HISTORY_JPEG_QUALITY", "80"))
+    HISTORY_MEMORY_SECONDS: float = float(os.getenv("HISTORY_MEMORY_SECONDS", "30"))
+    HISTORY_MAX_MEMORY_BYTES: int = int(
+        os.getenv("HISTORY_MAX_MEMORY_BYTES", str(256 * 1024 * 1024))
+    )
+    HISTORY_MAX_DISK_BYTES: int = int(
+        os.getenv("HISTORY_MAX_DISK_BYTES", str(2 * 1024 * 1024 * 1024))
+    )
+    HISTORY_SEGMENT_BYTES: int = int(
+        os.getenv("HISTORY_SEGMENT_BYTES", str(16 * 1024 * 1024))
+    )
+    HISTORY_ENCODE_WORKERS: int = int(os.getenv("HISTORY_ENCODE_WORKERS", "2"))
+    HISTORY_SYNC_SECONDS: float = float(os.getenv("HISTORY_SYNC_SECONDS", "30"))
+    HISTORY_MAX_BURST_FRAMES: int = int(os.getenv("HISTORY_MAX_BURST_FRAMES", "100"))
+
+    # Multiple uvicorn workers sharing one capture per camera
+    SERVICE_WORKERS: int = int(os.getenv("SERVICE_WORKERS", "1"))
+    SHARED_FRAMES_ENABLED: bool = os.getenv(
+        "SHARED_FRAMES_ENABLED", "true" if SERVICE_WORKERS > 1 else "false"
+    ).lower() in ("1", "true", "yes")
+    SHARED_FRAMES_NAME: str = os.getenv(
+        "SHARED_FRAMES_NAME", "streaming_controller_frames"
+    )
+    SHARED_FRAMES_SLOTS: int = int(os.getenv("SHARED_FRAMES_SLOTS", "256"))
+    SHARED_FRAMES_SLOT_BYTES: int = int(
+        os.getenv("SHARED_FRAMES_SLOT_BYTES", str(2 * 1024 * 1024))
+    )
+    SHARED_FRAMES_LOCK_PATH: str = os.getenv(
+        "SHARED_FRAMES_LOCK_PATH", "/tmp/streaming_controller_frames.lock"
+    )
+    SHARED_FRAMES_FPS: float = float(os.getenv("SHARED_FRAMES_FPS", "5"))
+    SHARED_FRAMES_OWNER_TIMEOUT_SECONDS: float = float(
+        os.getenv("SHARED_FRAMES_OWNER_TIMEOUT_SECONDS", "5")
+    )
+    SHARED_FRAMES_IDLE_SECONDS: float = float(
+        os.getenv("SHARED_FRAMES_IDLE_SECONDS", "60")
+    )
+
+    # Background prefetch of frequently requested cameras
+    PREFETCH_ENABLED: bool = os.getenv(
+        "PREFETCH_ENABLED", "true" if SERVICE_WORKERS == 1 else "false"
+    ).lower() in ("1", "true", "yes")
+    PREFETCH_INTERVAL_SECONDS: float = float(
+        os.getenv("PREFETCH_INTERVAL_SECONDS", "1")
+    )
+    PREFETCH_HALF_LIFE_SECONDS: float = float(
+        os.getenv("PREFETCH_HALF_LIFE_SECONDS", "60")
+    )
+    PREFETCH_MIN_SCORE: float = float(os.getenv("PREFETCH_MIN_SCORE", "5"))
+    PREFETCH_MAX_CAMERAS: int = int(os.getenv("PREFETCH_MAX_CAMERAS", "16"))
+    PREFETCH_PER_HOST_SESSIONS: int = int(
+        os.getenv("PREFETCH_PER_HOST_SESSIONS", "2")
+    )
+    PREFETCH_OPENS_PER_MINUTE: float = float(
+        os.getenv("PREFETCH_OPENS_PER_MINUTE", "6")
+    )
+    PREFETCH_REFRESH_MS: int = int(os.getenv("PREFETCH_REFRESH_MS", "500"))
+    PREFETCH_MAX_TRACKED: int = int(os.getenv("PREFETCH_MAX_TRACKED", "10000"))
+
+    # Metrics and slow-request logging
+    METRICS_DEVICE_LABELS: bool = os.getenv(
+        "METRICS_DEVICE_LABELS", "true"
+    ).lower() in ("1", "true", "yes")
+    METRICS_MAX_DEVICES: int = int(os.getenv("METRICS_MAX_DEVICES", "1000"))
+    METRICS_SLOW_REQUEST_MS: float = float(
+        os.getenv("METRICS_SLOW_REQUEST_MS", "0")
+    )
+    METRICS_SLOW_SAMPLE_RATE: float = float(
+        os.getenv("METRICS_SLOW_SAMPLE_RATE", "1.0")
+    )
+
+    # Live MJPEG / WebSocket streams
+    STREAM_DEFAULT_FPS: float = float(os.getenv("STREAM_DEFAULT_FPS", "5"))
+    STREAM_MAX_FPS: float = float(os.getenv("STREAM_MAX_FPS", "25"))
+
+    # Batch snapshots
+    BATCH_MAX_ITEMS: int = int(os.getenv("BATCH_MAX_ITEMS", "256"))
+    BATCH_GLOBAL_CONCURRENCY: int = int(os.getenv("BATCH_GLOBAL_CONCURRENCY", "32"))
+    BATCH_PER_DEVICE_CONCURRENCY: int = int(
+        os.getenv("BATCH_PER_DEVICE_CONCURRENCY", "4")
+    )
 
 print("DATABASE_URL =", os.getenv("DATABASE_URL"))
 
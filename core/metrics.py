@@ -0,0 +1,301 @@
+import bisect
+import contextlib
+import contextvars
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# seconds; covers cache hits (sub-ms) up to hung RTSP opens
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = ['%s="%s"' % (n, _escape(v)) for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{%s}" % ",".join(parts) if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [
+            "# HELP %s %s" % (self.name, self.documentation),
+            "# TYPE %s %s" % (self.name, self.kind),
+        ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [
+            "%s%s %s" % (self.name, _format_labels(self.labelnames, labels), value)
+            for labels, value in values
+        ]
+
+
+class Gauge(_Metric):
+    """Gauge read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, read: Callable[[], float]):
+        super().__init__(name, documentation)
+        self._read = read
+
+    def render(self) -> List[str]:
+        try:
+            value = float(self._read())
+        except Exception:
+            logger.exception("Failed to read gauge %s", self.name)
+            return []
+        return self.header() + ["%s %s" % (self.name, value)]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> (per-bucket counts, +Inf count, sum)
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0, 0.0]
+            if i < len(self.buckets):
+                entry[0][i] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = [(k, list(v[0]), v[1], v[2]) for k, v in self._values.items()]
+        lines = self.header()
+        for labels, counts, total, value_sum in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(
+                    "%s_bucket%s %d"
+                    % (
+                        self.name,
+                        _format_labels(self.labelnames, labels, 'le="%s"' % bound),
+                        cumulative,
+                    )
+                )
+            lines.append(
+                "%s_bucket%s %d"
+                % (self.name, _format_labels(self.labelnames, labels, 'le="+Inf"'), total)
+            )
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append("%s_sum%s %s" % (self.name, label_str, value_sum))
+            lines.append("%s_count%s %d" % (self.name, label_str, total))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.register(
+    Histogram(
+        "streaming_stage_seconds",
+        "Time spent per request stage",
+        ("stage", "device"),
+    )
+)
+request_seconds = registry.register(
+    Histogram(
+        "streaming_request_seconds",
+        "End-to-end HTTP request time",
+        ("path", "status"),
+    )
+)
+failures_total = registry.register(
+    Counter(
+        "streaming_failures_total",
+        "Failed operations by cause",
+        ("cause", "device"),
+    )
+)
+frame_cache_total = registry.register(
+    Counter(
+        "streaming_frame_cache_requests_total",
+        "Frame cache lookups by result",
+        ("result",),
+    )
+)
+
+
+# -------------------------------------------------------------------
+# per-request context
+# -------------------------------------------------------------------
+_device: contextvars.ContextVar[str] = contextvars.ContextVar("metrics_device", default="")
+_stages: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "metrics_stages", default=None
+)
+_known_devices: set = set()
+
+
+def _device_label(device_id: str) -> str:
+    if not settings.METRICS_DEVICE_LABELS:
+        return ""
+    if device_id in _known_devices:
+        return device_id
+    # bound the number of series a large fleet can create
+    if len(_known_devices) >= settings.METRICS_MAX_DEVICES:
+        return "other"
+    _known_devices.add(device_id)
+    return device_id
+
+
+def set_device(device_id: Optional[str]) -> None:
+    """Attribute the stages that follow, in this context, to device_id."""
+    _device.set(device_id or "")
+
+
+def current_device() -> str:
+    return _device.get()
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    stage_seconds.observe(seconds, name, _device_label(_device.get()))
+    stages = _stages.get()
+    if stages is not None:
+        stages[name] = stages.get(name, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def count_failure(cause: str, device_id: Optional[str] = None) -> None:
+    device = _device.get() if device_id is None else device_id
+    failures_total.inc(cause, _device_label(device))
+
+
+def add_gauge(name: str, documentation: str, read: Callable[[], float]) -> None:
+    registry.register(Gauge(name, documentation, read))
+
+
+# -------------------------------------------------------------------
+# ASGI middleware
+# -------------------------------------------------------------------
+class MetricsMiddleware:
+    """Times every HTTP request and its response write.
+
+    Each request gets its own stage dict, so requests slower than
+    METRICS_SLOW_REQUEST_MS can be logged with their per-stage breakdown
+    (sampled at METRICS_SLOW_SAMPLE_RATE).
+    """
+
+    def __init__(self, app, skip_paths: Iterable[str] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        stages: Dict[str, float] = {}
+        stages_token = _stages.set(stages)
+        device_token = _device.set("")
+        started = time.perf_counter()
+        status = [500]
+        write_started = [0.0]
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                write_started[0] = time.perf_counter()
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                observe_stage("write", time.perf_counter() - write_started[0])
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            elapsed = time.perf_counter() - started
+            device = _device.get()
+            _stages.reset(stages_token)
+            _device.reset(device_token)
+            # the router records the matched endpoint in scope; anything
+            # else (scanners, typos) shares one label
+            path = scope["path"] if "endpoint" in scope else "unmatched"
+            request_seconds.observe(elapsed, path, str(status[0]))
+
+            slow_ms = settings.METRICS_SLOW_REQUEST_MS
+            if (
+                slow_ms
+                and elapsed * 1000 >= slow_ms
+                and random.random() < settings.METRICS_SLOW_SAMPLE_RATE
+            ):
+                logger.warning(
+                    "Slow request %s %s -> %d in %.0fms (device=%s) stages: %s",
+                    scope["method"],
+                    scope["path"],
+                    status[0],
+                    elapsed * 1000,
+                    device or "-",
+                    ", ".join(
+                        "%s=%.1fms" % (name, seconds * 1000)
+                        for name, seconds in stages.items()
+                    )
+                    or "none",
+                )
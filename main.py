@@ -1,6 +1,13 @@
 import uvicorn
 from app import app
+from core.config import settings
 
 
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=8002, reload=False)
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8002,
+        reload=False,
+        workers=settings.SERVICE_WORKERS,
+    )
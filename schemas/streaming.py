@@ -1,11 +1,57 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, root_validator
 from typing import Optional, List, Any, Literal
 
 
-class FrameRequest(BaseModel):
+class CropRect(BaseModel):
+    # fractions of the source frame, so crops survive resolution changes
+    x: float = Field(..., ge=0, lt=1)
+    y: float = Field(..., ge=0, lt=1)
+    w: float = Field(..., gt=0, le=1)
+    h: float = Field(..., gt=0, le=1)
+
+    @root_validator(skip_on_failure=True)
+    def check_bounds(cls, values):
+        if values["x"] + values["w"] > 1 or values["y"] + values["h"] > 1:
+            raise ValueError("crop rectangle must lie inside the frame")
+        return values
+
+
+class FrameOutputOptions(BaseModel):
+    # bounding box for the output; aspect ratio is kept, never upscaled
+    width: Optional[int] = Field(None, gt=0, le=7680)
+    height: Optional[int] = Field(None, gt=0, le=4320)
+    quality: Optional[int] = Field(None, ge=1, le=100)
+    format: Literal["jpeg", "webp", "png"] = "jpeg"
+    crop: Optional[CropRect] = None
+
+
+class FrameRequest(FrameOutputOptions):
     device_id: str
     device_type: str
     camera_id: Optional[str] = None
+    # accept a cached frame up to this old; 0 forces a fresh grab
+    max_age_ms: Optional[int] = Field(None, ge=0)
+    # raw image bytes by default; base64 JSON only when asked for
+    response_format: Literal["binary", "base64"] = "binary"
+    # long-poll: hold the request until the scene differs from If-None-Match
+    wait_for_change: bool = False
+    wait_timeout_ms: Optional[int] = Field(None, gt=0)
+    # mean absolute difference (0-255) of the frame fingerprints that
+    # counts as a change; defaults to FRAME_CHANGE_THRESHOLD
+    change_threshold: Optional[float] = Field(None, ge=0, le=255)
+
+
+class BatchFrameItem(BaseModel):
+    device_id: str
+    camera_id: Optional[str] = None
+    # nvr only: expand to every camera listed in the device meta_data
+    all_cameras: bool = False
+
+
+class BatchFrameRequest(FrameOutputOptions):
+    items: List[BatchFrameItem] = Field(..., min_items=1)
+    max_age_ms: Optional[int] = Field(None, ge=0)
+    response_format: Literal["ndjson", "multipart"] = "ndjson"
 
 
 class CameraFrameResponse(BaseModel):
@@ -23,6 +69,13 @@ class CapabilitiesRequest(BaseModel):
     device_id: str
     ip: str
     port: int
+    # bypass the cached discovery result
+    refresh: bool = False
+
+
+class RegistryInvalidateRequest(BaseModel):
+    # None drops every cached device
+    device_ids: Optional[List[str]] = None
 
 
 class CameraDiscoveryResponse(BaseModel):
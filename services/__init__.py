@@ -1 +1,9 @@
-from . import streaming_service, capabilities_service
+from . import (
+    device_registry,
+    camera_profiles,
+    session_pool,
+    frame_cache,
+    fanout,
+    streaming_service,
+    capabilities_service,
+)
@@ -0,0 +1,247 @@
+import cv2
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Optional
+
+from core import metrics
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_OPTIONS_ENV = "OPENCV_FFMPEG_CAPTURE_OPTIONS"
+
+
+class CameraUnavailable(RuntimeError):
+    """Raised without touching the network for cameras known to be failing."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GrabCancelled(RuntimeError):
+    """Raised when the caller abandoned the grab (e.g. client disconnected)."""
+
+
+class CameraProfile:
+    """What worked the last time this camera was opened."""
+
+    def __init__(self):
+        self.transport: Optional[str] = None
+        self.open_latency: Optional[float] = None
+        self.warmup_frames: Optional[int] = None
+        self.failures = 0
+        self.failing_until = 0.0
+
+    def transport_order(self) -> List[str]:
+        order = list(settings.RTSP_TRANSPORTS)
+        if self.transport in order:
+            order.remove(self.transport)
+            order.insert(0, self.transport)
+        return order
+
+    def open_timeout(self, limit: float) -> float:
+        # a camera that usually answers in 300 ms will not answer in 20 s
+        if self.open_latency is None:
+            return limit
+        return min(limit, max(self.open_latency * 3, 1.0))
+
+    def warmup_budget(self) -> int:
+        if self.warmup_frames is None:
+            return settings.RTSP_MAX_WARMUP_FRAMES
+        return min(settings.RTSP_MAX_WARMUP_FRAMES, self.warmup_frames + 2)
+
+    def to_dict(self) -> dict:
+        remaining = max(self.failing_until - time.monotonic(), 0.0)
+        return {
+            "transport": self.transport,
+            "open_latency_ms": (
+                round(self.open_latency * 1000, 1)
+                if self.open_latency is not None
+                else None
+            ),
+            "warmup_frames": self.warmup_frames,
+            "consecutive_failures": self.failures,
+            "failing_for_seconds": round(remaining, 1),
+        }
+
+
+class ProfileStore:
+    """LRU map of RTSP URL to CameraProfile, shared by every capture path."""
+
+    def __init__(self, max_profiles: int):
+        self.max_profiles = max_profiles
+        self._profiles: "OrderedDict[str, CameraProfile]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, rtsp_url: str) -> CameraProfile:
+        with self._lock:
+            profile = self._profiles.get(rtsp_url)
+            if profile is None:
+                profile = CameraProfile()
+                self._profiles[rtsp_url] = profile
+                if len(self._profiles) > self.max_profiles:
+                    self._profiles.popitem(last=False)
+            else:
+                self._profiles.move_to_end(rtsp_url)
+            return profile
+
+    def check(self, rtsp_url: str) -> CameraProfile:
+        profile = self.get(rtsp_url)
+        remaining = profile.failing_until - time.monotonic()
+        if remaining > 0:
+            raise CameraUnavailable(
+                "Camera is failing, next attempt in %.0fs" % remaining,
+                retry_after=max(int(remaining), 1),
+            )
+        return profile
+
+    def record_open(
+        self,
+        rtsp_url: str,
+        transport: Optional[str],
+        latency: float,
+    ) -> None:
+        profile = self.get(rtsp_url)
+        profile.transport = transport
+        if profile.open_latency is None:
+            profile.open_latency = latency
+        else:
+            profile.open_latency = 0.7 * profile.open_latency + 0.3 * latency
+
+    def record_success(self, rtsp_url: str, warmup_frames: int) -> None:
+        profile = self.get(rtsp_url)
+        profile.warmup_frames = warmup_frames
+        profile.failures = 0
+        profile.failing_until = 0.0
+
+    def record_failure(self, rtsp_url: str) -> None:
+        profile = self.get(rtsp_url)
+        profile.failures += 1
+        if profile.failures >= settings.CAMERA_FAILURE_THRESHOLD:
+            exponent = profile.failures - settings.CAMERA_FAILURE_THRESHOLD
+            backoff = min(
+                settings.CAMERA_FAILURE_BACKOFF_MIN_SECONDS * (2 ** exponent),
+                settings.CAMERA_FAILURE_BACKOFF_MAX_SECONDS,
+            )
+            profile.failing_until = time.monotonic() + backoff
+            logger.warning(
+                "Camera %s failed %d times in a row, short-circuiting for %.0fs",
+                rtsp_url,
+                profile.failures,
+                backoff,
+            )
+
+
+class _TransportGate:
+    """Serialises FFmpeg capture options across concurrent opens.
+
+    OpenCV's FFmpeg backend only takes the RTSP transport from a
+    process-wide environment variable read at open time. Opens that want
+    the same options run concurrently; an open that needs different
+    options waits until the in-flight ones have finished.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._current: Optional[str] = None
+        self._active = 0
+
+    @contextmanager
+    def use(self, options: Optional[str]):
+        with self._cond:
+            while self._active and self._current != options:
+                self._cond.wait()
+            self._current = options
+            self._active += 1
+            if options is None:
+                os.environ.pop(FFMPEG_OPTIONS_ENV, None)
+            else:
+                os.environ[FFMPEG_OPTIONS_ENV] = options
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                if not self._active:
+                    self._cond.notify_all()
+
+
+profile_store = ProfileStore(max_profiles=settings.CAMERA_PROFILES_MAX)
+_transport_gate = _TransportGate()
+
+
+def _is_rtsp(rtsp_url: str) -> bool:
+    return rtsp_url.lower().startswith(("rtsp://", "rtsps://"))
+
+
+def open_capture(
+    rtsp_url: str,
+    timeout_seconds: float,
+    cancel_event: Optional[threading.Event] = None,
+):
+    """Open a capture with enforced timeouts, trying the known-good transport first."""
+    profile = profile_store.check(rtsp_url)
+    open_timeout = profile.open_timeout(
+        min(timeout_seconds, settings.RTSP_OPEN_TIMEOUT_SECONDS)
+    )
+    read_timeout = min(timeout_seconds, settings.RTSP_READ_TIMEOUT_SECONDS)
+    params = [
+        cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(open_timeout * 1000),
+        cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(read_timeout * 1000),
+    ]
+
+    transports = profile.transport_order() if _is_rtsp(rtsp_url) else [None]
+    open_started = time.perf_counter()
+    for transport in transports:
+        if cancel_event is not None and cancel_event.is_set():
+            raise GrabCancelled("Capture abandoned before open")
+
+        options = "rtsp_transport;%s" % transport if transport else None
+        started = time.monotonic()
+        with _transport_gate.use(options):
+            cap = cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG, params)
+
+        if cap.isOpened():
+            profile_store.record_open(rtsp_url, transport, time.monotonic() - started)
+            metrics.observe_stage("rtsp_open", time.perf_counter() - open_started)
+            return cap
+
+        cap.release()
+        logger.debug("Open of %s over %s failed", rtsp_url, transport)
+
+    metrics.observe_stage("rtsp_open", time.perf_counter() - open_started)
+    metrics.count_failure("rtsp_open")
+    profile_store.record_failure(rtsp_url)
+    raise RuntimeError("Unable to open RTSP stream")
+
+
+def read_first_frame(
+    cap,
+    rtsp_url: str,
+    deadline: float,
+    cancel_event: Optional[threading.Event] = None,
+):
+    """Read through the stream warm-up and return the first decoded frame."""
+    budget = profile_store.get(rtsp_url).warmup_budget()
+    started = time.perf_counter()
+    for attempt in range(1, budget + 1):
+        if cancel_event is not None and cancel_event.is_set():
+            raise GrabCancelled("Capture abandoned during warm-up")
+        if time.monotonic() > deadline:
+            break
+
+        ret, frame = cap.read()
+        if ret and frame is not None:
+            profile_store.record_success(rtsp_url, attempt)
+            metrics.observe_stage("first_frame", time.perf_counter() - started)
+            return frame
+
+    metrics.observe_stage("first_frame", time.perf_counter() - started)
+    metrics.count_failure("rtsp_read")
+    profile_store.record_failure(rtsp_url)
+    raise RuntimeError("Failed to read frame from RTSP stream")
@@ -1,29 +1,64 @@
+import asyncio
 import httpx
 import logging
-from typing import Dict, Any, List
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+from core import metrics
 from core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# app-lifetime client so device_onboarding calls reuse pooled connections
+_client: Optional[httpx.AsyncClient] = None
+
+DiscoveryKey = Tuple[str, str, int]
+
+# (device_id, ip, port) -> (expires_at, parsed discovery response)
+_discovery_cache: "OrderedDict[DiscoveryKey, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_discovery_inflight: Dict[DiscoveryKey, asyncio.Future] = {}
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=settings.ONBOARDING_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=settings.ONBOARDING_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.ONBOARDING_MAX_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
 
 async def fetch_capabilities_from_onboarding(ip: str, port: int, username: str, password: str) -> Dict[str, Any]:
     url = settings.SERVICE_DEVICE_ONBOARDING_URL
     payload = {
         "camera_type": "onvif",
         "host": ip,
-        "port": 80,
+        "port": port,
         "username": username,
         "password": password,
     }
 
-    async with httpx.AsyncClient(timeout=20.0) as client:
-        try:
-            resp = await client.post(url, json=payload)
-        except httpx.RequestError as e:
-            logger.exception("Request to device_onboarding failed: %s", e)
-            raise
+    try:
+        with metrics.stage("onboarding"):
+            resp = await get_client().post(url, json=payload)
+    except httpx.RequestError as e:
+        metrics.count_failure("onboarding_request")
+        logger.exception("Request to device_onboarding failed: %s", e)
+        raise
 
     if resp.status_code != 200:
+        metrics.count_failure("onboarding_status")
         logger.error("device_onboarding returned non-200: %s - %s", resp.status_code, resp.text)
         resp.raise_for_status()
 
@@ -54,3 +89,55 @@ def extract_discovery_response(device_id: str, device_type: str, onboarding_resp
         "camera_count": len(tokens),
         "camera_id_sources": tokens,
     }
+
+
+async def get_discovery(
+    device_id: str,
+    device_type: str,
+    ip: str,
+    port: int,
+    username: str,
+    password: str,
+    refresh: bool = False,
+) -> Dict[str, Any]:
+    """Cached, single-flight wrapper around the onboarding discovery call.
+
+    ONVIF discovery is slow and rarely changes, so parsed results are kept
+    for CAPABILITIES_CACHE_TTL_SECONDS. Concurrent identical lookups share
+    one downstream request; refresh=True skips the cached value.
+    """
+    key = (device_id, ip, port)
+
+    if not refresh:
+        entry = _discovery_cache.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                _discovery_cache.move_to_end(key)
+                return entry[1]
+            del _discovery_cache[key]
+
+    fut = _discovery_inflight.get(key)
+    if fut is None:
+        async def run() -> Dict[str, Any]:
+            try:
+                onboarding_resp = await fetch_capabilities_from_onboarding(
+                    ip, port, username, password
+                )
+                result = extract_discovery_response(
+                    device_id, device_type, onboarding_resp
+                )
+                ttl = settings.CAPABILITIES_CACHE_TTL_SECONDS
+                _discovery_cache[key] = (time.monotonic() + ttl, result)
+                _discovery_cache.move_to_end(key)
+                max_entries = settings.CAPABILITIES_CACHE_MAX_ENTRIES
+                while len(_discovery_cache) > max_entries:
+                    _discovery_cache.popitem(last=False)
+                return result
+            finally:
+                _discovery_inflight.pop(key, None)
+
+        fut = asyncio.ensure_future(run())
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        _discovery_inflight[key] = fut
+
+    return await asyncio.shield(fut)
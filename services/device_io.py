@@ -0,0 +1,425 @@
+import codecs
+import csv
+import io
+import json
+import logging
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional, Tuple, Union
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from core.config import settings
+from db.session import async_session
+from models.streaming_device import DeviceType, StreamingDevice
+from services.device_registry import device_registry
+from services.stream_profiles import parse_stream_profiles
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("device_id", "device_type", "ip", "port", "username", "password", "meta_data")
+# exported only on request; import rows without them keep the stored values
+CREDENTIAL_COLUMNS = ("username", "password")
+
+# asyncpg takes at most 32767 bind parameters per statement
+_MAX_BATCH_ROWS = 32767 // len(COLUMNS)
+
+
+class DeviceRowError(ValueError):
+    """An import row that cannot be stored; the message is shown to the caller."""
+
+
+ParsedRow = Tuple[int, Union[Dict[str, Any], DeviceRowError]]
+
+
+# -------------------------------------------------------------------
+# validation
+# -------------------------------------------------------------------
+def _optional_str(row: Dict[str, Any], field: str) -> Optional[str]:
+    value = row.get(field)
+    if value is None or value == "":
+        return None
+    if not isinstance(value, str):
+        raise DeviceRowError("%s must be a string" % field)
+    return value
+
+
+def _check_stream_entry(entry: Any, where: str) -> None:
+    if not isinstance(entry, dict):
+        raise DeviceRowError("%s must be an object" % where)
+
+    profiles = entry.get("profiles")
+    if profiles is not None:
+        if not isinstance(profiles, list):
+            raise DeviceRowError("%s.profiles must be a list" % where)
+        names = set()
+        for i, profile in enumerate(profiles):
+            at = "%s.profiles[%d]" % (where, i)
+            if not isinstance(profile, dict):
+                raise DeviceRowError("%s must be an object" % at)
+            if not isinstance(profile.get("rtsp_url"), str) or not profile["rtsp_url"]:
+                raise DeviceRowError("%s.rtsp_url is required" % at)
+            for side in ("width", "height"):
+                value = profile.get(side)
+                if value is not None and (
+                    not isinstance(value, int) or isinstance(value, bool) or value <= 0
+                ):
+                    raise DeviceRowError("%s.%s must be a positive integer" % (at, side))
+            name = profile.get("name")
+            if name is not None:
+                if name in names:
+                    raise DeviceRowError("%s.name %r is not unique" % (at, name))
+                names.add(name)
+
+    rtsp_url = entry.get("rtsp_url")
+    if rtsp_url is not None and not isinstance(rtsp_url, str):
+        raise DeviceRowError("%s.rtsp_url must be a string" % where)
+
+    available = parse_stream_profiles(entry)
+    if not available:
+        raise DeviceRowError("%s needs an rtsp_url or a profiles list" % where)
+
+    history = entry.get("history")
+    if isinstance(history, str) and all(p.name != history for p in available):
+        raise DeviceRowError("%s.history names an unknown profile %r" % (where, history))
+    if history is not None and not isinstance(history, (bool, str)):
+        raise DeviceRowError("%s.history must be a boolean or a profile name" % where)
+
+
+def validate_device(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Check one import row and return it as streaming_devices column values."""
+    if not isinstance(row, dict):
+        raise DeviceRowError("row must be an object")
+    unknown = set(row) - set(COLUMNS)
+    if unknown:
+        raise DeviceRowError("unknown fields: %s" % ", ".join(sorted(unknown)))
+
+    device_id = row.get("device_id")
+    if not isinstance(device_id, str) or not device_id.strip():
+        raise DeviceRowError("device_id is required")
+
+    try:
+        device_type = DeviceType(row.get("device_type"))
+    except ValueError:
+        raise DeviceRowError("device_type must be 'camera' or 'nvr'")
+
+    port = row.get("port")
+    if port == "":
+        port = None
+    if port is not None:
+        if isinstance(port, str) and port.isdigit():
+            port = int(port)
+        if not isinstance(port, int) or isinstance(port, bool) or not 0 < port < 65536:
+            raise DeviceRowError("port must be an integer between 1 and 65535")
+
+    meta = row.get("meta_data")
+    if meta is None:
+        # no streams configured yet; stored as NULL, as exported
+        pass
+    elif device_type == DeviceType.camera:
+        _check_stream_entry(meta, "meta_data")
+    else:
+        # the service reads NVR channels from a top-level list
+        if not isinstance(meta, list) or not meta:
+            raise DeviceRowError("meta_data must be a non-empty list of cameras for nvr")
+        seen = set()
+        for i, cam in enumerate(meta):
+            where = "meta_data[%d]" % i
+            _check_stream_entry(cam, where)
+            camera_id = cam.get("camera_id")
+            if not isinstance(camera_id, str) or not camera_id:
+                raise DeviceRowError("%s.camera_id is required" % where)
+            if camera_id in seen:
+                raise DeviceRowError("%s.camera_id %r is not unique" % (where, camera_id))
+            seen.add(camera_id)
+
+    values = {
+        "device_id": device_id,
+        "device_type": device_type,
+        "ip": _optional_str(row, "ip"),
+        "port": port,
+        "meta_data": meta,
+    }
+    for column in CREDENTIAL_COLUMNS:
+        if column in row:
+            values[column] = _optional_str(row, column)
+    return values
+
+
+# -------------------------------------------------------------------
+# parsing (request body chunks -> rows)
+# -------------------------------------------------------------------
+async def _lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[Tuple[int, str]]:
+    """Decode a UTF-8 byte stream into (line_number, line) without buffering it."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    max_bytes = settings.DEVICE_IMPORT_MAX_LINE_BYTES
+    pending = ""
+    number = 0
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *complete, pending = pending.split("\n")
+        for line in complete:
+            number += 1
+            yield number, line.rstrip("\r")
+        if len(pending) > max_bytes:
+            raise DeviceRowError("line %d is longer than %d bytes" % (number + 1, max_bytes))
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield number + 1, pending.rstrip("\r")
+
+
+async def parse_ndjson(chunks: AsyncIterable[bytes]) -> AsyncIterator[ParsedRow]:
+    async for number, line in _lines(chunks):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as e:
+            yield number, DeviceRowError("invalid JSON: %s" % e)
+
+
+async def parse_csv(chunks: AsyncIterable[bytes]) -> AsyncIterator[ParsedRow]:
+    """Rows of a CSV with a header naming the columns; meta_data is JSON text."""
+    header: Optional[List[str]] = None
+    record: List[str] = []
+    start = 0
+    async for number, line in _lines(chunks):
+        if not record:
+            start = number
+        record.append(line)
+        # a quoted field can span lines; quotes are balanced once it ends
+        if sum(part.count('"') for part in record) % 2:
+            continue
+        fields = next(csv.reader(["\n".join(record)]), [])
+        record = []
+        if not any(f.strip() for f in fields):
+            continue
+
+        if header is None:
+            header = [f.strip() for f in fields]
+            unknown = set(header) - set(COLUMNS)
+            if unknown or "device_id" not in header:
+                raise DeviceRowError(
+                    "CSV header must name device_id and only these columns: %s"
+                    % ", ".join(COLUMNS)
+                )
+            continue
+
+        if len(fields) != len(header):
+            yield start, DeviceRowError(
+                "expected %d fields, got %d" % (len(header), len(fields))
+            )
+            continue
+        row: Dict[str, Any] = dict(zip(header, fields))
+        meta = row.get("meta_data")
+        if meta:
+            try:
+                row["meta_data"] = json.loads(meta)
+            except ValueError as e:
+                yield start, DeviceRowError("meta_data is not valid JSON: %s" % e)
+                continue
+        elif meta is not None:
+            # empty cells are null, meta_data included
+            row["meta_data"] = None
+        yield start, row
+
+    if record:
+        yield start, DeviceRowError("unterminated quoted field")
+
+
+PARSERS = {"ndjson": parse_ndjson, "csv": parse_csv}
+
+
+# -------------------------------------------------------------------
+# import
+# -------------------------------------------------------------------
+def _upsert(rows: List[Dict[str, Any]]):
+    stmt = insert(StreamingDevice).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[StreamingDevice.device_id],
+        set_={c: stmt.excluded[c] for c in rows[0] if c != "device_id"},
+    )
+
+
+async def _write(rows: List[Dict[str, Any]]) -> None:
+    device_ids = [row["device_id"] for row in rows]
+    # one statement per column set: rows without credentials leave them be
+    groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+    for row in rows:
+        groups.setdefault(tuple(row), []).append(row)
+    async with async_session() as db:
+        async with db.begin():
+            for group in groups.values():
+                await db.execute(_upsert(group))
+            channel = settings.DEVICE_REGISTRY_NOTIFY_CHANNEL
+            if channel:
+                # delivered on commit, so other workers reload these devices
+                await db.execute(
+                    text(
+                        "SELECT pg_notify(:channel, device_id) "
+                        "FROM unnest(CAST(:ids AS text[])) AS device_id"
+                    ),
+                    {"channel": channel, "ids": device_ids},
+                )
+    device_registry.invalidate(device_ids)
+
+
+class ImportResult:
+    def __init__(self, max_errors: int):
+        self.max_errors = max_errors
+        self.received = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors: List[Dict[str, Any]] = []
+        # set when the body itself could not be read any further
+        self.error: Optional[str] = None
+
+    def fail(self, line: int, device_id: Any, error: str) -> None:
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "device_id": device_id, "error": error})
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "received": self.received,
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+            "error": self.error,
+        }
+
+
+async def _flush(batch: List[Tuple[int, Dict[str, Any]]], result: ImportResult) -> None:
+    # a later row for the same device wins, as it would row by row
+    # (Postgres refuses to upsert one key twice in a statement)
+    latest: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+    lines: Dict[str, List[int]] = {}
+    for line, row in batch:
+        latest.pop(row["device_id"], None)
+        latest[row["device_id"]] = (line, row)
+        lines.setdefault(row["device_id"], []).append(line)
+
+    try:
+        await _write([row for _, row in latest.values()])
+        result.imported += len(batch)
+        return
+    except SQLAlchemyError:
+        logger.exception("Device import batch of %d rows failed", len(latest))
+
+    # find the rows the database rejected, one transaction each
+    # rows replaced by a later one for the same device share its fate
+    for _, row in latest.values():
+        device_id = row["device_id"]
+        try:
+            await _write([row])
+            result.imported += len(lines[device_id])
+        except SQLAlchemyError as e:
+            # only DBAPIError carries the driver's message in .orig
+            error = getattr(e, "orig", None) or e
+            for line in lines[device_id]:
+                result.fail(line, device_id, "database error: %s" % error)
+
+
+async def import_devices(
+    rows: AsyncIterable[ParsedRow],
+    dry_run: bool = False,
+) -> ImportResult:
+    """Validate rows and upsert them in chunked transactions.
+
+    Each chunk of DEVICE_IMPORT_BATCH_SIZE valid rows is written with one
+    multi-row INSERT ... ON CONFLICT DO UPDATE in its own transaction, so a
+    failing chunk does not undo the ones before it. Invalid rows are
+    reported with their line number and skipped. A body that cannot be
+    parsed any further (bad CSV header, overlong line) stops the import
+    and is reported in ImportResult.error.
+    """
+    result = ImportResult(settings.DEVICE_IMPORT_MAX_ERRORS)
+    batch_size = max(1, min(settings.DEVICE_IMPORT_BATCH_SIZE, _MAX_BATCH_ROWS))
+    batch: List[Tuple[int, Dict[str, Any]]] = []
+
+    try:
+        async for line, raw in rows:
+            result.received += 1
+            if isinstance(raw, DeviceRowError):
+                result.fail(line, None, str(raw))
+                continue
+            try:
+                row = validate_device(raw)
+            except DeviceRowError as e:
+                device_id = raw.get("device_id") if isinstance(raw, dict) else None
+                result.fail(line, device_id, str(e))
+                continue
+
+            if dry_run:
+                result.imported += 1
+                continue
+            batch.append((line, row))
+            if len(batch) >= batch_size:
+                await _flush(batch, result)
+                batch = []
+    except DeviceRowError as e:
+        result.error = str(e)
+    finally:
+        # keep what was valid even if the body ends badly
+        if batch:
+            await _flush(batch, result)
+    return result
+
+
+# -------------------------------------------------------------------
+# export
+# -------------------------------------------------------------------
+def _export_row(device: StreamingDevice) -> Dict[str, Any]:
+    return {
+        "device_id": device.device_id,
+        "device_type": device.device_type.value,
+        "ip": device.ip,
+        "port": device.port,
+        "username": device.username,
+        "password": device.password,
+        "meta_data": device.meta_data,
+    }
+
+
+async def export_devices(
+    fmt: str,
+    include_credentials: bool = False,
+) -> AsyncIterator[bytes]:
+    """Stream every device as NDJSON or CSV from a server-side cursor."""
+    columns = COLUMNS
+    if not include_credentials:
+        columns = tuple(c for c in COLUMNS if c not in CREDENTIAL_COLUMNS)
+
+    stmt = select(StreamingDevice).order_by(StreamingDevice.device_id)
+    stmt = stmt.execution_options(yield_per=settings.DEVICE_EXPORT_BATCH_SIZE)
+
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    if fmt == "csv":
+        writer.writerow(columns)
+
+    async with async_session() as db:
+        result = await db.stream_scalars(stmt)
+        async for partition in result.partitions():
+            for device in partition:
+                row = _export_row(device)
+                if not include_credentials:
+                    for column in CREDENTIAL_COLUMNS:
+                        del row[column]
+                if fmt == "csv":
+                    if row["meta_data"] is not None:
+                        row["meta_data"] = json.dumps(row["meta_data"])
+                    writer.writerow(
+                        ["" if row[c] is None else row[c] for c in columns]
+                    )
+                else:
+                    buf.write(json.dumps(row))
+                    buf.write("\n")
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+            # loaded rows are not needed again; keep memory flat
+            db.expunge_all()
+    if buf.tell():
+        yield buf.getvalue().encode()
@@ -0,0 +1,403 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Text, cast, func, select
+
+from core.config import settings
+from db.session import async_session, engine
+from models.streaming_device import DeviceType, StreamingDevice
+from services.stream_profiles import StreamProfile, parse_stream_profiles
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceRecord:
+    """Immutable snapshot of a streaming_devices row plus its stream index."""
+
+    __slots__ = (
+        "device_id",
+        "device_type",
+        "ip",
+        "port",
+        "username",
+        "password",
+        "meta_data",
+        "fingerprint",
+        "profiles",
+        "history",
+    )
+
+    def __init__(
+        self,
+        device_id: str,
+        device_type: DeviceType,
+        ip: Optional[str],
+        port: Optional[int],
+        username: Optional[str],
+        password: Optional[str],
+        meta_data: Any,
+        fingerprint: Optional[str] = None,
+    ):
+        self.device_id = device_id
+        self.device_type = device_type
+        self.ip = ip
+        self.port = port
+        self.username = username
+        self.password = password
+        self.meta_data = meta_data
+        self.fingerprint = fingerprint
+        # camera_id -> stream profiles smallest first (None for plain
+        # cameras), built once so lookups do not scan meta_data per request
+        self.profiles: Dict[Optional[str], List[StreamProfile]] = _index_profiles(
+            device_type, meta_data
+        )
+        # camera_id -> profile recorded into the frame history
+        self.history: Dict[Optional[str], StreamProfile] = _index_history(
+            device_type, meta_data, self.profiles
+        )
+
+    @classmethod
+    def from_model(
+        cls,
+        device: StreamingDevice,
+        fingerprint: Optional[str] = None,
+    ):
+        return cls(
+            device_id=device.device_id,
+            device_type=device.device_type,
+            ip=device.ip,
+            port=device.port,
+            username=device.username,
+            password=device.password,
+            meta_data=device.meta_data,
+            fingerprint=fingerprint,
+        )
+
+    @property
+    def camera_ids(self) -> List[str]:
+        return [cid for cid in self.profiles if cid is not None]
+
+
+def _index_profiles(
+    device_type: DeviceType,
+    meta: Any,
+) -> Dict[Optional[str], List[StreamProfile]]:
+    if device_type == DeviceType.camera:
+        if isinstance(meta, dict):
+            profiles = parse_stream_profiles(meta)
+            if profiles:
+                return {None: profiles}
+        return {}
+
+    index: Dict[Optional[str], List[StreamProfile]] = {}
+    if isinstance(meta, list):
+        for cam in meta:
+            if not isinstance(cam, dict):
+                continue
+            camera_id = cam.get("camera_id")
+            if not camera_id or camera_id in index:
+                # first entry wins, matching the old linear scan
+                continue
+            profiles = parse_stream_profiles(cam)
+            if profiles:
+                index[camera_id] = profiles
+    return index
+
+
+def _index_history(
+    device_type: DeviceType,
+    meta: Any,
+    profiles: Dict[Optional[str], List[StreamProfile]],
+) -> Dict[Optional[str], StreamProfile]:
+    if device_type == DeviceType.camera:
+        entries = [(None, meta)] if isinstance(meta, dict) else []
+    elif isinstance(meta, list):
+        entries = [
+            (cam.get("camera_id"), cam) for cam in meta if isinstance(cam, dict)
+        ]
+    else:
+        entries = []
+
+    index: Dict[Optional[str], StreamProfile] = {}
+    for camera_id, entry in entries:
+        wanted = entry.get("history")
+        available = profiles.get(camera_id)
+        if not wanted or not available or camera_id in index:
+            continue
+        # "history": true records the biggest stream, "history": "sub" a named one
+        chosen = available[-1]
+        if isinstance(wanted, str):
+            chosen = next((p for p in available if p.name == wanted), chosen)
+        index[camera_id] = chosen
+    return index
+
+
+# md5 over every column the service reads, computed in Postgres so a
+# refresh only has to pull (device_id, md5) pairs to spot changed rows
+_fingerprint = func.md5(
+    func.concat_ws(
+        "|",
+        cast(StreamingDevice.device_type, Text),
+        func.coalesce(StreamingDevice.ip, ""),
+        func.coalesce(cast(StreamingDevice.port, Text), ""),
+        func.coalesce(StreamingDevice.username, ""),
+        func.coalesce(StreamingDevice.password, ""),
+        func.coalesce(cast(StreamingDevice.meta_data, Text), ""),
+    )
+)
+
+
+class DatabaseDeviceSource:
+    """Loads device records from Postgres."""
+
+    async def fetch(
+        self,
+        device_ids: Optional[Iterable[str]] = None,
+        limit: Optional[int] = None,
+    ) -> List[DeviceRecord]:
+        stmt = select(StreamingDevice, _fingerprint)
+        if device_ids is not None:
+            stmt = stmt.where(StreamingDevice.device_id.in_(list(device_ids)))
+        if limit is not None:
+            stmt = stmt.limit(limit)
+
+        records = []
+        async with async_session() as db:
+            result = await db.stream(stmt.execution_options(yield_per=1000))
+            async for device, fingerprint in result:
+                records.append(DeviceRecord.from_model(device, fingerprint))
+        return records
+
+    async def fetch_fingerprints(self) -> Dict[str, str]:
+        stmt = select(StreamingDevice.device_id, _fingerprint)
+        async with async_session() as db:
+            result = await db.stream(stmt.execution_options(yield_per=5000))
+            return {device_id: fp async for device_id, fp in result}
+
+    async def listen(self, channel: str, callback) -> None:
+        """Call callback(payload) for every NOTIFY on channel until cancelled."""
+        async with engine.connect() as conn:
+            raw = await conn.get_raw_connection()
+            driver = raw.driver_connection
+
+            def on_notify(_conn, _pid, _channel, payload):
+                callback(payload)
+
+            await driver.add_listener(channel, on_notify)
+            try:
+                await asyncio.Future()
+            finally:
+                await driver.remove_listener(channel, on_notify)
+
+
+class DeviceRegistry:
+    """Read-through in-memory cache of streaming devices.
+
+    Devices are loaded once at startup and kept in an LRU bounded by
+    max_devices; misses fall through to the source. Entries are refreshed
+    incrementally by comparing row fingerprints on a timer, and can be
+    invalidated explicitly (HTTP hook or Postgres NOTIFY).
+    """
+
+    def __init__(
+        self,
+        source,
+        max_devices: int,
+        refresh_interval_seconds: float,
+        negative_ttl_seconds: float,
+    ):
+        self.source = source
+        self.max_devices = max_devices
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+
+        self._devices: "OrderedDict[str, DeviceRecord]" = OrderedDict()
+        self._missing: Dict[str, float] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def records(self) -> List[DeviceRecord]:
+        """Snapshot of the devices currently held, without touching LRU order."""
+        return list(self._devices.values())
+
+    # ---------------------------------------------------------------
+    # lookups
+    # ---------------------------------------------------------------
+    def peek(self, device_id: str) -> Optional[DeviceRecord]:
+        record = self._devices.get(device_id)
+        if record is not None:
+            self._devices.move_to_end(device_id)
+        return record
+
+    async def get(self, device_id: str) -> Optional[DeviceRecord]:
+        record = self.peek(device_id)
+        if record is not None:
+            return record
+        return (await self.get_many([device_id])).get(device_id)
+
+    async def get_many(self, device_ids: Iterable[str]) -> Dict[str, DeviceRecord]:
+        found: Dict[str, DeviceRecord] = {}
+        misses = []
+        waits: List[Tuple[str, asyncio.Future]] = []
+        now = time.monotonic()
+
+        for device_id in set(device_ids):
+            record = self.peek(device_id)
+            if record is not None:
+                found[device_id] = record
+            elif self._missing.get(device_id, 0) > now:
+                continue
+            elif device_id in self._loading:
+                waits.append((device_id, self._loading[device_id]))
+            else:
+                misses.append(device_id)
+
+        if misses:
+            fut = asyncio.get_running_loop().create_future()
+            for device_id in misses:
+                self._loading[device_id] = fut
+            try:
+                records = await self.source.fetch(misses)
+                for record in records:
+                    self._store(record)
+                    found[record.device_id] = record
+                loaded = {r.device_id for r in records}
+                expires = time.monotonic() + self.negative_ttl_seconds
+                for device_id in misses:
+                    if device_id not in loaded:
+                        self._missing[device_id] = expires
+                fut.set_result(None)
+            except Exception as e:
+                fut.set_exception(e)
+                fut.exception()
+                raise
+            except BaseException:
+                fut.cancel()
+                raise
+            finally:
+                for device_id in misses:
+                    self._loading.pop(device_id, None)
+
+        retry = []
+        for device_id, fut in waits:
+            try:
+                await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                # the loading request was cancelled, not us: load again
+                if not fut.cancelled():
+                    raise
+                retry.append(device_id)
+                continue
+            record = self._devices.get(device_id)
+            if record is not None:
+                found[device_id] = record
+
+        if retry:
+            found.update(await self.get_many(retry))
+
+        return found
+
+    # ---------------------------------------------------------------
+    # maintenance
+    # ---------------------------------------------------------------
+    def _store(self, record: DeviceRecord) -> None:
+        self._missing.pop(record.device_id, None)
+        self._devices[record.device_id] = record
+        self._devices.move_to_end(record.device_id)
+        while len(self._devices) > self.max_devices:
+            self._devices.popitem(last=False)
+
+        if len(self._missing) > self.max_devices:
+            now = time.monotonic()
+            self._missing = {k: v for k, v in self._missing.items() if v > now}
+
+    def invalidate(self, device_ids: Optional[Iterable[str]] = None) -> None:
+        """Drop devices (all if None); the next lookup reloads them."""
+        if device_ids is None:
+            self._devices.clear()
+            self._missing.clear()
+            return
+        for device_id in device_ids:
+            self._devices.pop(device_id, None)
+            self._missing.pop(device_id, None)
+
+    async def load(self) -> None:
+        records = await self.source.fetch(limit=self.max_devices)
+        for record in records:
+            self._store(record)
+        logger.info("Device registry loaded %d devices", len(records))
+
+    async def refresh(self) -> None:
+        fingerprints = await self.source.fetch_fingerprints()
+
+        changed = []
+        for device_id, record in list(self._devices.items()):
+            fp = fingerprints.get(device_id)
+            if fp is None:
+                self._devices.pop(device_id, None)
+            elif fp != record.fingerprint:
+                changed.append(device_id)
+
+        # previously unknown ids may exist now
+        self._missing = {
+            k: v for k, v in self._missing.items() if k not in fingerprints
+        }
+
+        if changed:
+            for record in await self.source.fetch(changed):
+                self._store(record)
+            logger.info("Device registry refreshed %d changed devices", len(changed))
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval_seconds)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Device registry refresh failed")
+
+    async def _listen_loop(self, channel: str) -> None:
+        def on_notify(payload: str) -> None:
+            # payload is a device_id, or empty to drop everything
+            self.invalidate([payload] if payload else None)
+
+        while True:
+            try:
+                await self.source.listen(channel, on_notify)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Device registry LISTEN %s failed", channel)
+            await asyncio.sleep(self.refresh_interval_seconds)
+
+    async def start(self) -> None:
+        try:
+            await self.load()
+        except Exception:
+            # lookups still fall through to the source on demand
+            logger.exception("Device registry initial load failed")
+
+        self._tasks.append(asyncio.ensure_future(self._refresh_loop()))
+        channel = settings.DEVICE_REGISTRY_NOTIFY_CHANNEL
+        if channel and hasattr(self.source, "listen"):
+            self._tasks.append(asyncio.ensure_future(self._listen_loop(channel)))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+
+device_registry = DeviceRegistry(
+    source=DatabaseDeviceSource(),
+    max_devices=settings.DEVICE_REGISTRY_MAX_DEVICES,
+    refresh_interval_seconds=settings.DEVICE_REGISTRY_REFRESH_SECONDS,
+    negative_ttl_seconds=settings.DEVICE_REGISTRY_NEGATIVE_TTL_SECONDS,
+)
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+from typing import Dict, Hashable, Optional, Set
+
+from core.config import settings
+from services.session_pool import session_pool
+from services.frame_cache import frame_cache
+from services.frame_fingerprint import fingerprint
+from services.frame_transform import DEFAULT_SPEC, transform_and_encode
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_live(frame):
+    # the fingerprint is made here too, so the cache refresh costs the
+    # loop nothing at stream fps
+    return transform_and_encode(frame, DEFAULT_SPEC), fingerprint(frame)
+
+
+class Subscriber:
+    """One live viewer. Holds at most one pending frame; older ones are dropped."""
+
+    def __init__(self, broadcast: "CameraBroadcast", fps: float):
+        self.broadcast = broadcast
+        self.fps = fps
+        self.dropped = 0
+
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._interval = 1.0 / fps
+        self._next_due = 0.0
+
+    def offer(self, jpeg: bytes, now: float) -> None:
+        if now < self._next_due:
+            return
+        self._next_due = now + self._interval
+
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(jpeg)
+
+    async def next_frame(self) -> bytes:
+        return await self._queue.get()
+
+
+class CameraBroadcast:
+    """Decodes and encodes one camera once and fans the JPEGs out to subscribers."""
+
+    def __init__(self, key: Hashable, rtsp_url: str):
+        self.key = key
+        self.rtsp_url = rtsp_url
+        self.subscribers: Set[Subscriber] = set()
+        # kept up to date on the loop so the reader thread never has to
+        # iterate subscribers while they change
+        self.fps = 0.0
+
+        self._loop = asyncio.get_running_loop()
+        self._new_frame = asyncio.Event()
+        self._latest = None
+        self._next_due = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._session = None
+
+    def add(self, sub: Subscriber) -> None:
+        self.subscribers.add(sub)
+        self._update_fps()
+
+    def remove(self, sub: Subscriber) -> None:
+        self.subscribers.discard(sub)
+        self._update_fps()
+
+    def _update_fps(self) -> None:
+        if not self.subscribers:
+            self.fps = 0.0
+            return
+        self.fps = min(
+            max(s.fps for s in self.subscribers), settings.STREAM_MAX_FPS
+        )
+
+    def start(self) -> None:
+        self._session = session_pool.hold(self.rtsp_url)
+        self._session.add_listener(self._on_frame)
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        if self._session is not None:
+            self._session.remove_listener(self._on_frame)
+            session_pool.release(self.rtsp_url, close=True)
+            self._session = None
+
+    def _on_frame(self, frame, ts: float) -> None:
+        # runs on the reader thread: only wake the loop at the wanted rate
+        if ts < self._next_due:
+            return
+        fps = self.fps
+        if fps <= 0:
+            return
+        self._next_due = ts + 1.0 / fps
+        self._latest = frame
+        self._loop.call_soon_threadsafe(self._new_frame.set)
+
+    async def _run(self) -> None:
+        while True:
+            await self._new_frame.wait()
+            self._new_frame.clear()
+            frame, self._latest = self._latest, None
+            if frame is None:
+                continue
+
+            try:
+                jpeg, fp = await self._loop.run_in_executor(
+                    None, _encode_live, frame
+                )
+            except Exception:
+                logger.exception("Failed to encode live frame for %s", self.key)
+                continue
+
+            frame_cache.put(self.key, frame, {DEFAULT_SPEC: jpeg}, fp=fp)
+            now = self._loop.time()
+            for sub in list(self.subscribers):
+                sub.offer(jpeg, now)
+
+
+class StreamHub:
+    """Registry of live broadcasts keyed by (device_id, camera_id, profile)."""
+
+    def __init__(self):
+        self._broadcasts: Dict[Hashable, CameraBroadcast] = {}
+
+    def subscribe(self, key: Hashable, rtsp_url: str, fps: float) -> Subscriber:
+        broadcast = self._broadcasts.get(key)
+        if broadcast is None:
+            broadcast = CameraBroadcast(key, rtsp_url)
+            broadcast.start()
+            self._broadcasts[key] = broadcast
+
+        sub = Subscriber(broadcast, fps)
+        broadcast.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        broadcast = sub.broadcast
+        broadcast.remove(sub)
+        if sub.dropped:
+            logger.info(
+                "Live subscriber for %s left after dropping %d frames",
+                broadcast.key,
+                sub.dropped,
+            )
+
+        if not broadcast.subscribers:
+            # last viewer gone: stop the upstream capture as well
+            self._broadcasts.pop(broadcast.key, None)
+            broadcast.stop()
+
+    def shutdown(self) -> None:
+        for broadcast in list(self._broadcasts.values()):
+            broadcast.stop()
+        self._broadcasts.clear()
+
+
+stream_hub = StreamHub()
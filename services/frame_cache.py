@@ -0,0 +1,298 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+from core import metrics
+from core.config import settings
+from services.frame_fingerprint import SceneTracker, fingerprint, scene_tracker
+from services.frame_transform import (
+    DEFAULT_SPEC,
+    FrameSpec,
+    decode,
+    transform_and_encode,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CachedFrame:
+    """A source frame plus the encoded variants made from it.
+
+    The decoded frame is only held until its full-size JPEG (DEFAULT_SPEC)
+    exists; after that other variants are made by decoding that JPEG.
+    """
+
+    __slots__ = (
+        "key",
+        "frame",
+        "captured_at",
+        "fingerprint",
+        "generation",
+        "variants",
+        "nbytes",
+        "_pending",
+    )
+
+    def __init__(
+        self,
+        key: Hashable,
+        frame,
+        captured_at: float,
+        fingerprint=None,
+        generation: int = 0,
+    ):
+        self.key = key
+        self.frame = frame
+        self.captured_at = captured_at
+        self.fingerprint = fingerprint
+        self.generation = generation
+        self.variants: "OrderedDict[FrameSpec, bytes]" = OrderedDict()
+        self.nbytes = 0 if frame is None else frame.nbytes
+        # in-flight encodes by spec; None is the in-flight decode
+        self._pending: Dict[Optional[FrameSpec], asyncio.Future] = {}
+
+    def drop_frame(self) -> int:
+        """Let go of the decoded frame once the full-size JPEG stands in for
+        it; return the bytes freed."""
+        if self.frame is None or DEFAULT_SPEC not in self.variants:
+            return 0
+        freed = self.frame.nbytes
+        self.frame = None
+        self.nbytes -= freed
+        return freed
+
+
+class FrameCache:
+    """LRU cache of source frames with a TTL and single-flight misses.
+
+    Entries are keyed by (device_id, camera_id, stream profile). Concurrent
+    misses for the same key share one in-flight grab instead of each opening
+    the camera, and each entry keeps the encoded variants (size/quality/
+    format/crop) requested from it so repeated thumbnail requests are not
+    re-encoded. A decoded 4K frame is ~25 MB against a few hundred KB for
+    its JPEG, so entries keep the frame only until the full-size JPEG is
+    encoded.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float,
+        max_entries: int,
+        max_bytes: int,
+        max_variants: int,
+        scene_tracker: Optional[SceneTracker] = None,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_variants = max_variants
+        self.scene_tracker = scene_tracker
+
+        self._entries: "OrderedDict[Hashable, CachedFrame]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}
+
+    def get(self, key: Hashable, max_age_seconds: float) -> Optional[CachedFrame]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        age = time.monotonic() - entry.captured_at
+        if age > self.ttl_seconds:
+            self._remove(key)
+            return None
+        if age > max_age_seconds:
+            return None
+
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(
+        self,
+        key: Hashable,
+        frame,
+        variants: Optional[Dict[FrameSpec, bytes]] = None,
+        generation: Optional[int] = None,
+        fp=None,
+    ) -> CachedFrame:
+        # callers off the loop can pass the frame's fingerprint along with
+        # its variants, so storing a frame costs the loop next to nothing.
+        # frame may be None when variants has the full-size JPEG.
+        entry = CachedFrame(key, frame, time.monotonic())
+        if self.scene_tracker is not None:
+            entry.fingerprint = fingerprint(frame) if fp is None else fp
+            if generation is not None:
+                entry.generation = self.scene_tracker.adopt(
+                    key, entry.fingerprint, generation
+                )
+            else:
+                entry.generation = self.scene_tracker.observe(key, entry.fingerprint)
+        for spec, data in (variants or {}).items():
+            entry.variants[spec] = data
+            entry.nbytes += len(data)
+        entry.drop_frame()
+
+        if entry.nbytes > self.max_bytes:
+            return entry
+
+        self._remove(key)
+        self._entries[key] = entry
+        self._bytes += entry.nbytes
+        self._evict()
+        return entry
+
+    def invalidate(self, key: Hashable) -> None:
+        self._remove(key)
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.nbytes
+
+    def _evict(self) -> None:
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            old_key = next(iter(self._entries))
+            self._remove(old_key)
+
+    async def get_or_grab(
+        self,
+        key: Hashable,
+        grab: Callable[[], Awaitable],
+        max_age_ms: Optional[int] = None,
+    ) -> CachedFrame:
+        if max_age_ms is None:
+            max_age_seconds = self.ttl_seconds
+        else:
+            max_age_seconds = min(max_age_ms / 1000.0, self.ttl_seconds)
+
+        entry = self.get(key, max_age_seconds)
+        if entry is not None:
+            metrics.frame_cache_total.inc("hit")
+            return entry
+
+        fut = self._inflight.get(key)
+        if fut is not None:
+            metrics.frame_cache_total.inc("shared")
+        else:
+            metrics.frame_cache_total.inc("miss")
+            fut = asyncio.ensure_future(self._grab_and_store(key, grab))
+            fut.add_done_callback(_consume_exception)
+            self._inflight[key] = fut
+
+        # shield so one cancelled waiter does not abort the shared grab;
+        # the grab itself is only cancelled once every waiter has gone
+        self._waiters[fut] = self._waiters.get(fut, 0) + 1
+        try:
+            return await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            if self._waiters[fut] == 1 and not fut.done():
+                fut.cancel()
+                if self._inflight.get(key) is fut:
+                    del self._inflight[key]
+            raise
+        finally:
+            self._waiters[fut] -= 1
+            if not self._waiters[fut]:
+                del self._waiters[fut]
+
+    async def _grab_and_store(
+        self,
+        key: Hashable,
+        grab: Callable[[], Awaitable],
+    ) -> CachedFrame:
+        try:
+            result = await grab()
+            # grab returns the frame, or (frame, variants[, generation])
+            # when it already has encoded forms of it
+            if isinstance(result, tuple):
+                return self.put(key, *result)
+            return self.put(key, result)
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+
+    async def encode(self, entry: CachedFrame, spec: FrameSpec) -> bytes:
+        """Return entry encoded as spec, encoding at most once per variant."""
+        data = entry.variants.get(spec)
+        if data is not None:
+            entry.variants.move_to_end(spec)
+            return data
+
+        fut = entry._pending.get(spec)
+        if fut is None:
+            fut = asyncio.ensure_future(self._encode(entry, spec))
+            fut.add_done_callback(_consume_exception)
+            entry._pending[spec] = fut
+        return await asyncio.shield(fut)
+
+    async def _source(self, entry: CachedFrame):
+        """The decoded frame of entry, decoding its full-size JPEG if dropped."""
+        if entry.frame is not None:
+            return entry.frame
+        fut = entry._pending.get(None)
+        if fut is None:
+            loop = asyncio.get_running_loop()
+            fut = loop.run_in_executor(None, decode, entry.variants[DEFAULT_SPEC])
+            fut.add_done_callback(_consume_exception)
+            fut.add_done_callback(lambda _: entry._pending.pop(None, None))
+            entry._pending[None] = fut
+        return await asyncio.shield(fut)
+
+    async def _encode(self, entry: CachedFrame, spec: FrameSpec) -> bytes:
+        try:
+            frame = await self._source(entry)
+            loop = asyncio.get_running_loop()
+            with metrics.stage("encode"):
+                data = await loop.run_in_executor(
+                    None, transform_and_encode, frame, spec
+                )
+        finally:
+            entry._pending.pop(spec, None)
+
+        entry.variants[spec] = data
+        added = len(data)
+        while len(entry.variants) > self.max_variants:
+            # the full-size JPEG is kept: it is the source once the frame
+            # has been dropped
+            oldest = next((s for s in entry.variants if s != DEFAULT_SPEC), None)
+            if oldest is None:
+                break
+            added -= len(entry.variants.pop(oldest))
+        entry.nbytes += added
+        # drop_frame() takes the frame off entry.nbytes itself
+        added -= entry.drop_frame()
+
+        if self._entries.get(entry.key) is entry:
+            self._bytes += added
+            self._evict()
+        return data
+
+
+def _consume_exception(fut: asyncio.Future) -> None:
+    # every waiter may have gone away; keep asyncio from warning about it
+    if not fut.cancelled():
+        fut.exception()
+
+
+frame_cache = FrameCache(
+    ttl_seconds=settings.FRAME_CACHE_TTL_MS / 1000.0,
+    max_entries=settings.FRAME_CACHE_MAX_ENTRIES,
+    max_bytes=settings.FRAME_CACHE_MAX_BYTES,
+    max_variants=settings.FRAME_CACHE_MAX_VARIANTS,
+    scene_tracker=scene_tracker,
+)
+metrics.add_gauge(
+    "streaming_frame_cache_entries",
+    "Frames held in the frame cache",
+    lambda: len(frame_cache._entries),
+)
+metrics.add_gauge(
+    "streaming_frame_cache_bytes",
+    "Bytes held in the frame cache",
+    lambda: frame_cache._bytes,
+)
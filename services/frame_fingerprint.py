@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import itertools
+import os
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+import cv2
+import numpy as np
+
+from core.config import settings
+
+FINGERPRINT_SIZE = 16
+
+
+def fingerprint(frame) -> np.ndarray:
+    """Tiny grayscale thumbnail of frame used to tell whether the scene changed."""
+    h, w = frame.shape[:2]
+    # stride down first so a 4K frame costs about the same as a small one
+    step = max(min(h, w) // (FINGERPRINT_SIZE * 8), 1)
+    small = cv2.resize(
+        frame[::step, ::step],
+        (FINGERPRINT_SIZE, FINGERPRINT_SIZE),
+        interpolation=cv2.INTER_AREA,
+    )
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return small
+
+
+def difference(a: np.ndarray, b: np.ndarray) -> float:
+    """Mean absolute difference of two fingerprints, on a 0-255 scale."""
+    return float(cv2.absdiff(a, b).mean())
+
+
+class _Scene:
+    __slots__ = ("generation", "references", "new_frame")
+
+    def __init__(self):
+        self.generation = 0
+        # generation -> fingerprint of the frame that started it
+        self.references: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self.new_frame = asyncio.Event()
+
+
+class SceneTracker:
+    """Numbers the distinct scenes seen per frame-cache key.
+
+    The generation only moves when a frame differs from the one that
+    started the current generation by more than change_threshold, so
+    noise and slow drift do not count as a change but drift that adds up
+    does. Generations are unique process-wide, so an ETag built from one
+    can never match a different picture, even after the key was evicted.
+    """
+
+    def __init__(self, change_threshold: float, max_keys: int, max_references: int = 8):
+        self.change_threshold = change_threshold
+        self.max_keys = max_keys
+        self.max_references = max_references
+        # ETags from another process (or before a restart) never match;
+        # workers sharing frames switch to the shared store's epoch
+        self.epoch = os.urandom(4).hex()
+
+        self._scenes: "OrderedDict[Hashable, _Scene]" = OrderedDict()
+        # random start, so workers sharing an epoch do not hand out the
+        # same numbers for different pictures
+        self._generations = itertools.count(int.from_bytes(os.urandom(4), "big") << 16)
+
+    def observe(self, key: Hashable, fp: np.ndarray) -> int:
+        """Record a new frame for key and return its generation."""
+        scene = self._scenes.get(key)
+        if scene is None:
+            scene = self._scenes[key] = _Scene()
+            while len(self._scenes) > self.max_keys:
+                self._scenes.popitem(last=False)
+        else:
+            self._scenes.move_to_end(key)
+
+        if not scene.references or (
+            difference(fp, next(reversed(scene.references.values())))
+            > self.change_threshold
+        ):
+            self._start_generation(scene, fp)
+
+        # wake long-polls so they can compare against their own threshold
+        scene.new_frame.set()
+        scene.new_frame = asyncio.Event()
+        return scene.generation
+
+    def adopt(self, key: Hashable, fp: np.ndarray, generation: int) -> int:
+        """Record a new frame for key whose generation was decided elsewhere
+        (by the worker that owns the camera's shared frame slot)."""
+        scene = self._scenes.get(key)
+        if scene is None:
+            scene = self._scenes[key] = _Scene()
+            while len(self._scenes) > self.max_keys:
+                self._scenes.popitem(last=False)
+        else:
+            self._scenes.move_to_end(key)
+
+        if scene.generation != generation:
+            scene.generation = generation
+            scene.references[generation] = fp
+            while len(scene.references) > self.max_references:
+                scene.references.popitem(last=False)
+
+        scene.new_frame.set()
+        scene.new_frame = asyncio.Event()
+        return generation
+
+    def mark_changed(self, key: Hashable, fp: np.ndarray) -> int:
+        """Start a new generation at fp, for a change below the global threshold."""
+        scene = self._scenes.get(key)
+        if scene is None:
+            return self.observe(key, fp)
+        self._start_generation(scene, fp)
+        return scene.generation
+
+    def _start_generation(self, scene: _Scene, fp: np.ndarray) -> None:
+        scene.generation = next(self._generations)
+        scene.references[scene.generation] = fp
+        while len(scene.references) > self.max_references:
+            scene.references.popitem(last=False)
+
+    def reference(self, key: Hashable, generation: int) -> Optional[np.ndarray]:
+        scene = self._scenes.get(key)
+        if scene is None:
+            return None
+        return scene.references.get(generation)
+
+    async def wait(self, key: Hashable, timeout: float) -> None:
+        """Return when the next frame for key is observed, or after timeout."""
+        scene = self._scenes.get(key)
+        if scene is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(scene.new_frame.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    # ---------------------------------------------------------------
+    # ETags
+    # ---------------------------------------------------------------
+    @staticmethod
+    def _digest(key: Hashable, variant: Hashable) -> str:
+        return hashlib.blake2b(
+            repr((key, variant)).encode(), digest_size=6
+        ).hexdigest()
+
+    def etag(self, key: Hashable, generation: int, variant: Hashable) -> str:
+        # weak: equal tags mean the same scene, not byte-identical images
+        return 'W/"%s-%x-%s"' % (self.epoch, generation, self._digest(key, variant))
+
+    def parse_etag(
+        self,
+        header: Optional[str],
+        key: Hashable,
+        variant: Hashable,
+    ) -> Optional[int]:
+        """Generation named by an If-None-Match header for key/variant, if any."""
+        if not header:
+            return None
+        digest = self._digest(key, variant)
+        for tag in header.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            parts = tag.strip('"').split("-")
+            if len(parts) != 3 or parts[0] != self.epoch or parts[2] != digest:
+                continue
+            try:
+                return int(parts[1], 16)
+            except ValueError:
+                continue
+        return None
+
+
+scene_tracker = SceneTracker(
+    change_threshold=settings.FRAME_CHANGE_THRESHOLD,
+    max_keys=settings.FRAME_FINGERPRINT_MAX_KEYS,
+)
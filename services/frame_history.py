@@ -0,0 +1,449 @@
+import asyncio
+import bisect
+import logging
+import mmap
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, Hashable, List, Optional, Tuple, Union
+
+from core.config import settings
+from services.device_registry import device_registry
+from services.frame_transform import FrameSpec, transform_and_encode
+from services.session_pool import PoolExhausted, session_pool
+
+logger = logging.getLogger(__name__)
+
+Buffer = Union[bytes, memoryview]
+
+
+class _Segment:
+    """A preallocated, memory-mapped spill file, reused once its frames expire."""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        self.owner: Optional["CameraHistory"] = None
+        self.pins = 0
+        self.reset(None)
+
+    def reset(self, owner: Optional["CameraHistory"]) -> None:
+        self.owner = owner
+        self.used = 0
+        self.times: List[float] = []
+        self.offsets: List[int] = []
+        self.lengths: List[int] = []
+
+    def fits(self, nbytes: int) -> bool:
+        return self.used + nbytes <= self.size
+
+    def append(self, ts: float, data: bytes) -> None:
+        end = self.used + len(data)
+        self.mm[self.used:end] = data
+        self.times.append(ts)
+        self.offsets.append(self.used)
+        self.lengths.append(len(data))
+        self.used = end
+
+    def view(self, i: int) -> memoryview:
+        start = self.offsets[i]
+        return memoryview(self.mm)[start:start + self.lengths[i]]
+
+    def close(self) -> None:
+        try:
+            self.mm.close()
+        except BufferError:
+            # a response still holds a view; the mapping goes with the process
+            pass
+
+
+class CameraHistory:
+    """Recorded frames of one camera: newest in memory, older ones in segments."""
+
+    def __init__(self, key: Hashable, rtsp_url: str):
+        self.key = key
+        self.rtsp_url = rtsp_url
+        self.memory: Deque[Tuple[float, bytes]] = deque()
+        self.memory_bytes = 0
+        self.segments: List[_Segment] = []
+
+        self.session = None
+        self.on_frame = None
+        self.encoding = False
+        self.next_due = 0.0
+
+
+class HistoryFrames:
+    """Frames returned by a history lookup; call release() once they are sent.
+
+    Frames spilled to disk are memoryviews straight into the segment mmap,
+    and the segment is kept from being reused until release().
+    """
+
+    def __init__(
+        self,
+        frames: List[Tuple[float, Buffer]],
+        segments: List[_Segment],
+        lock,
+    ):
+        self.frames = frames
+        self._segments = segments
+        self._lock = lock
+
+    def release(self) -> None:
+        with self._lock:
+            for segment in self._segments:
+                segment.pins -= 1
+            self._segments = []
+
+
+class FrameHistory:
+    """Per-camera ring buffer of recent encoded frames.
+
+    Cameras opted in through meta_data are recorded at a fixed rate by a
+    listener on their pooled RTSP session. The last memory_seconds stay in
+    memory; older frames are appended to preallocated mmap segment files,
+    and when the disk budget is used up the globally oldest segment is
+    recycled. Both budgets are shared by every camera.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        fps: float,
+        quality: int,
+        memory_seconds: float,
+        max_memory_bytes: int,
+        max_disk_bytes: int,
+        segment_bytes: int,
+        encode_workers: int,
+    ):
+        self.directory = directory
+        self.interval = 1.0 / fps
+        self.spec = FrameSpec(quality=quality)
+        self.memory_seconds = memory_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_disk_bytes // segment_bytes
+        self.encode_workers = encode_workers
+
+        self._cameras: Dict[Hashable, CameraHistory] = {}
+        self._segments: List[_Segment] = []
+        self._free: List[_Segment] = []
+        self._memory_bytes = 0
+        # recording happens on encode threads, lookups on the event loop
+        self._lock = threading.Lock()
+        self._allocating = False
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------------------------------------------------------------
+    # recording
+    # ---------------------------------------------------------------
+    def start_camera(self, key: Hashable, rtsp_url: str) -> None:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.encode_workers,
+                thread_name_prefix="frame-history",
+            )
+
+        camera = CameraHistory(key, rtsp_url)
+
+        def on_frame(frame, ts: float) -> None:
+            # reader thread: hand off to an encode worker at the history rate,
+            # skipping frames while the previous one is still being encoded
+            if ts < camera.next_due or camera.encoding:
+                return
+            camera.next_due = ts + self.interval
+            camera.encoding = True
+            self._executor.submit(self._record, camera, frame, time.time())
+
+        camera.session = session_pool.hold(rtsp_url)
+        camera.session.add_listener(on_frame)
+        camera.on_frame = on_frame
+        with self._lock:
+            self._cameras[key] = camera
+        logger.info("Recording frame history for %s", key)
+
+    def stop_camera(self, key: Hashable) -> None:
+        with self._lock:
+            camera = self._cameras.pop(key, None)
+            if camera is None:
+                return
+            self._memory_bytes -= camera.memory_bytes
+            camera.memory.clear()
+            for segment in camera.segments:
+                segment.reset(None)
+                self._free.append(segment)
+            camera.segments = []
+
+        if camera.session is not None:
+            camera.session.remove_listener(camera.on_frame)
+            # runs on the loop from sync(); release only signals the reader
+            # thread to stop and never joins it
+            session_pool.release(camera.rtsp_url, close=True)
+            camera.session = None
+        logger.info("Stopped frame history for %s", key)
+
+    def _record(self, camera: CameraHistory, frame, ts: float) -> None:
+        try:
+            data = transform_and_encode(frame, self.spec)
+            self._reserve_segment()
+            with self._lock:
+                if self._cameras.get(camera.key) is not camera:
+                    return
+                camera.memory.append((ts, data))
+                camera.memory_bytes += len(data)
+                self._memory_bytes += len(data)
+                self._spill(camera, ts)
+        except Exception:
+            logger.exception("Failed to record history frame for %s", camera.key)
+        finally:
+            camera.encoding = False
+
+    def _spill(self, camera: CameraHistory, now: float) -> None:
+        cutoff = now - self.memory_seconds
+        while camera.memory and camera.memory[0][0] < cutoff:
+            self._spill_one(camera)
+
+        # global memory budget: spill the oldest frames of any camera
+        while self._memory_bytes > self.max_memory_bytes:
+            oldest = min(
+                (c for c in self._cameras.values() if c.memory),
+                key=lambda c: c.memory[0][0],
+                default=None,
+            )
+            if oldest is None:
+                break
+            self._spill_one(oldest)
+
+    def _spill_one(self, camera: CameraHistory) -> None:
+        ts, data = camera.memory.popleft()
+        camera.memory_bytes -= len(data)
+        self._memory_bytes -= len(data)
+
+        if len(data) > self.segment_bytes:
+            return
+        segment = camera.segments[-1] if camera.segments else None
+        if segment is None or not segment.fits(len(data)):
+            segment = self._take_segment(camera)
+            if segment is None:
+                return
+        segment.append(ts, data)
+
+    def _reserve_segment(self) -> None:
+        """Keep one free segment ready while the disk budget allows.
+
+        Allocating a segment (fallocate + mmap of segment_bytes) takes a
+        while, so it happens here without the lock lookups also take, and
+        _take_segment only ever hands out segments that already exist.
+        """
+        with self._lock:
+            if (
+                self._allocating
+                or len(self._segments) >= self.max_segments
+                or any(not s.pins for s in self._free)
+            ):
+                return
+            self._allocating = True
+            path = os.path.join(
+                self.directory, "segment-%05d.dat" % len(self._segments)
+            )
+
+        segment = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            segment = _Segment(path, self.segment_bytes)
+        except OSError:
+            logger.exception("Failed to allocate history segment %s", path)
+        finally:
+            with self._lock:
+                self._allocating = False
+                if segment is not None:
+                    self._segments.append(segment)
+                    self._free.append(segment)
+
+    def _take_segment(self, camera: CameraHistory) -> Optional[_Segment]:
+        # a released segment may still be read by an unfinished response
+        segment = next((s for s in self._free if not s.pins), None)
+        if segment is not None:
+            self._free.remove(segment)
+        else:
+            # no spare: recycle the oldest segment nobody is reading
+            candidates = [
+                s for s in self._segments if s.owner is not None and not s.pins
+            ]
+            if not candidates:
+                return None
+            segment = min(candidates, key=lambda s: s.times[0] if s.times else 0.0)
+            segment.owner.segments.remove(segment)
+
+        segment.reset(camera)
+        camera.segments.append(segment)
+        return segment
+
+    # ---------------------------------------------------------------
+    # lookups
+    # ---------------------------------------------------------------
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._cameras
+
+    def nearest(self, key: Hashable, ts: float) -> Optional[HistoryFrames]:
+        """The recorded frame closest to ts, or None if nothing is recorded
+        or ts lies outside the retained span by more than two intervals."""
+        with self._lock:
+            camera = self._cameras.get(key)
+            if camera is None:
+                return None
+
+            oldest = next((s.times[0] for s in camera.segments if s.times), None)
+            if oldest is None and camera.memory:
+                oldest = camera.memory[0][0]
+            if camera.memory:
+                newest = camera.memory[-1][0]
+            else:
+                newest = next(
+                    (s.times[-1] for s in reversed(camera.segments) if s.times),
+                    None,
+                )
+            tolerance = 2 * self.interval
+            if oldest is None or not oldest - tolerance <= ts <= newest + tolerance:
+                return None
+
+            best = None  # (distance, ts, segment or None, index or data)
+            for segment in camera.segments:
+                i = bisect.bisect_left(segment.times, ts)
+                for j in (i - 1, i):
+                    if 0 <= j < len(segment.times):
+                        d = abs(segment.times[j] - ts)
+                        if best is None or d < best[0]:
+                            best = (d, segment.times[j], segment, j)
+            for frame_ts, data in camera.memory:
+                d = abs(frame_ts - ts)
+                if best is None or d < best[0]:
+                    best = (d, frame_ts, None, data)
+
+            if best is None:
+                return None
+            _, frame_ts, segment, ref = best
+            if segment is None:
+                return HistoryFrames([(frame_ts, ref)], [], self._lock)
+            segment.pins += 1
+            return HistoryFrames([(frame_ts, segment.view(ref))], [segment], self._lock)
+
+    def between(
+        self,
+        key: Hashable,
+        start: float,
+        end: float,
+        limit: int,
+    ) -> Optional[HistoryFrames]:
+        """Recorded frames with start <= ts <= end, oldest first, at most limit."""
+        with self._lock:
+            camera = self._cameras.get(key)
+            if camera is None:
+                return None
+
+            frames: List[Tuple[float, Buffer]] = []
+            pinned: List[_Segment] = []
+            for segment in camera.segments:
+                i = bisect.bisect_left(segment.times, start)
+                j = bisect.bisect_right(segment.times, end)
+                if i >= j:
+                    continue
+                segment.pins += 1
+                pinned.append(segment)
+                for k in range(i, j):
+                    frames.append((segment.times[k], segment.view(k)))
+                if len(frames) >= limit:
+                    break
+            if len(frames) < limit:
+                frames.extend(
+                    (frame_ts, data)
+                    for frame_ts, data in camera.memory
+                    if start <= frame_ts <= end
+                )
+            return HistoryFrames(frames[:limit], pinned, self._lock)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "cameras": len(self._cameras),
+                "memory_bytes": self._memory_bytes,
+                "segments": len(self._segments),
+                "segments_in_use": len(self._segments) - len(self._free),
+            }
+
+    # ---------------------------------------------------------------
+    # opt-in tracking
+    # ---------------------------------------------------------------
+    def sync(self) -> None:
+        """Start/stop recorders to match the history flags in the registry."""
+        wanted: Dict[Hashable, str] = {}
+        for record in device_registry.records():
+            for camera_id, profile in record.history.items():
+                wanted[(record.device_id, camera_id)] = profile.rtsp_url
+
+        for key, camera in list(self._cameras.items()):
+            if wanted.get(key) != camera.rtsp_url:
+                self.stop_camera(key)
+
+        for key, rtsp_url in wanted.items():
+            if key in self._cameras:
+                continue
+            try:
+                self.start_camera(key, rtsp_url)
+            except PoolExhausted:
+                logger.warning("No RTSP session for frame history of %s", key)
+
+    async def _sync_loop(self, interval: float) -> None:
+        while True:
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Frame history sync failed")
+            await asyncio.sleep(interval)
+
+    def start(self, sync_interval: float) -> None:
+        self._task = asyncio.ensure_future(self._sync_loop(sync_interval))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        for key in list(self._cameras):
+            self.stop_camera(key)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        with self._lock:
+            for segment in self._segments:
+                segment.close()
+            self._segments.clear()
+            self._free.clear()
+
+
+frame_history = FrameHistory(
+    directory=settings.HISTORY_DIR,
+    fps=settings.HISTORY_FPS,
+    quality=settings.HISTORY_JPEG_QUALITY,
+    memory_seconds=settings.HISTORY_MEMORY_SECONDS,
+    max_memory_bytes=settings.HISTORY_MAX_MEMORY_BYTES,
+    max_disk_bytes=settings.HISTORY_MAX_DISK_BYTES,
+    segment_bytes=settings.HISTORY_SEGMENT_BYTES,
+    encode_workers=settings.HISTORY_ENCODE_WORKERS,
+)
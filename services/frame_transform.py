@@ -0,0 +1,85 @@
+import cv2
+import numpy as np
+from typing import NamedTuple, Optional, Tuple
+
+MEDIA_TYPES = {
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "png": "image/png",
+}
+
+_EXTENSIONS = {
+    "jpeg": ".jpg",
+    "webp": ".webp",
+    "png": ".png",
+}
+
+
+class FrameSpec(NamedTuple):
+    """Output variant of a source frame; hashable so it can key the variant cache.
+
+    crop is (x, y, w, h) as fractions of the source frame, so the same
+    request works whichever source resolution the frame came from.
+    """
+
+    width: Optional[int] = None
+    height: Optional[int] = None
+    quality: Optional[int] = None
+    format: str = "jpeg"
+    crop: Optional[Tuple[float, float, float, float]] = None
+
+
+DEFAULT_SPEC = FrameSpec()
+
+
+def output_size(
+    src_width: int,
+    src_height: int,
+    width: Optional[int],
+    height: Optional[int],
+) -> Tuple[int, int]:
+    """Fit (width, height) inside the requested box, keeping aspect, never upscaling."""
+    scale = 1.0
+    if width:
+        scale = min(scale, width / src_width)
+    if height:
+        scale = min(scale, height / src_height)
+    return max(int(round(src_width * scale)), 1), max(int(round(src_height * scale)), 1)
+
+
+def transform_and_encode(frame, spec: FrameSpec) -> bytes:
+    if spec.crop is not None:
+        h, w = frame.shape[:2]
+        x, y, cw, ch = spec.crop
+        x0, y0 = int(x * w), int(y * h)
+        x1, y1 = max(int((x + cw) * w), x0 + 1), max(int((y + ch) * h), y0 + 1)
+        frame = frame[y0:y1, x0:x1]
+
+    if spec.width or spec.height:
+        h, w = frame.shape[:2]
+        size = output_size(w, h, spec.width, spec.height)
+        if size != (w, h):
+            # area interpolation is the cheapest artefact-free downscale
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+    params = []
+    if spec.format == "jpeg" and spec.quality is not None:
+        params = [cv2.IMWRITE_JPEG_QUALITY, spec.quality]
+    elif spec.format == "webp" and spec.quality is not None:
+        params = [cv2.IMWRITE_WEBP_QUALITY, spec.quality]
+    elif spec.format == "png":
+        # favour encode speed over size; PNG is lossless either way
+        params = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+
+    ret, buf = cv2.imencode(_EXTENSIONS[spec.format], frame, params)
+    if not ret:
+        raise RuntimeError("Failed to encode frame")
+    return buf.tobytes()
+
+
+def decode(data: bytes):
+    """Decode an encoded image back into a BGR frame."""
+    frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise RuntimeError("Failed to decode frame")
+    return frame
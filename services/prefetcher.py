@@ -0,0 +1,244 @@
+import asyncio
+import functools
+import logging
+import math
+import time
+from typing import Dict, Hashable, List, Optional
+
+from core.config import settings
+from services.camera_profiles import CameraUnavailable, profile_store
+from services.frame_cache import frame_cache
+from services.frame_fingerprint import fingerprint
+from services.frame_transform import DEFAULT_SPEC, transform_and_encode
+from services.session_pool import PoolExhausted, session_pool
+
+logger = logging.getLogger(__name__)
+
+
+class _Access:
+    __slots__ = ("score", "updated_at", "rtsp_url", "host")
+
+    def __init__(self, rtsp_url: str, host: str, now: float):
+        self.score = 0.0
+        self.updated_at = now
+        self.rtsp_url = rtsp_url
+        self.host = host
+
+
+class _HostBudget:
+    """Concurrent warm sessions and a token bucket of session opens for one NVR/IP."""
+
+    def __init__(self, opens_per_minute: float, now: float):
+        self.sessions = 0
+        self.tokens = opens_per_minute
+        self.updated_at = now
+
+
+class _WarmCamera:
+    """A pinned pool session whose frames are copied into the frame cache."""
+
+    def __init__(self, key: Hashable, rtsp_url: str, host: str):
+        self.key = key
+        self.rtsp_url = rtsp_url
+        self.host = host
+        self.next_due = 0.0
+        self.session = None
+        self._on_frame = None
+
+    def start(self, loop: asyncio.AbstractEventLoop, refresh_seconds: float) -> None:
+        def on_frame(frame, ts: float) -> None:
+            # reader thread: refresh the cache often enough to never expire
+            if ts < self.next_due:
+                return
+            self.next_due = ts + refresh_seconds
+            # encode here, at the refresh rate, so requests for the warm
+            # camera are served as they are without work on the loop
+            try:
+                variants = {DEFAULT_SPEC: transform_and_encode(frame, DEFAULT_SPEC)}
+            except Exception:
+                logger.exception("Failed to encode warm frame for %s", self.key)
+                return
+            loop.call_soon_threadsafe(
+                functools.partial(
+                    frame_cache.put, self.key, frame, variants, fp=fingerprint(frame)
+                )
+            )
+
+        self.session = session_pool.hold(self.rtsp_url)
+        self.session.add_listener(on_frame)
+        self._on_frame = on_frame
+
+    def stop(self) -> None:
+        if self.session is not None:
+            self.session.remove_listener(self._on_frame)
+            # let the pool's idle timeout close it if nobody else uses it
+            session_pool.release(self.rtsp_url)
+            self.session = None
+
+
+class Prefetcher:
+    """Keeps the most requested cameras warm in the frame cache.
+
+    Every frame request bumps an exponentially decayed score for its
+    cache key. Periodically the top max_cameras keys above min_score get
+    a pinned RTSP session whose frames are pushed into the frame cache, so
+    their requests are plain cache hits. Warming is limited per host (an
+    NVR serves all its channels from one IP) by a cap on concurrent warm
+    sessions and a token bucket on session opens. Cameras whose score
+    decays below half of min_score, or that drop out of the top set, are
+    released again.
+    """
+
+    def __init__(
+        self,
+        half_life_seconds: float,
+        min_score: float,
+        max_cameras: int,
+        per_host_sessions: int,
+        opens_per_minute: float,
+        refresh_ms: int,
+        max_tracked: int,
+    ):
+        self.decay = math.log(2) / half_life_seconds
+        self.min_score = min_score
+        self.max_cameras = max_cameras
+        self.per_host_sessions = per_host_sessions
+        self.opens_per_minute = opens_per_minute
+        self.refresh_seconds = refresh_ms / 1000.0
+        self.max_tracked = max_tracked
+
+        self._access: Dict[Hashable, _Access] = {}
+        self._warm: Dict[Hashable, _WarmCamera] = {}
+        self._hosts: Dict[str, _HostBudget] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _score(self, access: _Access, now: float) -> float:
+        return access.score * math.exp(-self.decay * (now - access.updated_at))
+
+    def record(self, key: Hashable, rtsp_url: str, host: str) -> None:
+        if self._task is None:
+            return
+        now = time.monotonic()
+        access = self._access.get(key)
+        if access is None:
+            if len(self._access) >= self.max_tracked:
+                return
+            access = self._access[key] = _Access(rtsp_url, host, now)
+        access.score = self._score(access, now) + 1.0
+        access.updated_at = now
+        access.rtsp_url = rtsp_url
+
+    # ---------------------------------------------------------------
+    # per-host budget
+    # ---------------------------------------------------------------
+    def _budget(self, host: str, now: float) -> _HostBudget:
+        budget = self._hosts.get(host)
+        if budget is None:
+            budget = self._hosts[host] = _HostBudget(self.opens_per_minute, now)
+        budget.tokens = min(
+            self.opens_per_minute,
+            budget.tokens + (now - budget.updated_at) * self.opens_per_minute / 60.0,
+        )
+        budget.updated_at = now
+        return budget
+
+    def _cool(self, key: Hashable) -> None:
+        warm = self._warm.pop(key)
+        warm.stop()
+        self._hosts[warm.host].sessions -= 1
+        logger.info("Stopped prefetching %s", key)
+
+    def _heat(self, key: Hashable, access: _Access, now: float) -> None:
+        budget = self._budget(access.host, now)
+        if budget.sessions >= self.per_host_sessions or budget.tokens < 1:
+            return
+        try:
+            # known-failing cameras are not worth a session
+            profile_store.check(access.rtsp_url)
+        except CameraUnavailable:
+            return
+
+        warm = _WarmCamera(key, access.rtsp_url, access.host)
+        try:
+            warm.start(asyncio.get_running_loop(), self.refresh_seconds)
+        except PoolExhausted:
+            return
+        budget.tokens -= 1
+        budget.sessions += 1
+        self._warm[key] = warm
+        logger.info("Prefetching %s", key)
+
+    # ---------------------------------------------------------------
+    # scheduling
+    # ---------------------------------------------------------------
+    def tick(self) -> None:
+        now = time.monotonic()
+        scored = []
+        for key, access in list(self._access.items()):
+            score = self._score(access, now)
+            if score < 0.01 and key not in self._warm:
+                del self._access[key]
+                continue
+            # hysteresis: warm cameras stay until they fall to half the bar
+            bar = self.min_score / 2 if key in self._warm else self.min_score
+            if score >= bar:
+                scored.append((score, key))
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+        hot = {key for _, key in scored[:self.max_cameras]}
+
+        for key, warm in list(self._warm.items()):
+            access = self._access.get(key)
+            if key not in hot or access is None or access.rtsp_url != warm.rtsp_url:
+                self._cool(key)
+
+        for _, key in scored[:self.max_cameras]:
+            if key not in self._warm:
+                self._heat(key, self._access[key], now)
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Prefetcher tick failed")
+
+    def start(self, interval: float) -> None:
+        self._task = asyncio.ensure_future(self._run(interval))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for key in list(self._warm):
+            self._cool(key)
+
+    def stats(self) -> Dict[str, List]:
+        now = time.monotonic()
+        warm = []
+        for key, camera in self._warm.items():
+            access = self._access.get(key)
+            score = self._score(access, now) if access is not None else 0.0
+            warm.append({"key": list(key), "host": camera.host, "score": round(score, 2)})
+        return {
+            "warm": warm,
+            "tracked": len(self._access),
+            "hosts": {
+                host: budget.sessions
+                for host, budget in self._hosts.items()
+                if budget.sessions
+            },
+        }
+
+
+prefetcher = Prefetcher(
+    half_life_seconds=settings.PREFETCH_HALF_LIFE_SECONDS,
+    min_score=settings.PREFETCH_MIN_SCORE,
+    max_cameras=settings.PREFETCH_MAX_CAMERAS,
+    per_host_sessions=settings.PREFETCH_PER_HOST_SESSIONS,
+    opens_per_minute=settings.PREFETCH_OPENS_PER_MINUTE,
+    refresh_ms=settings.PREFETCH_REFRESH_MS,
+    max_tracked=settings.PREFETCH_MAX_TRACKED,
+)
@@ -0,0 +1,370 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+from core import metrics
+from core.config import settings
+from services.camera_profiles import (
+    profile_store,
+    open_capture,
+    read_first_frame,
+    CameraUnavailable,
+    GrabCancelled,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PoolExhausted(RuntimeError):
+    """Raised when the pool is at max_sessions and cannot open another one."""
+
+
+class RTSPSession:
+    """Keeps one RTSP capture open and always holds the latest decoded frame.
+
+    A daemon reader thread drains the stream continuously so that callers
+    never see buffered (old) frames, and reconnects with exponential backoff
+    when the camera drops the session.
+    """
+
+    def __init__(self, rtsp_url: str):
+        self.rtsp_url = rtsp_url
+        self.host = urlparse(rtsp_url).hostname
+        self.last_access = time.monotonic()
+        # holders pin the session against idle eviction (e.g. live streams)
+        self.holders = 0
+        # the device whose request opened the session, for stage metrics
+        self.device = metrics.current_device()
+
+        self._cond = threading.Condition()
+        self._frame = None
+        self._frame_ts = 0.0
+        self._frame_seq = 0
+        self._last_error: Optional[str] = None
+        self._listeners: List[Callable] = []
+        self._error_listeners: List[Callable] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="rtsp-reader",
+            daemon=True,
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self, join_timeout: float = 2.0) -> None:
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        self.join(join_timeout)
+
+    def join(self, timeout: float) -> None:
+        if self._thread.is_alive() and timeout > 0:
+            self._thread.join(timeout)
+
+    def add_listener(self, fn: Callable) -> None:
+        """Call fn(frame, ts) from the reader thread for every decoded frame."""
+        with self._cond:
+            self._listeners = self._listeners + [fn]
+
+    def remove_listener(self, fn: Callable) -> None:
+        with self._cond:
+            self._listeners = [f for f in self._listeners if f is not fn]
+
+    def add_error_listener(self, fn: Callable) -> None:
+        """Call fn(error) from the reader thread whenever an open fails."""
+        with self._cond:
+            self._error_listeners = self._error_listeners + [fn]
+
+    def remove_error_listener(self, fn: Callable) -> None:
+        with self._cond:
+            self._error_listeners = [
+                f for f in self._error_listeners if f is not fn
+            ]
+
+    @property
+    def closed(self) -> bool:
+        return self._stop.is_set()
+
+    def latest(
+        self,
+        timeout_seconds: float,
+        cancel_event: Optional[threading.Event] = None,
+    ):
+        """Return the most recent frame, waiting up to timeout for the first one."""
+        self.last_access = time.monotonic()
+        deadline = time.monotonic() + timeout_seconds
+        with self._cond:
+            while True:
+                if self._frame is not None:
+                    age = time.monotonic() - self._frame_ts
+                    if age <= settings.RTSP_FRAME_STALE_SECONDS:
+                        return self._frame
+
+                # nothing fresh and the camera is known bad: fail right away
+                profile_store.check(self.rtsp_url)
+
+                if cancel_event is not None and cancel_event.is_set():
+                    raise GrabCancelled("Frame wait abandoned")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stop.is_set():
+                    break
+                self._cond.wait(min(remaining, 0.25))
+
+        raise RuntimeError(
+            "No fresh frame available from RTSP stream (%s)"
+            % (self._last_error or "timed out")
+        )
+
+    def _open(self):
+        try:
+            cap = open_capture(
+                self.rtsp_url, settings.RTSP_OPEN_TIMEOUT_SECONDS, self._stop
+            )
+        except CameraUnavailable as e:
+            self._last_error = str(e)
+            return None, None, e.retry_after
+        except (RuntimeError, GrabCancelled) as e:
+            self._last_error = str(e)
+            return None, None, None
+
+        try:
+            deadline = time.monotonic() + settings.RTSP_READ_TIMEOUT_SECONDS
+            frame = read_first_frame(cap, self.rtsp_url, deadline, self._stop)
+        except (RuntimeError, GrabCancelled) as e:
+            cap.release()
+            self._last_error = str(e)
+            return None, None, None
+        return cap, frame, None
+
+    def _publish(self, frame) -> None:
+        with self._cond:
+            self._frame = frame
+            self._frame_ts = time.monotonic()
+            self._frame_seq += 1
+            self._cond.notify_all()
+            listeners = self._listeners
+
+        for fn in listeners:
+            try:
+                fn(frame, self._frame_ts)
+            except Exception:
+                logger.exception("Frame listener failed for %s", self.rtsp_url)
+
+    def _run(self) -> None:
+        metrics.set_device(self.device)
+        backoff = settings.RTSP_RECONNECT_BACKOFF_MIN_SECONDS
+
+        while not self._stop.is_set():
+            cap, frame, retry_after = self._open()
+            if cap is None:
+                wait = max(backoff, retry_after or 0)
+                logger.warning(
+                    "RTSP open failed for %s (%s), retrying in %.1fs",
+                    self.rtsp_url,
+                    self._last_error,
+                    wait,
+                )
+                with self._cond:
+                    self._cond.notify_all()
+                    listeners = self._error_listeners
+                for fn in listeners:
+                    try:
+                        fn(self._last_error)
+                    except Exception:
+                        logger.exception(
+                            "Error listener failed for %s", self.rtsp_url
+                        )
+                self._stop.wait(wait)
+                backoff = min(
+                    backoff * 2, settings.RTSP_RECONNECT_BACKOFF_MAX_SECONDS
+                )
+                continue
+
+            self._publish(frame)
+            misses = 0
+            try:
+                while not self._stop.is_set():
+                    ret, frame = cap.read()
+                    if not ret or frame is None:
+                        misses += 1
+                        if misses >= 5:
+                            self._last_error = "RTSP stream stopped delivering frames"
+                            break
+                        continue
+
+                    misses = 0
+                    backoff = settings.RTSP_RECONNECT_BACKOFF_MIN_SECONDS
+                    self._publish(frame)
+            finally:
+                cap.release()
+
+            if not self._stop.is_set():
+                logger.warning(
+                    "RTSP session for %s lost, reconnecting in %.1fs",
+                    self.rtsp_url,
+                    backoff,
+                )
+                self._stop.wait(backoff)
+                backoff = min(
+                    backoff * 2, settings.RTSP_RECONNECT_BACKOFF_MAX_SECONDS
+                )
+
+
+class SessionPool:
+    """Persistent RTSP sessions keyed by URL, with caps and idle eviction.
+
+    Besides the overall cap, at most max_sessions_per_host sessions stay
+    open against one host: an NVR serves all its channels from one IP and
+    falls over long before the pool is full.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int,
+        idle_timeout_seconds: float,
+        max_sessions_per_host: int = 0,
+    ):
+        self.max_sessions = max_sessions
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.max_sessions_per_host = max_sessions_per_host
+
+        self._sessions: Dict[str, RTSPSession] = {}
+        self._lock = threading.RLock()
+        self._reaper: Optional[threading.Thread] = None
+        self._shutdown = threading.Event()
+
+    def acquire(self, rtsp_url: str) -> RTSPSession:
+        with self._lock:
+            if self._shutdown.is_set():
+                raise PoolExhausted("Session pool is shut down")
+
+            session = self._sessions.get(rtsp_url)
+            if session is not None and not session.closed:
+                session.last_access = time.monotonic()
+                return session
+
+            if len(self._sessions) >= self.max_sessions:
+                raise PoolExhausted(
+                    "RTSP session pool is full (%d sessions)" % self.max_sessions
+                )
+
+            session = RTSPSession(rtsp_url)
+            limit = self.max_sessions_per_host
+            if limit and session.host is not None:
+                open_to_host = sum(
+                    1
+                    for s in self._sessions.values()
+                    if s.host == session.host and not s.closed
+                )
+                if open_to_host >= limit:
+                    raise PoolExhausted(
+                        "RTSP session pool has %d sessions to %s already"
+                        % (limit, session.host)
+                    )
+
+            self._sessions[rtsp_url] = session
+            session.start()
+            self._ensure_reaper()
+            return session
+
+    def hold(self, rtsp_url: str) -> RTSPSession:
+        """Acquire a session and pin it until the matching release()."""
+        with self._lock:
+            session = self.acquire(rtsp_url)
+            session.holders += 1
+            return session
+
+    def release(self, rtsp_url: str, close: bool = False) -> None:
+        """Unpin a held session; close it right away if nobody else holds it.
+
+        Callers run on the event loop, so the reader thread is only told to
+        stop, not joined; it releases the capture itself when it exits.
+        """
+        with self._lock:
+            session = self._sessions.get(rtsp_url)
+            if session is None:
+                return
+            session.holders = max(session.holders - 1, 0)
+            session.last_access = time.monotonic()
+            if not (close and session.holders == 0):
+                return
+            self._sessions.pop(rtsp_url, None)
+        session.stop(join_timeout=0)
+
+    def read_frame(
+        self,
+        rtsp_url: str,
+        timeout_seconds: float,
+        cancel_event: Optional[threading.Event] = None,
+    ):
+        # known-failing cameras must not take up a pool slot
+        profile_store.check(rtsp_url)
+        session = self.acquire(rtsp_url)
+        with metrics.stage("grab"):
+            return session.latest(timeout_seconds, cancel_event)
+
+    def close(self, rtsp_url: str) -> None:
+        with self._lock:
+            session = self._sessions.pop(rtsp_url, None)
+        if session is not None:
+            session.stop()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def shutdown(self) -> None:
+        self._shutdown.set()
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+
+        # signal every reader first so they wind down in parallel
+        for session in sessions:
+            session.stop(join_timeout=0)
+
+        deadline = time.monotonic() + 5.0
+        for session in sessions:
+            session.join(deadline - time.monotonic())
+
+        logger.info("RTSP session pool shut down (%d sessions closed)", len(sessions))
+
+    def _ensure_reaper(self) -> None:
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+        self._reaper = threading.Thread(
+            target=self._reap_loop,
+            name="rtsp-pool-reaper",
+            daemon=True,
+        )
+        self._reaper.start()
+
+    def _reap_loop(self) -> None:
+        interval = max(self.idle_timeout_seconds / 2, 1.0)
+        while not self._shutdown.wait(interval):
+            now = time.monotonic()
+            with self._lock:
+                idle = [
+                    url
+                    for url, s in self._sessions.items()
+                    if s.holders == 0
+                    and now - s.last_access > self.idle_timeout_seconds
+                ]
+                evicted = [self._sessions.pop(url) for url in idle]
+
+            for session in evicted:
+                logger.info("Evicting idle RTSP session %s", session.rtsp_url)
+                session.stop()
+
+
+session_pool = SessionPool(
+    max_sessions=settings.RTSP_POOL_MAX_SESSIONS,
+    idle_timeout_seconds=settings.RTSP_POOL_IDLE_TIMEOUT_SECONDS,
+    max_sessions_per_host=settings.RTSP_POOL_MAX_SESSIONS_PER_HOST,
+)
+metrics.add_gauge(
+    "streaming_rtsp_sessions", "Open pooled RTSP sessions", lambda: len(session_pool)
+)
@@ -0,0 +1,540 @@
+import asyncio
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+from core.config import settings
+from services.camera_profiles import CameraUnavailable, profile_store
+from services.frame_fingerprint import (
+    FINGERPRINT_SIZE,
+    difference,
+    fingerprint,
+    scene_tracker,
+)
+from services.frame_transform import DEFAULT_SPEC, transform_and_encode
+from services.session_pool import session_pool
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"SCFRAME3"
+# magic, slot count, slot data bytes, ETag epoch
+_HEADER = struct.Struct("<8sII4s")
+_HEADER_SIZE = 64
+# key digest, sequence, owner pid, heartbeat, captured_at, last_read,
+# scene generation, failed_at, failing_until, length, fingerprint
+_SLOT = struct.Struct("<16sQqdddQddI4x%ds" % FINGERPRINT_SIZE ** 2)
+_SEQ_OFFSET = 16
+_OWNER_OFFSET = 24
+_HEARTBEAT_OFFSET = 32
+_LAST_READ_OFFSET = 48
+_SCENE_OFFSET = 56
+_FAILED_AT_OFFSET = 64
+_FINGERPRINT_OFFSET = 88
+_EMPTY_KEY = bytes(16)
+_NO_FINGERPRINT = bytes(FINGERPRINT_SIZE ** 2)
+
+
+class SlotsExhausted(RuntimeError):
+    """Every shared slot is owned by a live camera; capture locally instead."""
+
+
+def _digest(key: Hashable, rtsp_url: str) -> bytes:
+    return hashlib.blake2b(repr((key, rtsp_url)).encode(), digest_size=16).digest()
+
+
+def _new_scene() -> int:
+    # unique without coordination between workers or owners
+    return int.from_bytes(os.urandom(8), "big") >> 1 or 1
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _Publisher:
+    """Owner side of one slot: pins the pooled session and writes its JPEGs."""
+
+    def __init__(self, store: "SharedFrameStore", index: int, rtsp_url: str):
+        self.store = store
+        self.index = index
+        self.rtsp_url = rtsp_url
+        self.next_due = 0.0
+        self.session = None
+        # the owner decides scene changes, so every worker hands out the
+        # same ETag for a picture
+        self.reference = None
+        self.scene = 0
+        # cleared under the claim lock when the slot is given up; the
+        # session itself is stopped after the lock is released
+        self.active = True
+
+    def start(self) -> None:
+        self.session = session_pool.hold(self.rtsp_url)
+        self.session.add_listener(self.on_frame)
+        self.session.add_error_listener(self.on_error)
+
+    def stop(self) -> None:
+        if self.session is not None:
+            self.session.remove_listener(self.on_frame)
+            self.session.remove_error_listener(self.on_error)
+            session_pool.release(self.rtsp_url, close=True)
+            self.session = None
+
+    def on_error(self, error: str) -> None:
+        # reader thread: tell the other workers right away, including
+        # whether this worker has started short-circuiting the camera
+        if self.active:
+            failing_until = profile_store.get(self.rtsp_url).failing_until
+            self.store._write_failure(self.index, failing_until)
+
+    def on_frame(self, frame, ts: float) -> None:
+        # reader thread; at a few fps the encode barely delays the next read
+        if ts < self.next_due or not self.active:
+            return
+        self.next_due = ts + self.store.interval
+        fp = fingerprint(frame)
+        if self.reference is None or (
+            difference(fp, self.reference) > scene_tracker.change_threshold
+        ):
+            self.reference = fp
+            self.scene = _new_scene()
+        jpeg = transform_and_encode(frame, DEFAULT_SPEC)
+        self.store._write(self.index, jpeg, ts, self.scene, fp.tobytes())
+
+
+class SharedFrameStore:
+    """Latest full-size JPEG per camera in shared memory, for multi-worker runs.
+
+    The first worker that needs a camera claims a slot and becomes its
+    owner: it keeps the RTSP session and publishes frames into the slot.
+    Every other worker reads the slot instead of opening the camera.
+    Writes are guarded by a seqlock (odd sequence = write in progress),
+    claims by an flock on lock_path, and owners heartbeat their slots so
+    a slot whose owner died or stalled is taken over by the next reader.
+    Owners give a slot up once nobody has read it for idle_seconds.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        slots: int,
+        slot_bytes: int,
+        lock_path: str,
+        fps: float,
+        owner_timeout_seconds: float,
+        idle_seconds: float,
+    ):
+        self.name = name
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.lock_path = lock_path
+        self.interval = 1.0 / fps
+        self.owner_timeout_seconds = owner_timeout_seconds
+        self.idle_seconds = idle_seconds
+
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        self._lock_fd: Optional[int] = None
+        # shared flock held while attached, so the last worker to detach
+        # can tell it is the last one (the kernel drops it if we crash)
+        self._users_fd: Optional[int] = None
+        self._index: Dict[bytes, int] = {}
+        self._publishers: Dict[int, _Publisher] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._shm is not None
+
+    def _slot_offset(self, index: int) -> int:
+        return _HEADER_SIZE + index * (_SLOT.size + self.slot_bytes)
+
+    # ---------------------------------------------------------------
+    # lifecycle
+    # ---------------------------------------------------------------
+    @contextlib.contextmanager
+    def _locked(self):
+        # serialises slot claims across every worker process; blocking,
+        # so only used by attach() before the worker serves requests
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    @contextlib.asynccontextmanager
+    async def _locked_async(self):
+        # same lock, polled so another worker's claim never blocks the loop.
+        # Coroutines of this process share the fd (flock would let them
+        # in together), so the guarded sections must not await.
+        while True:
+            try:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(0.002)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def attach(self) -> None:
+        self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._users_fd = os.open(
+            self.lock_path + ".users", os.O_RDWR | os.O_CREAT, 0o600
+        )
+        size = self._slot_offset(self.slots)
+
+        with self._locked():
+            fcntl.flock(self._users_fd, fcntl.LOCK_SH)
+            try:
+                shm = shared_memory.SharedMemory(self.name)
+                header = _HEADER.unpack_from(shm.buf, 0)
+                if header[:3] != (_MAGIC, self.slots, self.slot_bytes):
+                    # left over from a run with another layout
+                    shm.close()
+                    shm.unlink()
+                    raise FileNotFoundError
+            except FileNotFoundError:
+                # a new segment is already zero-filled, and touching it all
+                # here would commit every page up front
+                shm = shared_memory.SharedMemory(self.name, create=True, size=size)
+                _HEADER.pack_into(
+                    shm.buf, 0, _MAGIC, self.slots, self.slot_bytes, os.urandom(4)
+                )
+            epoch = _HEADER.unpack_from(shm.buf, 0)[3]
+            # the segment outlives any one worker: keep the resource tracker
+            # from unlinking it when this process exits. Workers spawned by
+            # one master share its tracker, so each register/unregister pair
+            # happens under the lock; interleaved, the second unregister
+            # fails in the tracker with a KeyError.
+            resource_tracker.unregister(shm._name, "shared_memory")
+
+        self._shm = shm
+        # ETags are then valid on every worker attached to this segment
+        scene_tracker.epoch = epoch.hex()
+        self._task = asyncio.ensure_future(self._maintain())
+        logger.info(
+            "Attached shared frame store %s (%d slots of %d bytes)",
+            self.name,
+            self.slots,
+            self.slot_bytes,
+        )
+
+    async def detach(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._shm is None:
+            return
+
+        async with self._locked_async():
+            stopping = [self._release(index) for index in list(self._publishers)]
+            self._index.clear()
+            self._shm.close()
+            self._shm = None
+
+            # the last worker out removes the segment
+            fcntl.flock(self._users_fd, fcntl.LOCK_UN)
+            try:
+                fcntl.flock(self._users_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                pass
+            else:
+                with contextlib.suppress(FileNotFoundError):
+                    shm = shared_memory.SharedMemory(self.name)
+                    shm.close()
+                    shm.unlink()
+                logger.info("Removed shared frame store %s", self.name)
+                fcntl.flock(self._users_fd, fcntl.LOCK_UN)
+        for publisher in stopping:
+            publisher.stop()
+        os.close(self._users_fd)
+        self._users_fd = None
+        os.close(self._lock_fd)
+        self._lock_fd = None
+
+    # ---------------------------------------------------------------
+    # slot table
+    # ---------------------------------------------------------------
+    def _read_header(self, index: int):
+        return _SLOT.unpack_from(self._shm.buf, self._slot_offset(index))
+
+    def _owner_alive(self, owner_pid: int, heartbeat: float, now: float) -> bool:
+        if not owner_pid:
+            return False
+        if now - heartbeat > self.owner_timeout_seconds:
+            return False
+        return owner_pid == os.getpid() or _pid_alive(owner_pid)
+
+    async def _claim(self, digest: bytes, rtsp_url: str) -> int:
+        """Find the slot for digest, taking it over or allocating one if needed."""
+        pid = os.getpid()
+        async with self._locked_async():
+            now = time.monotonic()
+            found = free = None
+            for index in range(self.slots):
+                key, _, owner, heartbeat, *_ = self._read_header(index)
+                if key == digest:
+                    found = index
+                    if self._owner_alive(owner, heartbeat, now):
+                        self._index[digest] = index
+                        return index
+                    break
+                if free is None and (
+                    key == _EMPTY_KEY or not self._owner_alive(owner, heartbeat, now)
+                ):
+                    free = index
+
+            index = found if found is not None else free
+            if index is None:
+                raise SlotsExhausted(
+                    "All %d shared frame slots are in use" % self.slots
+                )
+
+            offset = self._slot_offset(index)
+            if found is None:
+                # fresh slot: no frame yet, sequence restarts
+                _SLOT.pack_into(
+                    self._shm.buf,
+                    offset,
+                    digest, 0, pid, now, 0.0, now, 0, 0.0, 0.0, 0, _NO_FINGERPRINT,
+                )
+            else:
+                # take over from a dead owner, keeping its last frame but
+                # not its failures
+                struct.pack_into(
+                    "<qd", self._shm.buf, offset + _OWNER_OFFSET, pid, now
+                )
+                struct.pack_into(
+                    "<dd", self._shm.buf, offset + _FAILED_AT_OFFSET, 0.0, 0.0
+                )
+                logger.warning(
+                    "Took over shared frame slot %d for %s", index, rtsp_url
+                )
+
+            publisher = _Publisher(self, index, rtsp_url)
+            try:
+                publisher.start()
+            except Exception:
+                self._clear(index)
+                raise
+            self._publishers[index] = publisher
+            self._index[digest] = index
+            return index
+
+    def _clear(self, index: int) -> None:
+        _SLOT.pack_into(
+            self._shm.buf,
+            self._slot_offset(index),
+            _EMPTY_KEY, 0, 0, 0.0, 0.0, 0.0, 0, 0.0, 0.0, 0, _NO_FINGERPRINT,
+        )
+
+    def _release(self, index: int) -> _Publisher:
+        """Give up an owned slot; the caller stops the returned publisher
+        once the claim lock is released."""
+        publisher = self._publishers.pop(index)
+        publisher.active = False
+        _, _, owner, *_ = self._read_header(index)
+        if owner == os.getpid():
+            self._clear(index)
+        return publisher
+
+    def _owned(self, offset: int) -> bool:
+        # the slot may have been given up or taken over since the reader
+        # thread got its frame
+        owner = struct.unpack_from("<q", self._shm.buf, offset + _OWNER_OFFSET)[0]
+        return owner == os.getpid()
+
+    def _write(
+        self,
+        index: int,
+        jpeg: bytes,
+        captured_at: float,
+        scene: int,
+        fp: bytes,
+    ) -> None:
+        if len(jpeg) > self.slot_bytes:
+            logger.warning(
+                "Frame of %d bytes does not fit shared slot %d", len(jpeg), index
+            )
+            return
+        buf = self._shm.buf
+        offset = self._slot_offset(index)
+        if not self._owned(offset):
+            return
+        seq = struct.unpack_from("<Q", buf, offset + _SEQ_OFFSET)[0]
+        # odd sequence tells readers a write is in progress
+        struct.pack_into("<Q", buf, offset + _SEQ_OFFSET, seq + 1)
+        data = offset + _SLOT.size
+        buf[data:data + len(jpeg)] = jpeg
+        struct.pack_into(
+            "<dd", buf, offset + _HEARTBEAT_OFFSET, time.monotonic(), captured_at
+        )
+        # a frame clears the failure state
+        struct.pack_into(
+            "<QddI", buf, offset + _SCENE_OFFSET, scene, 0.0, 0.0, len(jpeg)
+        )
+        buf[offset + _FINGERPRINT_OFFSET:offset + _SLOT.size] = fp
+        struct.pack_into("<Q", buf, offset + _SEQ_OFFSET, seq + 2)
+
+    def _write_failure(self, index: int, failing_until: float) -> None:
+        offset = self._slot_offset(index)
+        if self._owned(offset):
+            struct.pack_into(
+                "<dd",
+                self._shm.buf,
+                offset + _FAILED_AT_OFFSET,
+                time.monotonic(),
+                failing_until,
+            )
+
+    def _read(
+        self,
+        index: int,
+        digest: bytes,
+    ) -> Optional[Tuple[int, float, int, bytes, bytes]]:
+        """(sequence, captured_at, scene, fingerprint, jpeg) of a consistent
+        slot snapshot."""
+        buf = self._shm.buf
+        offset = self._slot_offset(index)
+        struct.pack_into("<d", buf, offset + _LAST_READ_OFFSET, time.monotonic())
+        for _ in range(8):
+            key, seq, _, _, captured_at, _, scene, _, _, length, fp = (
+                _SLOT.unpack_from(buf, offset)
+            )
+            if key != digest or seq == 0:
+                return None
+            if seq & 1:
+                continue
+            data = offset + _SLOT.size
+            # one copy out of the slot; the sequence check below needs it
+            jpeg = bytes(buf[data:data + length])
+            if struct.unpack_from("<Q", buf, offset + _SEQ_OFFSET)[0] == seq:
+                return seq, captured_at, scene, fp, jpeg
+        return None
+
+    # ---------------------------------------------------------------
+    # frames
+    # ---------------------------------------------------------------
+    async def read_frame(
+        self,
+        key: Hashable,
+        rtsp_url: str,
+        timeout_seconds: float,
+    ):
+        """Return (None, variants, scene generation, fingerprint) for key.
+
+        The slot's JPEG is served as the full-size variant; the frame cache
+        decodes it only when another variant is asked for. Raises
+        CameraUnavailable while the owner short-circuits the camera, and
+        RuntimeError as soon as the owner failed to open it and has no
+        fresh frame.
+        """
+        digest = _digest(key, rtsp_url)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout_seconds
+
+        index = self._index.get(digest)
+        while True:
+            now = time.monotonic()
+            if index is not None:
+                slot_key, _, owner, heartbeat, *_ = self._read_header(index)
+                if slot_key != digest or not self._owner_alive(owner, heartbeat, now):
+                    index = None
+            if index is None:
+                index = await self._claim(digest, rtsp_url)
+
+            snapshot = self._read(index, digest)
+            failed_at, failing_until = struct.unpack_from(
+                "<dd", self._shm.buf, self._slot_offset(index) + _FAILED_AT_OFFSET
+            )
+            if failing_until > now:
+                remaining = failing_until - now
+                raise CameraUnavailable(
+                    "Camera is failing, next attempt in %.0fs" % remaining,
+                    retry_after=max(int(remaining), 1),
+                )
+            if snapshot is not None:
+                _, captured_at, scene, fp, jpeg = snapshot
+                if now - captured_at <= settings.RTSP_FRAME_STALE_SECONDS:
+                    fp = np.frombuffer(fp, np.uint8).reshape(
+                        FINGERPRINT_SIZE, FINGERPRINT_SIZE
+                    )
+                    return None, {DEFAULT_SPEC: jpeg}, scene, fp
+            if failed_at:
+                # the owner's last open failed and nothing fresh came since
+                raise RuntimeError(
+                    "No fresh frame available from RTSP stream "
+                    "(the owning worker could not open it)"
+                )
+
+            if loop.time() >= deadline:
+                raise RuntimeError("No shared frame published for %s" % rtsp_url)
+            await asyncio.sleep(min(self.interval / 2, 0.05))
+
+    async def _maintain(self) -> None:
+        period = self.owner_timeout_seconds / 3
+        while True:
+            await asyncio.sleep(period)
+            try:
+                stopping = []
+                async with self._locked_async():
+                    now = time.monotonic()
+                    for index in list(self._publishers):
+                        _, _, owner, _, _, last_read, *_ = self._read_header(index)
+                        if owner != os.getpid() or now - last_read > self.idle_seconds:
+                            # idle, or declared dead while stalled and taken
+                            # over (then the slot is left alone)
+                            stopping.append(self._release(index))
+                        else:
+                            struct.pack_into(
+                                "<d",
+                                self._shm.buf,
+                                self._slot_offset(index) + _HEARTBEAT_OFFSET,
+                                now,
+                            )
+                for publisher in stopping:
+                    publisher.stop()
+            except Exception:
+                logger.exception("Shared frame store maintenance failed")
+
+    def stats(self) -> Dict[str, int]:
+        if self._shm is None:
+            return {"enabled": 0}
+        now = time.monotonic()
+        used = 0
+        for index in range(self.slots):
+            _, _, owner, heartbeat, *_ = self._read_header(index)
+            used += self._owner_alive(owner, heartbeat, now)
+        return {
+            "enabled": 1,
+            "slots": self.slots,
+            "slots_in_use": used,
+            "owned_here": len(self._publishers),
+        }
+
+
+shared_frames = SharedFrameStore(
+    name=settings.SHARED_FRAMES_NAME,
+    slots=settings.SHARED_FRAMES_SLOTS,
+    slot_bytes=settings.SHARED_FRAMES_SLOT_BYTES,
+    lock_path=settings.SHARED_FRAMES_LOCK_PATH,
+    fps=settings.SHARED_FRAMES_FPS,
+    owner_timeout_seconds=settings.SHARED_FRAMES_OWNER_TIMEOUT_SECONDS,
+    idle_seconds=settings.SHARED_FRAMES_IDLE_SECONDS,
+)
@@ -0,0 +1,78 @@
+import math
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from services.frame_transform import FrameSpec
+
+
+class StreamProfile(NamedTuple):
+    """One RTSP stream (main/sub/third...) offered by a camera or NVR channel."""
+
+    name: str
+    rtsp_url: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+    @property
+    def area(self) -> float:
+        if not self.width or not self.height:
+            return math.inf
+        return self.width * self.height
+
+
+def parse_stream_profiles(entry: Dict[str, Any]) -> List[StreamProfile]:
+    """Read the profiles of a camera meta_data dict or an NVR channel entry.
+
+    Accepts the original single ``rtsp_url`` and/or a ``profiles`` list of
+    ``{"name", "rtsp_url", "width", "height"}``. Returned smallest first.
+    """
+    profiles: List[StreamProfile] = []
+    for p in entry.get("profiles") or []:
+        if not isinstance(p, dict) or not p.get("rtsp_url"):
+            continue
+        width, height = p.get("width"), p.get("height")
+        profiles.append(
+            StreamProfile(
+                name=str(p.get("name") or "profile%d" % len(profiles)),
+                rtsp_url=p["rtsp_url"],
+                width=width if isinstance(width, int) and width > 0 else None,
+                height=height if isinstance(height, int) and height > 0 else None,
+            )
+        )
+
+    rtsp_url = entry.get("rtsp_url")
+    if rtsp_url and all(p.rtsp_url != rtsp_url for p in profiles):
+        names = {p.name for p in profiles}
+        profiles.append(
+            StreamProfile(name="main" if "main" not in names else "default", rtsp_url=rtsp_url)
+        )
+
+    profiles.sort(key=lambda p: p.area)
+    return profiles
+
+
+def _satisfies(profile: StreamProfile, spec: FrameSpec) -> bool:
+    if profile.area == math.inf:
+        return True
+    crop_w, crop_h = (spec.crop[2], spec.crop[3]) if spec.crop else (1.0, 1.0)
+    ratios = []
+    if spec.width:
+        ratios.append(spec.width / (profile.width * crop_w))
+    if spec.height:
+        ratios.append(spec.height / (profile.height * crop_h))
+    # output is fitted inside the box, so the tightest side decides
+    return min(ratios) <= 1.0
+
+
+def select_profiles(
+    profiles: List[StreamProfile],
+    spec: FrameSpec,
+) -> List[StreamProfile]:
+    """Order profiles by preference for spec: the cheapest that is big enough
+    first, then larger ones, then smaller ones as a degraded last resort."""
+    if not spec.width and not spec.height:
+        # full resolution wanted: biggest stream first
+        return list(reversed(profiles))
+
+    big_enough = [p for p in profiles if _satisfies(p, spec)]
+    too_small = [p for p in reversed(profiles) if not _satisfies(p, spec)]
+    return big_enough + too_small
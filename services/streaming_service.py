@@ -1,39 +1,258 @@
 import asyncio
 import base64
-import cv2
+import contextvars
 import logging
-from typing import Optional
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlparse
+
+from core import metrics
+from core.config import settings
+from services.session_pool import session_pool, PoolExhausted
+from services.camera_profiles import open_capture, read_first_frame
+from services.frame_transform import DEFAULT_SPEC, transform_and_encode
 
 logger = logging.getLogger(__name__)
 
 
-def _grab_frame_blocking(rtsp_url: str, timeout_seconds: int = 10):
-    cap = cv2.VideoCapture(rtsp_url)
-    if not cap.isOpened():
-        cap.release()
-        raise RuntimeError("Unable to open RTSP stream")
-
-    # try to read several frames to allow stream warmup
-    for _ in range(5):
-        ret, frame = cap.read()
-        if ret and frame is not None:
-            break
-    else:
+class CaptureRejected(RuntimeError):
+    """Raised when the capture scheduler is saturated; retry after retry_after."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CaptureScheduler:
+    """Runs blocking RTSP work on its own bounded thread pool.
+
+    Work is admitted through a per-host semaphore (NVRs fall over when too
+    many sessions hit one IP) and then a global slot semaphore sized to the
+    pool, so queued work waits here where it is visible and bounded instead
+    of piling up inside the executor. When the wait queue is full, or a
+    slot does not free up within the queue timeout, callers are rejected
+    straight away with a Retry-After hint.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        per_host_limit: int,
+        max_queue: int,
+        queue_timeout_seconds: float,
+    ):
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.max_queue = max_queue
+        self.queue_timeout_seconds = queue_timeout_seconds
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots = asyncio.Semaphore(max_workers)
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._host_users: Dict[str, int] = {}
+
+        self.waiting = 0
+        self.running = 0
+        self.rejected = 0
+        self._wait_times = deque(maxlen=1024)
+        self._run_times = deque(maxlen=1024)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="capture",
+            )
+        return self._executor
+
+    def _retry_after(self) -> int:
+        if self._run_times:
+            avg_run = sum(self._run_times) / len(self._run_times)
+        else:
+            avg_run = 1.0
+        backlog = (self.waiting + self.running) / self.max_workers
+        return max(1, math.ceil(avg_run * max(backlog, 1)))
+
+    def _reject(self, message: str):
+        self.rejected += 1
+        metrics.count_failure("capture_rejected")
+        raise CaptureRejected(message, self._retry_after())
+
+    async def run(self, host: Optional[str], fn: Callable[..., Any], *args) -> Any:
+        if self.waiting >= self.max_queue:
+            self._reject("Capture queue is full")
+
+        host = host or ""
+        host_sem = self._host_semaphores.get(host)
+        if host_sem is None:
+            host_sem = asyncio.Semaphore(self.per_host_limit)
+            self._host_semaphores[host] = host_sem
+        self._host_users[host] = self._host_users.get(host, 0) + 1
+
+        acquired = []
+
+        def release() -> None:
+            for sem in acquired:
+                sem.release()
+            self._host_users[host] -= 1
+            if not self._host_users[host]:
+                del self._host_users[host]
+                del self._host_semaphores[host]
+
+        queued_at = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(host_sem.acquire(), self.queue_timeout_seconds)
+            acquired.append(host_sem)
+            remaining = queued_at + self.queue_timeout_seconds - time.monotonic()
+            await asyncio.wait_for(self._slots.acquire(), max(remaining, 0))
+            acquired.append(self._slots)
+        except asyncio.TimeoutError:
+            release()
+            self._reject("Timed out waiting for a capture slot")
+        except BaseException:
+            release()
+            raise
+        finally:
+            self.waiting -= 1
+
+        started_at = time.monotonic()
+        self._wait_times.append(started_at - queued_at)
+        metrics.observe_stage("queue_wait", started_at - queued_at)
+        self.running += 1
+        loop = asyncio.get_running_loop()
+
+        def on_done(_) -> None:
+            self.running -= 1
+            self._run_times.append(time.monotonic() - started_at)
+            release()
+
+        # slots are only freed once the worker thread is really done, even
+        # if the caller stops waiting, so the pool never gets oversubscribed
+        def notify(f) -> None:
+            try:
+                loop.call_soon_threadsafe(on_done, f)
+            except RuntimeError:
+                # event loop already closed during shutdown
+                pass
+
+        def timed() -> Any:
+            with metrics.stage("capture"):
+                return fn(*args)
+
+        # run in a copy of the request context so stages timed on the
+        # worker thread are attributed to the same device and request
+        cf = self.executor.submit(contextvars.copy_context().run, timed)
+        cf.add_done_callback(notify)
+        return await asyncio.wrap_future(cf)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._wait_times)
+
+        def pct(p: float) -> float:
+            if not waits:
+                return 0.0
+            idx = min(int(len(waits) * p), len(waits) - 1)
+            return round(waits[idx] * 1000, 2)
+
+        return {
+            "max_workers": self.max_workers,
+            "per_host_limit": self.per_host_limit,
+            "max_queue": self.max_queue,
+            "queue_depth": self.waiting,
+            "running": self.running,
+            "rejected": self.rejected,
+            "busy_hosts": len(self._host_semaphores),
+            "wait_ms_p50": pct(0.50),
+            "wait_ms_p95": pct(0.95),
+            "wait_ms_max": round(waits[-1] * 1000, 2) if waits else 0.0,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+capture_scheduler = CaptureScheduler(
+    max_workers=settings.CAPTURE_MAX_WORKERS,
+    per_host_limit=settings.CAPTURE_PER_HOST_LIMIT,
+    max_queue=settings.CAPTURE_MAX_QUEUE,
+    queue_timeout_seconds=settings.CAPTURE_QUEUE_TIMEOUT_SECONDS,
+)
+metrics.add_gauge(
+    "streaming_capture_queue_depth",
+    "Captures waiting for a scheduler slot",
+    lambda: capture_scheduler.waiting,
+)
+metrics.add_gauge(
+    "streaming_capture_running",
+    "Captures running on the scheduler pool",
+    lambda: capture_scheduler.running,
+)
+
+
+def rtsp_host(rtsp_url: str) -> Optional[str]:
+    return urlparse(rtsp_url).hostname
+
+
+def _grab_raw_frame_blocking(
+    rtsp_url: str,
+    timeout_seconds: float = 10,
+    cancel_event: Optional[threading.Event] = None,
+):
+    deadline = time.monotonic() + timeout_seconds
+    cap = open_capture(rtsp_url, timeout_seconds, cancel_event)
+    try:
+        # read through the stream warmup
+        return read_first_frame(cap, rtsp_url, deadline, cancel_event)
+    finally:
         cap.release()
-        raise RuntimeError("Failed to read frame from RTSP stream")
 
-    # encode as JPEG
-    ret2, buf = cv2.imencode('.jpg', frame)
-    cap.release()
-    if not ret2:
-        raise RuntimeError("Failed to encode frame")
-    return buf.tobytes()
+
+def _read_frame_pooled(
+    rtsp_url: str,
+    timeout_seconds: float = 10,
+    cancel_event: Optional[threading.Event] = None,
+):
+    # serve the latest frame of a persistent session; fall back to a
+    # one-shot capture when the pool has no room for another session
+    try:
+        return session_pool.read_frame(rtsp_url, timeout_seconds, cancel_event)
+    except PoolExhausted as e:
+        # still bounded per host by the capture scheduler
+        logger.warning("%s, using one-shot grab", e)
+        return _grab_raw_frame_blocking(rtsp_url, timeout_seconds, cancel_event)
+
+
+def _grab_frame_blocking(
+    rtsp_url: str,
+    timeout_seconds: float = 10,
+    cancel_event: Optional[threading.Event] = None,
+):
+    frame = _grab_raw_frame_blocking(rtsp_url, timeout_seconds, cancel_event)
+    return transform_and_encode(frame, DEFAULT_SPEC)
+
+
+def _grab_frame_pooled(
+    rtsp_url: str,
+    timeout_seconds: float = 10,
+    cancel_event: Optional[threading.Event] = None,
+):
+    frame = _read_frame_pooled(rtsp_url, timeout_seconds, cancel_event)
+    return transform_and_encode(frame, DEFAULT_SPEC)
 
 
 async def grab_frame_base64(rtsp_url: str) -> str:
-    loop = asyncio.get_running_loop()
     try:
-        jpeg_bytes = await loop.run_in_executor(None, _grab_frame_blocking, rtsp_url)
+        jpeg_bytes = await capture_scheduler.run(
+            rtsp_host(rtsp_url), _grab_frame_pooled, rtsp_url
+        )
     except Exception as e:
         logger.exception("Error grabbing frame from %s: %s", rtsp_url, e)
         raise
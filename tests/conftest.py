@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+from fastapi import FastAPI
+
+import api.stream as stream_api
+from core.config import settings
+from models.streaming_device import DeviceType
+from services.device_registry import DeviceRecord, device_registry
+from services.frame_cache import FrameCache
+from services.frame_fingerprint import SceneTracker
+from services.streaming_service import CaptureScheduler
+
+
+@pytest.fixture
+def frame():
+    """A small noisy BGR frame; noise keeps JPEG sizes realistic."""
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+
+
+def camera_record(device_id, fingerprint="fp1", **meta):
+    return DeviceRecord(
+        device_id=device_id,
+        device_type=DeviceType.camera,
+        ip="10.0.0.1",
+        port=554,
+        username=None,
+        password=None,
+        meta_data=meta or {"rtsp_url": "rtsp://10.0.0.1/%s" % device_id},
+        fingerprint=fingerprint,
+    )
+
+
+def nvr_record(device_id, channels, fingerprint="fp1"):
+    return DeviceRecord(
+        device_id=device_id,
+        device_type=DeviceType.nvr,
+        ip="10.0.0.2",
+        port=554,
+        username=None,
+        password=None,
+        meta_data=channels,
+        fingerprint=fingerprint,
+    )
+
+
+class MemorySource:
+    """Device source backed by a dict, counting the lookups that reach it."""
+
+    def __init__(self, records=()):
+        self.records = {r.device_id: r for r in records}
+        self.fetches = []
+
+    async def fetch(self, device_ids=None, limit=None):
+        ids = list(self.records) if device_ids is None else list(device_ids)
+        self.fetches.append(ids)
+        return [self.records[i] for i in ids if i in self.records]
+
+    async def fetch_fingerprints(self):
+        return {i: r.fingerprint for i, r in self.records.items()}
+
+
+class FakeCamera:
+    """Stands in for the pooled RTSP read; returns whatever frame is set."""
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.reads = 0
+
+    def __call__(self, rtsp_url, timeout_seconds, cancel_event=None):
+        self.reads += 1
+        return self.frame
+
+
+@pytest.fixture
+def memory_source(monkeypatch):
+    source = MemorySource()
+    monkeypatch.setattr(device_registry, "source", source)
+    device_registry.invalidate()
+    yield source
+    device_registry.invalidate()
+
+
+@pytest.fixture
+def stream_app(monkeypatch, memory_source):
+    """The stream router with a fresh cache and scheduler per test."""
+    tracker = SceneTracker(
+        change_threshold=settings.FRAME_CHANGE_THRESHOLD, max_keys=64
+    )
+    cache = FrameCache(
+        ttl_seconds=settings.FRAME_CACHE_TTL_MS / 1000.0,
+        max_entries=64,
+        max_bytes=64 * 1024 * 1024,
+        max_variants=4,
+        scene_tracker=tracker,
+    )
+    scheduler = CaptureScheduler(
+        max_workers=4, per_host_limit=2, max_queue=16, queue_timeout_seconds=5
+    )
+    monkeypatch.setattr(stream_api, "scene_tracker", tracker)
+    monkeypatch.setattr(stream_api, "frame_cache", cache)
+    monkeypatch.setattr(stream_api, "capture_scheduler", scheduler)
+
+    app = FastAPI()
+    app.include_router(stream_api.router)
+    yield app
+    scheduler.shutdown()
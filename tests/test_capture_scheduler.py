@@ -0,0 +1,125 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+import api.stream as stream_api
+from conftest import FakeCamera, camera_record
+from services.session_pool import PoolExhausted, RTSPSession, SessionPool
+from services.streaming_service import CaptureRejected, CaptureScheduler
+
+
+def _scheduler(**kw):
+    kw.setdefault("max_workers", 2)
+    kw.setdefault("per_host_limit", 2)
+    kw.setdefault("max_queue", 8)
+    kw.setdefault("queue_timeout_seconds", 5)
+    return CaptureScheduler(**kw)
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def main():
+        scheduler = _scheduler(max_workers=1, max_queue=1)
+        release = threading.Event()
+        try:
+            running = asyncio.ensure_future(scheduler.run("a", release.wait))
+            await asyncio.sleep(0.05)
+            queued = asyncio.ensure_future(scheduler.run("b", lambda: "queued"))
+            await asyncio.sleep(0.05)
+            assert scheduler.running == 1
+            assert scheduler.waiting == 1
+
+            with pytest.raises(CaptureRejected) as rejected:
+                await scheduler.run("c", lambda: None)
+            assert rejected.value.retry_after >= 1
+            assert scheduler.rejected == 1
+
+            release.set()
+            assert await queued == "queued"
+            await running
+        finally:
+            release.set()
+            scheduler.shutdown()
+
+    asyncio.run(main())
+
+
+def test_slot_wait_times_out_with_retry_after():
+    async def main():
+        scheduler = _scheduler(max_workers=1, queue_timeout_seconds=0.1)
+        release = threading.Event()
+        try:
+            running = asyncio.ensure_future(scheduler.run("a", release.wait))
+            await asyncio.sleep(0.05)
+            with pytest.raises(CaptureRejected) as rejected:
+                await scheduler.run("b", lambda: None)
+            assert rejected.value.retry_after >= 1
+            assert scheduler.waiting == 0
+        finally:
+            release.set()
+            await running
+            scheduler.shutdown()
+
+    asyncio.run(main())
+
+
+def test_per_host_limit_leaves_other_hosts_running():
+    async def main():
+        scheduler = _scheduler(max_workers=4, per_host_limit=1)
+        release = threading.Event()
+        try:
+            first = asyncio.ensure_future(scheduler.run("nvr", release.wait))
+            second = asyncio.ensure_future(scheduler.run("nvr", release.wait))
+            await asyncio.sleep(0.05)
+            # the second capture of the NVR waits; another host does not
+            assert scheduler.running == 1
+            assert scheduler.waiting == 1
+            assert await scheduler.run("camera", lambda: "done") == "done"
+
+            release.set()
+            await asyncio.gather(first, second)
+            assert scheduler.stats()["busy_hosts"] == 0
+        finally:
+            release.set()
+            scheduler.shutdown()
+
+    asyncio.run(main())
+
+
+def test_frame_answers_503_with_retry_after(monkeypatch, stream_app, memory_source):
+    memory_source.records["cam1"] = camera_record("cam1")
+    monkeypatch.setattr(stream_api, "_read_frame_pooled", FakeCamera(None))
+    monkeypatch.setattr(stream_api, "capture_scheduler", _scheduler(max_queue=0))
+
+    async def main():
+        async with httpx.AsyncClient(app=stream_app, base_url="http://t") as c:
+            r = await c.post(
+                "/api/v1/stream/frame",
+                json={"device_id": "cam1", "device_type": "camera"},
+            )
+            assert r.status_code == 503
+            assert int(r.headers["retry-after"]) >= 1
+
+    asyncio.run(main())
+
+
+def test_session_pool_caps_sessions_per_host(monkeypatch):
+    monkeypatch.setattr(RTSPSession, "start", lambda self: None)
+    pool = SessionPool(
+        max_sessions=10, idle_timeout_seconds=60, max_sessions_per_host=2
+    )
+    try:
+        pool.acquire("rtsp://10.0.0.1/ch1")
+        pool.acquire("rtsp://10.0.0.1/ch2")
+        # an open session is reused, not counted again
+        pool.acquire("rtsp://10.0.0.1/ch1")
+        with pytest.raises(PoolExhausted):
+            pool.acquire("rtsp://10.0.0.1/ch3")
+        pool.acquire("rtsp://10.0.0.2/ch1")
+
+        pool.close("rtsp://10.0.0.1/ch2")
+        pool.acquire("rtsp://10.0.0.1/ch3")
+        assert len(pool) == 3
+    finally:
+        pool.shutdown()
@@ -0,0 +1,356 @@
+import asyncio
+import json
+import re
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy.exc import DBAPIError
+
+import services.device_io as device_io
+from api.devices import router as devices_router
+from core.config import settings
+from models.streaming_device import DeviceType, StreamingDevice
+from services.device_io import (
+    DeviceRowError,
+    export_devices,
+    import_devices,
+    parse_csv,
+    parse_ndjson,
+    validate_device,
+)
+
+
+def camera(device_id, **fields):
+    row = {
+        "device_id": device_id,
+        "device_type": "camera",
+        "ip": "10.0.0.1",
+        "port": 554,
+        "meta_data": {"rtsp_url": "rtsp://10.0.0.1/%s" % device_id},
+    }
+    row.update(fields)
+    return row
+
+
+async def chunked(data: bytes, size=7):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def collect(rows):
+    return [row async for row in rows]
+
+
+class FakeDatabase:
+    """Replaces _write: records batches, failing rows whose ip is 'bad'."""
+
+    def __init__(self):
+        self.writes = []
+
+    async def __call__(self, rows):
+        if any(row["ip"] == "bad" for row in rows):
+            raise DBAPIError("INSERT", {}, Exception("value rejected"))
+        self.writes.append([row["device_id"] for row in rows])
+
+
+@pytest.fixture
+def database(monkeypatch):
+    db = FakeDatabase()
+    monkeypatch.setattr(device_io, "_write", db)
+    monkeypatch.setattr(settings, "DEVICE_IMPORT_BATCH_SIZE", 3)
+    return db
+
+
+# -------------------------------------------------------------------
+# validation
+# -------------------------------------------------------------------
+def test_valid_rows_become_column_values():
+    values = validate_device(camera("cam1", port="8554", ip=""))
+    assert values["device_type"] == DeviceType.camera
+    assert values["port"] == 8554
+    assert values["ip"] is None
+    # credentials are only set when the row has them
+    assert "username" not in values
+    assert validate_device(camera("cam1", username="admin"))["username"] == "admin"
+    assert validate_device(camera("cam1", meta_data=None))["meta_data"] is None
+
+    nvr = validate_device(
+        {
+            "device_id": "nvr1",
+            "device_type": "nvr",
+            "meta_data": [
+                {"camera_id": "c1", "rtsp_url": "rtsp://nvr/1"},
+                {
+                    "camera_id": "c2",
+                    "profiles": [{"name": "sub", "rtsp_url": "rtsp://nvr/2s"}],
+                    "history": "sub",
+                },
+            ],
+        }
+    )
+    assert nvr["device_type"] == DeviceType.nvr
+
+
+@pytest.mark.parametrize(
+    "row, error",
+    [
+        ("not an object", "row must be an object"),
+        (camera("cam1", extra=1), "unknown fields: extra"),
+        (camera(""), "device_id is required"),
+        (camera("cam1", device_type="dvr"), "device_type"),
+        (camera("cam1", port=70000), "port must be"),
+        (camera("cam1", port=True), "port must be"),
+        (camera("cam1", meta_data={}), "needs an rtsp_url or a profiles list"),
+        (
+            camera("cam1", meta_data={"profiles": [{"rtsp_url": "r", "width": 0}]}),
+            "meta_data.profiles[0].width must be a positive integer",
+        ),
+        (
+            camera("cam1", meta_data={"rtsp_url": "r", "history": "sub"}),
+            "unknown profile 'sub'",
+        ),
+        (
+            {"device_id": "nvr1", "device_type": "nvr", "meta_data": {"cameras": []}},
+            "non-empty list",
+        ),
+        (
+            {
+                "device_id": "nvr1",
+                "device_type": "nvr",
+                "meta_data": [
+                    {"camera_id": "c1", "rtsp_url": "r1"},
+                    {"camera_id": "c1", "rtsp_url": "r2"},
+                ],
+            },
+            "meta_data[1].camera_id 'c1' is not unique",
+        ),
+    ],
+)
+def test_invalid_rows_are_rejected(row, error):
+    with pytest.raises(DeviceRowError, match=re.escape(error)):
+        validate_device(row)
+
+
+# -------------------------------------------------------------------
+# parsing
+# -------------------------------------------------------------------
+def test_ndjson_is_parsed_across_chunks_with_line_numbers():
+    body = "\n".join(
+        [json.dumps(camera("cam1")), "", "{broken", json.dumps(camera("cam2"))]
+    ).encode()
+    rows = asyncio.run(collect(parse_ndjson(chunked(body))))
+
+    assert [line for line, _ in rows] == [1, 3, 4]
+    assert rows[0][1]["device_id"] == "cam1"
+    assert isinstance(rows[1][1], DeviceRowError)
+    assert rows[2][1]["device_id"] == "cam2"
+
+
+def test_csv_fields_may_span_lines():
+    body = (
+        "device_id,device_type,meta_data\r\n"
+        'cam1,camera,"{""rtsp_url"":\n ""rtsp://x""}"\r\n'
+        "cam2,camera\r\n"
+        "cam3,camera,\r\n"
+    ).encode()
+    rows = asyncio.run(collect(parse_csv(chunked(body))))
+
+    assert rows[0] == (2, {"device_id": "cam1", "device_type": "camera", "meta_data": {"rtsp_url": "rtsp://x"}})
+    assert rows[1][0] == 4
+    assert str(rows[1][1]) == "expected 3 fields, got 2"
+    assert rows[2] == (5, {"device_id": "cam3", "device_type": "camera", "meta_data": None})
+
+
+def test_csv_with_unknown_header_stops_the_import(database):
+    body = b"device_id,colour\ncam1,red\n"
+    result = asyncio.run(import_devices(parse_csv(chunked(body))))
+    assert result.received == 0
+    assert "CSV header" in result.error
+    assert database.writes == []
+
+
+# -------------------------------------------------------------------
+# import counting
+# -------------------------------------------------------------------
+def _ndjson(*rows):
+    return "\n".join(r if isinstance(r, str) else json.dumps(r) for r in rows).encode()
+
+
+def test_import_counts_and_batches(database):
+    body = _ndjson(
+        camera("cam1"),
+        "{broken",
+        camera("cam2", port=0),
+        camera("cam3"),
+        camera("cam4"),
+        camera("cam5"),
+    )
+    result = asyncio.run(import_devices(parse_ndjson(chunked(body)))).as_dict()
+
+    assert result["received"] == 6
+    assert result["imported"] == 4
+    assert result["failed"] == 2
+    assert [e["line"] for e in result["errors"]] == [2, 3]
+    assert result["errors"][1]["device_id"] == "cam2"
+    assert database.writes == [["cam1", "cam3", "cam4"], ["cam5"]]
+
+
+def test_duplicate_rows_are_written_once_and_counted_each(database):
+    body = _ndjson(camera("cam1"), camera("cam1", port=8554), camera("cam2"))
+    result = asyncio.run(import_devices(parse_ndjson(chunked(body))))
+
+    assert result.imported == 3
+    assert result.failed == 0
+    assert database.writes == [["cam1", "cam2"]]
+
+
+def test_rejected_rows_fail_with_every_row_they_replaced(database):
+    body = _ndjson(
+        camera("cam1"),
+        camera("cam2"),
+        camera("cam2", ip="bad"),
+    )
+    result = asyncio.run(import_devices(parse_ndjson(chunked(body))))
+
+    # the batch fails, then each device is retried on its own
+    assert database.writes == [["cam1"]]
+    assert result.imported == 1
+    assert result.failed == 2
+    assert [(e["line"], e["device_id"]) for e in result.errors] == [
+        (2, "cam2"),
+        (3, "cam2"),
+    ]
+    assert "value rejected" in result.errors[0]["error"]
+
+
+def test_dry_run_writes_nothing(database):
+    body = _ndjson(camera("cam1"), camera("cam2", port=0))
+    result = asyncio.run(import_devices(parse_ndjson(chunked(body)), dry_run=True))
+    assert (result.imported, result.failed) == (1, 1)
+    assert database.writes == []
+
+
+# -------------------------------------------------------------------
+# export
+# -------------------------------------------------------------------
+class FakeExportSession:
+    def __init__(self, devices):
+        self.devices = devices
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def stream_scalars(self, stmt):
+        return self
+
+    async def partitions(self):
+        yield self.devices
+
+    def expunge_all(self):
+        pass
+
+
+DEVICES = [
+    StreamingDevice(
+        device_id="cam1",
+        device_type=DeviceType.camera,
+        ip="10.0.0.1",
+        port=554,
+        username="admin",
+        password="secret, with comma",
+        meta_data={"rtsp_url": "rtsp://10.0.0.1/1", "history": True},
+    ),
+    StreamingDevice(
+        device_id="cam2",
+        device_type=DeviceType.camera,
+        ip=None,
+        port=None,
+        username=None,
+        password=None,
+        meta_data=None,
+    ),
+    StreamingDevice(
+        device_id="nvr1",
+        device_type=DeviceType.nvr,
+        ip="10.0.0.2",
+        port=None,
+        username=None,
+        password=None,
+        meta_data=[{"camera_id": "c1", "rtsp_url": "rtsp://10.0.0.2/1"}],
+    ),
+]
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    monkeypatch.setattr(device_io, "async_session", lambda: FakeExportSession(DEVICES))
+
+
+async def _export(fmt, include_credentials=False):
+    return b"".join([chunk async for chunk in export_devices(fmt, include_credentials)])
+
+
+@pytest.mark.parametrize("fmt", ["csv", "ndjson"])
+def test_export_round_trips_through_import(monkeypatch, stored, fmt):
+    written = []
+
+    async def write(rows):
+        written.extend(rows)
+
+    monkeypatch.setattr(device_io, "_write", write)
+
+    async def main():
+        body = await _export(fmt, include_credentials=True)
+        return await import_devices(device_io.PARSERS[fmt](chunked(body)))
+
+    result = asyncio.run(main())
+    assert (result.imported, result.failed) == (3, 0)
+    assert written == [
+        validate_device(device_io._export_row(device)) for device in DEVICES
+    ]
+    assert written[1]["meta_data"] is None
+
+
+def test_csv_export_writes_empty_cells_for_null(stored):
+    lines = asyncio.run(_export("csv")).decode().splitlines()
+    assert lines[0] == "device_id,device_type,ip,port,meta_data"
+    assert lines[2] == "cam2,camera,,,"
+
+
+def test_credentials_are_only_exported_on_request(stored):
+    body = asyncio.run(_export("ndjson")).decode()
+    assert "secret" not in body
+    assert "username" not in json.loads(body.splitlines()[0])
+
+    body = asyncio.run(_export("ndjson", include_credentials=True)).decode()
+    assert json.loads(body.splitlines()[0])["password"] == "secret, with comma"
+
+
+# -------------------------------------------------------------------
+# endpoint
+# -------------------------------------------------------------------
+def test_import_endpoint_picks_the_format(database):
+    app = FastAPI()
+    app.include_router(devices_router)
+
+    async def main():
+        async with httpx.AsyncClient(app=app, base_url="http://t") as c:
+            r = await c.post(
+                "/api/v1/devices/import",
+                content=b"device_id,device_type,meta_data\ncam1,camera,\n",
+                headers={"Content-Type": "text/csv"},
+            )
+            assert r.status_code == 200
+            assert r.json()["imported"] == 1
+
+            r = await c.post("/api/v1/devices/import?format=csv", content=b"x,y\n1,2\n")
+            assert r.status_code == 400
+
+            r = await c.post("/api/v1/devices/import?format=xml", content=b"")
+            assert r.status_code == 400
+
+    asyncio.run(main())
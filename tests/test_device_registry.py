@@ -0,0 +1,125 @@
+import asyncio
+
+from conftest import MemorySource, camera_record, nvr_record
+from services.device_registry import DeviceRegistry
+
+
+def _registry(*records, max_devices=100):
+    source = MemorySource(records)
+    registry = DeviceRegistry(
+        source=source,
+        max_devices=max_devices,
+        refresh_interval_seconds=60,
+        negative_ttl_seconds=60,
+    )
+    return registry, source
+
+
+def test_concurrent_lookups_share_one_fetch():
+    async def main():
+        registry, source = _registry(camera_record("cam1"))
+        records = await asyncio.gather(*[registry.get("cam1") for _ in range(5)])
+        assert all(r is records[0] for r in records)
+        assert source.fetches == [["cam1"]]
+
+        assert await registry.get("cam1") is records[0]
+        assert len(source.fetches) == 1
+
+    asyncio.run(main())
+
+
+def test_unknown_devices_are_negatively_cached():
+    async def main():
+        registry, source = _registry()
+        assert await registry.get("nope") is None
+        assert await registry.get("nope") is None
+        assert len(source.fetches) == 1
+
+        # a refresh that sees the id in the table forgets the miss
+        source.records["nope"] = camera_record("nope")
+        await registry.refresh()
+        assert (await registry.get("nope")).device_id == "nope"
+
+    asyncio.run(main())
+
+
+def test_refresh_reloads_only_changed_rows():
+    async def main():
+        registry, source = _registry(
+            camera_record("cam1"), camera_record("cam2"), camera_record("cam3")
+        )
+        await registry.load()
+        old = registry.peek("cam2")
+        source.fetches.clear()
+
+        source.records["cam2"] = camera_record("cam2", fingerprint="fp2")
+        del source.records["cam3"]
+        await registry.refresh()
+
+        assert source.fetches == [["cam2"]]
+        assert registry.peek("cam2") is not old
+        assert registry.peek("cam2").fingerprint == "fp2"
+        assert registry.peek("cam3") is None
+        assert len(registry) == 2
+
+        await registry.refresh()
+        assert len(source.fetches) == 1
+
+    asyncio.run(main())
+
+
+def test_invalidate_drops_devices_until_the_next_lookup():
+    async def main():
+        registry, source = _registry(camera_record("cam1"), camera_record("cam2"))
+        await registry.load()
+
+        registry.invalidate(["cam1"])
+        assert registry.peek("cam1") is None
+        assert registry.peek("cam2") is not None
+        assert (await registry.get("cam1")).device_id == "cam1"
+        assert source.fetches[-1] == ["cam1"]
+
+        registry.invalidate()
+        assert len(registry) == 0
+
+    asyncio.run(main())
+
+
+def test_registry_is_bounded_lru():
+    async def main():
+        registry, _ = _registry(
+            *[camera_record("cam%d" % i) for i in range(3)], max_devices=2
+        )
+        await registry.get("cam0")
+        await registry.get("cam1")
+        await registry.get("cam0")
+        await registry.get("cam2")
+        assert [r.device_id for r in registry.records()] == ["cam0", "cam2"]
+
+    asyncio.run(main())
+
+
+def test_nvr_channels_are_indexed_by_camera_id():
+    record = nvr_record(
+        "nvr1",
+        [
+            {"camera_id": "c1", "rtsp_url": "rtsp://nvr/1", "history": True},
+            {"camera_id": "c1", "rtsp_url": "rtsp://nvr/dup"},
+            {
+                "camera_id": "c2",
+                "profiles": [
+                    {"name": "main", "rtsp_url": "rtsp://nvr/2m", "width": 1920, "height": 1080},
+                    {"name": "sub", "rtsp_url": "rtsp://nvr/2s", "width": 640, "height": 360},
+                ],
+                "history": "sub",
+            },
+            {"camera_id": "c3"},
+            "not-a-channel",
+        ],
+    )
+    assert record.camera_ids == ["c1", "c2"]
+    # first entry wins for duplicate camera ids
+    assert [p.rtsp_url for p in record.profiles["c1"]] == ["rtsp://nvr/1"]
+    assert [p.name for p in record.profiles["c2"]] == ["sub", "main"]
+    assert record.history["c1"].rtsp_url == "rtsp://nvr/1"
+    assert record.history["c2"].name == "sub"
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from services.frame_cache import FrameCache
+
+
+def _cache(ttl_seconds=10.0):
+    return FrameCache(
+        ttl_seconds=ttl_seconds,
+        max_entries=16,
+        max_bytes=64 * 1024 * 1024,
+        max_variants=4,
+    )
+
+
+class SlowGrab:
+    def __init__(self, frame, delay=0.05):
+        self.frame = frame
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.frame
+
+
+def test_concurrent_misses_share_one_grab(frame):
+    async def main():
+        cache = _cache()
+        grab = SlowGrab(frame)
+        entries = await asyncio.gather(
+            *[cache.get_or_grab("cam", grab) for _ in range(10)]
+        )
+        assert grab.calls == 1
+        assert all(e is entries[0] for e in entries)
+        assert not cache._inflight
+
+    asyncio.run(main())
+
+
+def test_failed_grab_reaches_every_waiter_and_is_not_cached(frame):
+    async def main():
+        cache = _cache()
+        calls = 0
+
+        async def failing():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            raise RuntimeError("no frame")
+
+        results = await asyncio.gather(
+            *[cache.get_or_grab("cam", failing) for _ in range(3)],
+            return_exceptions=True,
+        )
+        assert calls == 1
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+        grab = SlowGrab(frame, 0)
+        entry = await cache.get_or_grab("cam", grab)
+        assert grab.calls == 1
+        assert cache.get("cam", cache.ttl_seconds) is entry
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_does_not_cancel_shared_grab(frame):
+    async def main():
+        cache = _cache()
+        grab = SlowGrab(frame, 0.1)
+        first = asyncio.ensure_future(cache.get_or_grab("cam", grab))
+        second = asyncio.ensure_future(cache.get_or_grab("cam", grab))
+        await asyncio.sleep(0.01)
+        first.cancel()
+
+        entry = await second
+        assert entry is not None
+        assert grab.calls == 1
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    asyncio.run(main())
+
+
+def test_entries_expire_after_ttl(frame):
+    async def main():
+        cache = _cache(ttl_seconds=0.05)
+        grab = SlowGrab(frame, 0)
+        first = await cache.get_or_grab("cam", grab)
+        assert await cache.get_or_grab("cam", grab) is first
+        assert grab.calls == 1
+
+        await asyncio.sleep(0.1)
+        assert cache.get("cam", cache.ttl_seconds) is None
+        assert "cam" not in cache._entries
+
+        second = await cache.get_or_grab("cam", grab)
+        assert second is not first
+        assert grab.calls == 2
+
+    asyncio.run(main())
+
+
+def test_max_age_forces_a_fresh_grab(frame):
+    async def main():
+        cache = _cache()
+        grab = SlowGrab(frame, 0)
+        first = await cache.get_or_grab("cam", grab)
+        await asyncio.sleep(0.02)
+        second = await cache.get_or_grab("cam", grab, max_age_ms=10)
+        assert second is not first
+        assert grab.calls == 2
+
+    asyncio.run(main())
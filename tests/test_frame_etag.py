@@ -0,0 +1,124 @@
+import asyncio
+import time
+
+import httpx
+import numpy as np
+import pytest
+
+import api.stream as stream_api
+from conftest import FakeCamera, camera_record
+
+DARK = np.full((120, 160, 3), 40, dtype=np.uint8)
+BRIGHT = np.full((120, 160, 3), 220, dtype=np.uint8)
+
+
+@pytest.fixture
+def camera(monkeypatch, memory_source):
+    memory_source.records["cam1"] = camera_record("cam1")
+    fake = FakeCamera(DARK)
+    monkeypatch.setattr(stream_api, "_read_frame_pooled", fake)
+    return fake
+
+
+def _frame(client, headers=None, **body):
+    body.setdefault("device_id", "cam1")
+    body.setdefault("device_type", "camera")
+    return client.post("/api/v1/stream/frame", json=body, headers=headers or {})
+
+
+def test_unchanged_scene_gets_304(stream_app, camera):
+    async def main():
+        async with httpx.AsyncClient(app=stream_app, base_url="http://t") as c:
+            r = await _frame(c)
+            assert r.status_code == 200
+            etag = r.headers["etag"]
+            assert etag.startswith('W/"')
+
+            r = await _frame(c, {"If-None-Match": etag}, max_age_ms=0)
+            assert r.status_code == 304
+            assert r.headers["etag"] == etag
+            assert r.content == b""
+            assert camera.reads == 2
+
+            camera.frame = BRIGHT
+            r = await _frame(c, {"If-None-Match": etag}, max_age_ms=0)
+            assert r.status_code == 200
+            assert r.headers["etag"] != etag
+            assert r.content[:2] == b"\xff\xd8"
+
+    asyncio.run(main())
+
+
+def test_etag_is_per_representation(stream_app, camera):
+    async def main():
+        async with httpx.AsyncClient(app=stream_app, base_url="http://t") as c:
+            etag = (await _frame(c)).headers["etag"]
+
+            r = await _frame(c, {"If-None-Match": etag}, width=80)
+            assert r.status_code == 200
+            r = await _frame(c, {"If-None-Match": etag}, response_format="base64")
+            assert r.status_code == 200
+            assert r.json()["device_id"] == "cam1"
+
+    asyncio.run(main())
+
+
+def test_long_poll_times_out_with_304(stream_app, camera):
+    async def main():
+        async with httpx.AsyncClient(app=stream_app, base_url="http://t") as c:
+            etag = (await _frame(c)).headers["etag"]
+
+            started = time.monotonic()
+            r = await _frame(
+                c,
+                {"If-None-Match": etag},
+                wait_for_change=True,
+                wait_timeout_ms=300,
+            )
+            assert r.status_code == 304
+            assert time.monotonic() - started >= 0.3
+
+    asyncio.run(main())
+
+
+def test_long_poll_returns_once_the_scene_changes(stream_app, camera):
+    async def main():
+        async with httpx.AsyncClient(app=stream_app, base_url="http://t") as c:
+            etag = (await _frame(c)).headers["etag"]
+
+            async def change():
+                await asyncio.sleep(0.2)
+                camera.frame = BRIGHT
+
+            started = time.monotonic()
+            r, _ = await asyncio.gather(
+                _frame(
+                    c,
+                    {"If-None-Match": etag},
+                    wait_for_change=True,
+                    wait_timeout_ms=5000,
+                ),
+                change(),
+            )
+            assert r.status_code == 200
+            assert r.headers["etag"] != etag
+            assert time.monotonic() - started < 4
+
+    asyncio.run(main())
+
+
+def test_change_threshold_is_per_request(stream_app, camera):
+    async def main():
+        async with httpx.AsyncClient(app=stream_app, base_url="http://t") as c:
+            etag = (await _frame(c)).headers["etag"]
+            # below the global threshold, above the client's own
+            camera.frame = DARK + 1
+
+            r = await _frame(c, {"If-None-Match": etag}, max_age_ms=0)
+            assert r.status_code == 304
+            r = await _frame(
+                c, {"If-None-Match": etag}, max_age_ms=0, change_threshold=0.5
+            )
+            assert r.status_code == 200
+
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+import pytest
+
+from services.frame_history import CameraHistory, FrameHistory
+
+KEY = ("cam1", None)
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = FrameHistory(
+        directory=str(tmp_path),
+        fps=2,
+        quality=80,
+        memory_seconds=2.0,
+        max_memory_bytes=64 * 1024 * 1024,
+        max_disk_bytes=3 * 256 * 1024,
+        segment_bytes=256 * 1024,
+        encode_workers=1,
+    )
+    yield history
+    for segment in history._segments:
+        segment.close()
+
+
+def _record(history, frame, times, key=KEY):
+    """Record frame at each of times, as the encode workers would."""
+    camera = history._cameras.get(key)
+    if camera is None:
+        camera = history._cameras[key] = CameraHistory(key, "rtsp://cam/1")
+    for ts in times:
+        history._record(camera, frame, ts)
+    return camera
+
+
+def _times(frames):
+    return [ts for ts, _ in frames.frames]
+
+
+def test_recent_frames_stay_in_memory_older_ones_spill(history, frame):
+    camera = _record(history, frame, [100.0 + i * 0.5 for i in range(10)])
+
+    # the last memory_seconds stay in memory, the rest went to a segment
+    assert [ts for ts, _ in camera.memory] == [102.5, 103.0, 103.5, 104.0, 104.5]
+    assert camera.segments[0].times == [100.0, 100.5, 101.0, 101.5, 102.0]
+    assert history.stats()["cameras"] == 1
+
+
+def test_nearest_finds_memory_and_spilled_frames(history, frame):
+    _record(history, frame, [100.0 + i * 0.5 for i in range(10)])
+
+    for at, expected in [(100.1, 100.0), (101.3, 101.5), (103.9, 104.0)]:
+        frames = history.nearest(KEY, at)
+        assert _times(frames) == [expected]
+        assert bytes(frames.frames[0][1][:2]) == b"\xff\xd8"
+        frames.release()
+
+    assert all(not s.pins for s in history._segments)
+
+
+def test_nearest_rejects_times_outside_the_retained_window(history, frame):
+    _record(history, frame, [100.0 + i * 0.5 for i in range(10)])
+
+    # two recording intervals of slack either side
+    assert history.nearest(KEY, 99.1) is not None
+    assert history.nearest(KEY, 98.9) is None
+    assert history.nearest(KEY, 105.4) is not None
+    assert history.nearest(KEY, 105.6) is None
+    assert history.nearest(KEY, 0.0) is None
+    assert history.nearest(("other", None), 100.0) is None
+
+
+def test_between_returns_frames_in_order_up_to_limit(history, frame):
+    _record(history, frame, [100.0 + i * 0.5 for i in range(10)])
+
+    frames = history.between(KEY, 101.0, 103.0, limit=100)
+    assert _times(frames) == [101.0, 101.5, 102.0, 102.5, 103.0]
+    frames.release()
+
+    frames = history.between(KEY, 100.0, 105.0, limit=3)
+    assert _times(frames) == [100.0, 100.5, 101.0]
+    frames.release()
+
+    assert _times(history.between(KEY, 200.0, 300.0, limit=10)) == []
+
+
+def test_pinned_segments_are_not_recycled(history, frame):
+    camera = _record(history, frame, [100.0 + i * 0.5 for i in range(10)])
+    frames = history.between(KEY, 100.0, 100.0, limit=1)
+    oldest = camera.segments[0]
+    assert oldest.pins == 1
+
+    # fill the disk budget so a segment has to be recycled
+    _record(history, frame, [105.0 + i * 0.5 for i in range(400)])
+    assert len(history._segments) == history.max_segments
+    assert oldest in camera.segments
+    assert oldest.times[0] == 100.0
+
+    frames.release()
+    _record(history, frame, [305.0 + i * 0.5 for i in range(200)])
+    assert oldest.times[0] != 100.0
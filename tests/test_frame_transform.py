@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from services.frame_cache import FrameCache
+from services.frame_transform import (
+    DEFAULT_SPEC,
+    FrameSpec,
+    decode,
+    output_size,
+    transform_and_encode,
+)
+
+
+@pytest.mark.parametrize(
+    "box, expected",
+    [
+        ((None, None), (1920, 1080)),
+        ((640, None), (640, 360)),
+        ((None, 360), (640, 360)),
+        ((640, 100), (178, 100)),
+        ((3840, None), (1920, 1080)),
+    ],
+)
+def test_output_fits_the_box_without_upscaling(box, expected):
+    assert output_size(1920, 1080, *box) == expected
+
+
+def test_transform_resizes_crops_and_encodes(frame):
+    image = decode(transform_and_encode(frame, FrameSpec(width=80)))
+    assert image.shape == (60, 80, 3)
+
+    crop = FrameSpec(crop=(0.5, 0.5, 0.5, 0.5), format="png")
+    data = transform_and_encode(frame, crop)
+    assert data[:4] == b"\x89PNG"
+    assert (decode(data) == frame[60:, 80:]).all()
+
+
+def test_decode_rejects_garbage():
+    with pytest.raises(RuntimeError):
+        decode(b"not an image")
+
+
+def test_cache_drops_the_raw_frame_once_the_full_jpeg_exists(frame):
+    async def main():
+        cache = FrameCache(
+            ttl_seconds=10, max_entries=4, max_bytes=64 * 1024 * 1024, max_variants=2
+        )
+        entry = cache.put("cam", frame)
+        assert entry.nbytes == cache._bytes == frame.nbytes
+
+        await cache.encode(entry, FrameSpec(width=40))
+        assert entry.frame is not None
+
+        await cache.encode(entry, DEFAULT_SPEC)
+        assert entry.frame is None
+
+        # later variants are made from the full-size JPEG, which is kept
+        thumb = await cache.encode(entry, FrameSpec(width=20))
+        assert decode(thumb).shape == (15, 20, 3)
+        assert DEFAULT_SPEC in entry.variants
+        assert len(entry.variants) == 2
+        assert entry.nbytes == cache._bytes == sum(map(len, entry.variants.values()))
+
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+from services.frame_transform import FrameSpec
+from services.stream_profiles import (
+    StreamProfile,
+    parse_stream_profiles,
+    select_profiles,
+)
+
+MAIN = {"name": "main", "rtsp_url": "rtsp://cam/main", "width": 1920, "height": 1080}
+SUB = {"name": "sub", "rtsp_url": "rtsp://cam/sub", "width": 640, "height": 360}
+
+
+def _names(profiles):
+    return [p.name for p in profiles]
+
+
+def test_plain_rtsp_url_is_one_main_profile():
+    assert parse_stream_profiles({"rtsp_url": "rtsp://cam/1"}) == [
+        StreamProfile(name="main", rtsp_url="rtsp://cam/1")
+    ]
+
+
+def test_profiles_are_sorted_smallest_first():
+    profiles = parse_stream_profiles({"profiles": [MAIN, SUB]})
+    assert _names(profiles) == ["sub", "main"]
+    assert profiles[0].area == 640 * 360
+
+
+def test_rtsp_url_is_merged_with_profiles():
+    # same URL as a listed profile: not added twice
+    profiles = parse_stream_profiles({"rtsp_url": MAIN["rtsp_url"], "profiles": [MAIN, SUB]})
+    assert _names(profiles) == ["sub", "main"]
+
+    # different URL: added, and sorted last since its size is unknown
+    profiles = parse_stream_profiles({"rtsp_url": "rtsp://cam/other", "profiles": [MAIN, SUB]})
+    assert _names(profiles) == ["sub", "main", "default"]
+
+
+def test_invalid_profile_entries_are_skipped():
+    profiles = parse_stream_profiles(
+        {
+            "profiles": [
+                "rtsp://cam/not-a-dict",
+                {"name": "nourl"},
+                {"rtsp_url": "rtsp://cam/x", "width": -1, "height": "360"},
+            ]
+        }
+    )
+    assert profiles == [StreamProfile(name="profile0", rtsp_url="rtsp://cam/x")]
+
+
+def test_full_resolution_prefers_the_biggest_stream():
+    profiles = parse_stream_profiles({"profiles": [MAIN, SUB]})
+    assert _names(select_profiles(profiles, FrameSpec())) == ["main", "sub"]
+
+
+def test_thumbnail_prefers_the_cheapest_stream_big_enough():
+    profiles = parse_stream_profiles({"profiles": [MAIN, SUB]})
+    assert _names(select_profiles(profiles, FrameSpec(width=320))) == ["sub", "main"]
+    assert _names(select_profiles(profiles, FrameSpec(height=360))) == ["sub", "main"]
+    assert _names(select_profiles(profiles, FrameSpec(width=1280))) == ["main", "sub"]
+
+
+def test_too_small_streams_are_the_last_resort():
+    profiles = parse_stream_profiles({"profiles": [MAIN, SUB]})
+    assert _names(select_profiles(profiles, FrameSpec(width=3840))) == ["main", "sub"]
+
+
+def test_crop_needs_a_bigger_source():
+    profiles = parse_stream_profiles({"profiles": [MAIN, SUB]})
+    # a quarter-width crop of the sub stream is only 160 px wide
+    spec = FrameSpec(width=320, crop=(0.0, 0.0, 0.25, 0.25))
+    assert _names(select_profiles(profiles, spec)) == ["main", "sub"]
+
+
+def test_stream_of_unknown_size_is_always_big_enough():
+    profiles = parse_stream_profiles({"rtsp_url": "rtsp://cam/other", "profiles": [SUB]})
+    assert _names(select_profiles(profiles, FrameSpec(width=1280))) == ["main", "sub"]